@@ -0,0 +1,145 @@
+"""
+Benchmark the markdown chunker against the previous character-based implementation.
+
+Generates a large documentation-style markdown page (headings, prose, lists and fenced
+code blocks, some of them containing blank lines and '#' comments) and reports throughput,
+chunk count, the spread of chunk sizes in tokens, and how many chunks start or end inside
+a fenced code block.
+
+Usage:
+    uv run python benchmarks/bench_chunking.py --megabytes 4
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from markdown_parser import BLOCK_FENCE, parse_markdown
+from page_processing import count_tokens, smart_chunk_markdown
+
+WORDS = (
+    "crawler browser markdown chunk embedding vector index query source page request response "
+    "session context document section example install configure deploy server client token"
+).split()
+
+
+def legacy_smart_chunk_markdown(text: str, chunk_size: int = 5000) -> List[str]:
+    """The character-based chunker this benchmark compares against."""
+    chunks = []
+    start = 0
+    text_length = len(text)
+    while start < text_length:
+        end = start + chunk_size
+        if end >= text_length:
+            chunks.append(text[start:].strip())
+            break
+        chunk = text[start:end]
+        code_block = chunk.rfind('```')
+        if code_block != -1 and code_block > chunk_size * 0.3:
+            end = start + code_block
+        elif '\n\n' in chunk:
+            last_break = chunk.rfind('\n\n')
+            if last_break > chunk_size * 0.3:
+                end = start + last_break
+        elif '. ' in chunk:
+            last_period = chunk.rfind('. ')
+            if last_period > chunk_size * 0.3:
+                end = start + last_period + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+
+def generate_markdown(target_bytes: int, seed: int = 11) -> str:
+    """Generate a documentation-style markdown page of roughly target_bytes characters."""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < target_bytes:
+        kind = rng.random()
+        if kind < 0.1:
+            part = "#" * rng.randint(1, 3) + " " + " ".join(rng.choice(WORDS) for _ in range(4)).title()
+        elif kind < 0.3:
+            lines = [f"result_{i} = client.{rng.choice(WORDS)}(retries={i})" for i in range(rng.randint(3, 80))]
+            if rng.random() < 0.3:
+                lines.insert(len(lines) // 2, "\n# configure the " + rng.choice(WORDS))
+            part = "```python\n" + "\n".join(lines) + "\n```"
+        elif kind < 0.4:
+            part = "\n".join(f"- {' '.join(rng.choice(WORDS) for _ in range(8))}" for _ in range(rng.randint(2, 8)))
+        else:
+            part = " ".join(
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20))).capitalize() + "."
+                for _ in range(rng.randint(2, 10))
+            )
+        parts.append(part)
+        size += len(part) + 2
+    return "\n\n".join(parts)
+
+
+def fence_breaks(text: str, chunks: List[str]) -> int:
+    """Count chunks that start or end strictly inside a fenced code block."""
+    fences = [(block.start, block.end) for block in parse_markdown(text).blocks if block.kind == BLOCK_FENCE]
+    breaks = 0
+    search_from = 0
+    for chunk in chunks:
+        start = text.find(chunk, search_from)
+        if start < 0:
+            continue
+        end = start + len(chunk)
+        search_from = start + 1
+        breaks += any(fence_start < start < fence_end or fence_start < end < fence_end for fence_start, fence_end in fences)
+    return breaks
+
+
+def measure(name: str, chunker: Callable[[str, int], List[str]], text: str, chunk_size: int, repeat: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = chunker(text, chunk_size)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    return {
+        "chunker": name,
+        "seconds": round(best, 4),
+        "megabytes_per_second": round(len(text) / best / 1_000_000, 2),
+        "chunks": len(chunks),
+        "tokens_mean": round(statistics.mean(tokens), 1),
+        "tokens_stdev": round(statistics.pstdev(tokens), 1),
+        "tokens_max": max(tokens),
+        "chunks_breaking_fences": fence_breaks(text, chunks)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=4, help="Size of the generated page")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Chunk size in characters")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per chunker (best time is reported)")
+    args = parser.parse_args()
+
+    text = generate_markdown(int(args.megabytes * 1_000_000))
+    results = [
+        measure("legacy", legacy_smart_chunk_markdown, text, args.chunk_size, args.repeat),
+        measure("token_aware", smart_chunk_markdown, text, args.chunk_size, args.repeat)
+    ]
+    for result in results:
+        print(
+            f"{result['chunker']:>12}: {result['megabytes_per_second']} MB/s, {result['chunks']} chunks, "
+            f"{result['tokens_mean']} ± {result['tokens_stdev']} tokens (max {result['tokens_max']}), "
+            f"{result['chunks_breaking_fences']} fence breaks",
+            file=sys.stderr
+        )
+    print(json.dumps({"benchmark": "chunking", "page_characters": len(text), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
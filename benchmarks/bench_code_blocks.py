@@ -0,0 +1,160 @@
+"""
+Fuzz and benchmark code block extraction against the previous '```' pairing implementation.
+
+Fuzzing generates pages full of the cases that broke the pairing scan (inline triple
+backticks, ~~~ fences, longer fences wrapping ``` lines, indented and unterminated fences,
+closing lines with trailing text) and checks the extracted blocks against a straightforward
+line-by-line CommonMark fence scanner. The benchmark then times extraction on a large
+generated page, reading only the context the code summary prompt uses: the pairing scan,
+the full structural parse (used when a page is chunked anyway) and the fence-only scan.
+
+Usage:
+    uv run python benchmarks/bench_code_blocks.py --fuzz 2000 --megabytes 4
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_chunking import generate_markdown
+from bench_page_processing import legacy_extract_code_blocks
+from markdown_parser import parse_markdown, scan_code_blocks
+
+_OPENER_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})(.*)$')
+_CLOSER_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})[ \t]*$')
+
+WORDS = "fetch crawl store query index chunk page source embed rank".split()
+
+
+def reference_code_blocks(text: str, min_length: int = 1000) -> List[Tuple[str, str]]:
+    """Line-by-line CommonMark fence scanner: (code, language) of each top-level fenced block."""
+    blocks = []
+    fence = None
+    for line in text.split('\n'):
+        if fence is None:
+            match = _OPENER_RE.match(line)
+            if match and not (match.group(1)[0] == '`' and '`' in match.group(2)):
+                info = match.group(2).split()
+                fence = (match.group(1), info[0] if info else "", [])
+        else:
+            match = _CLOSER_RE.match(line)
+            if match and match.group(1)[0] == fence[0][0] and len(match.group(1)) >= len(fence[0]):
+                blocks.append(("\n".join(fence[2]).strip(), fence[1]))
+                fence = None
+            else:
+                fence[2].append(line)
+    if fence is not None:
+        blocks.append(("\n".join(fence[2]).strip(), fence[1]))
+    return [(code, language) for code, language in blocks if len(code) >= min_length]
+
+
+def generate_fuzz_page(rng: random.Random) -> str:
+    """Generate a short page mixing prose, headings and fences with their tricky variants."""
+    parts = []
+    for _ in range(rng.randint(1, 25)):
+        kind = rng.random()
+        if kind < 0.45:
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+            if rng.random() < 0.3:
+                sentence += rng.choice([" use ```inline``` code", " a ``` b", "\n``` not closed `here`"])
+            parts.append(sentence)
+        elif kind < 0.55:
+            parts.append("#" * rng.randint(1, 4) + " " + rng.choice(WORDS))
+        else:
+            marker = rng.choice(["```", "~~~", "````", "~~~~~"])
+            indent = " " * rng.choice([0, 0, 1, 3, 4])
+            lines = [f"{rng.choice(WORDS)}({i})" for i in range(rng.randint(0, 40))]
+            if rng.random() < 0.3:
+                lines.insert(len(lines) // 2, rng.choice(["```", "~~~", "", "# comment", "``` trailing", "  ```  "]))
+            closer = rng.choice([marker, marker, marker + "  ", marker + "`", marker + " x", marker[:3], ""])
+            parts.append(f"{indent}{marker}{rng.choice(['', 'python', ' js extra'])}\n" + "\n".join(lines) + f"\n{closer}")
+    return rng.choice(["\n\n", "\n"]).join(parts)
+
+
+def fuzz(pages: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    mismatches = 0
+    scan_mismatches = 0
+    legacy_mismatches = 0
+    for _ in range(pages):
+        text = generate_fuzz_page(rng)
+        min_length = rng.choice([1, 20, 200])
+        expected = reference_code_blocks(text, min_length)
+        got = [(block.code, block.language) for block in parse_markdown(text).code_blocks(min_length=min_length)]
+        scanned = [(block.code, block.language) for block in scan_code_blocks(text, min_length=min_length)]
+        legacy = [(block['code'], block['language']) for block in legacy_extract_code_blocks(text, min_length)]
+        if got != expected:
+            mismatches += 1
+            if mismatches == 1:
+                print(f"First mismatch:\n{text!r}\nexpected {expected!r}\ngot {got!r}", file=sys.stderr)
+        if scanned != expected:
+            scan_mismatches += 1
+            if scan_mismatches == 1:
+                print(f"First scan mismatch:\n{text!r}\nexpected {expected!r}\ngot {scanned!r}", file=sys.stderr)
+        legacy_mismatches += legacy != expected
+    return {"pages": pages, "mismatches": mismatches, "scan_mismatches": scan_mismatches,
+            "legacy_mismatches": legacy_mismatches}
+
+
+def summary_inputs(block: Any) -> int:
+    """Read what the code summary prompt reads: the code and 500 characters of context on each side."""
+    if isinstance(block, dict):
+        return len(block['code']) + len(block['context_before'][-500:]) + len(block['context_after'][:500])
+    return len(block.code) + len(block.context_before[-500:]) + len(block.context_after[:500])
+
+
+def measure(name: str, extract, markdown: str, repeat: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        blocks = extract(markdown)
+        for block in blocks:
+            summary_inputs(block)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "extractor": name,
+        "seconds": round(best, 4),
+        "megabytes_per_second": round(len(markdown) / best / 1_000_000, 2),
+        "code_blocks": len(blocks)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=2000, help="Number of fuzzed pages to check")
+    parser.add_argument("--seed", type=int, default=7, help="Fuzzing seed")
+    parser.add_argument("--megabytes", type=float, default=4, help="Size of the generated benchmark page")
+    parser.add_argument("--min-length", type=int, default=200, help="Minimum code length for the benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per extractor (best time is reported)")
+    args = parser.parse_args()
+
+    fuzz_result = fuzz(args.fuzz, args.seed)
+    print(f"fuzz: {fuzz_result['mismatches']} parser and {fuzz_result['scan_mismatches']} scanner mismatches "
+          f"in {fuzz_result['pages']} pages "
+          f"(previous extractor: {fuzz_result['legacy_mismatches']})", file=sys.stderr)
+
+    markdown = generate_markdown(int(args.megabytes * 1_000_000))
+    results = [
+        measure("pairing", lambda text: legacy_extract_code_blocks(text, args.min_length), markdown, args.repeat),
+        measure("full_parse", lambda text: parse_markdown(text).code_blocks(min_length=args.min_length), markdown, args.repeat),
+        measure("fence_scan", lambda text: scan_code_blocks(text, min_length=args.min_length), markdown, args.repeat)
+    ]
+    for result in results:
+        print(f"{result['extractor']:>14}: {result['megabytes_per_second']} MB/s, {result['code_blocks']} code blocks",
+              file=sys.stderr)
+    print(json.dumps({"benchmark": "code_blocks", "fuzz": fuzz_result, "page_characters": len(markdown),
+                      "results": results}, indent=2))
+    if fuzz_result["mismatches"] or fuzz_result["scan_mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
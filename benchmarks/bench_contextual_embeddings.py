@@ -0,0 +1,149 @@
+"""
+Benchmark contextual-embedding generation: one call per chunk against document-level batches.
+
+Runs both strategies against an in-process stub of the chat completions API, so no API key
+is needed. The stub charges latency per prompt token, models provider-side prompt caching
+(a prompt prefix of at least 1024 tokens that was already sent is billed and processed at a
+discount) and answers batched requests with one context per chunk id.
+
+Usage:
+    uv run python benchmarks/bench_contextual_embeddings.py --documents 5 --chunks-per-document 40
+"""
+import argparse
+import concurrent.futures
+import json
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import utils
+from bench_chunking import generate_markdown
+from page_processing import count_tokens, smart_chunk_markdown
+
+CACHE_MIN_TOKENS = 1024
+CACHED_TOKEN_COST = 0.1
+
+
+class StubChatCompletions:
+    """Chat completions stand-in that records token usage and simulates latency."""
+
+    def __init__(self, seconds_per_1k_tokens: float, seconds_per_call: float):
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.seconds_per_call = seconds_per_call
+        self.lock = threading.Lock()
+        self.prefixes = set()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def _cached_prefix_tokens(self, system: str, user: str) -> int:
+        # Cache the instructions plus the document, which is what batched calls share
+        document_end = user.find("</document>")
+        if document_end < 0:
+            return 0
+        prefix = system + user[:document_end]
+        tokens = count_tokens(prefix)
+        with self.lock:
+            hit = prefix in self.prefixes
+            self.prefixes.add(prefix)
+        return tokens if hit and tokens >= CACHE_MIN_TOKENS else 0
+
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs: Any):
+        system, user = messages[0]["content"], messages[-1]["content"]
+        prompt_tokens = count_tokens(system) + count_tokens(user)
+        cached = self._cached_prefix_tokens(system, user)
+
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            ids = [int(i) for i in re.findall(r'<chunk id="(\d+)">', user)]
+            content = json.dumps({"contexts": [{"id": i, "context": f"Part {i} of the document."} for i in ids]})
+        else:
+            content = "Part of the document."
+        completion_tokens = count_tokens(content)
+
+        billed = prompt_tokens - cached + cached * CACHED_TOKEN_COST
+        time.sleep(self.seconds_per_call + billed / 1000 * self.seconds_per_1k_tokens)
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached
+            self.completion_tokens += completion_tokens
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def per_chunk_strategy(urls: List[str], contents: List[str], documents: Dict[str, str]) -> List[Any]:
+    """The previous strategy: one call per chunk, ten at a time."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        return list(executor.map(lambda args: utils.generate_contextual_embedding(documents[args[0]], args[1]),
+                                 zip(urls, contents)))
+
+
+def document_strategy(urls: List[str], contents: List[str], documents: Dict[str, str]) -> List[Any]:
+    return utils.contextualize_chunks(urls, contents, documents)
+
+
+def measure(name: str, strategy, stub: StubChatCompletions, urls, contents, documents) -> Dict[str, Any]:
+    stub.reset()
+    stub.prefixes.clear()
+    start = time.perf_counter()
+    results = strategy(urls, contents, documents)
+    seconds = time.perf_counter() - start
+    return {
+        "strategy": name,
+        "seconds": round(seconds, 3),
+        "calls": stub.calls,
+        "prompt_tokens": stub.prompt_tokens,
+        "cached_prompt_tokens": stub.cached_tokens,
+        "billed_prompt_tokens": round(stub.prompt_tokens - stub.cached_tokens * (1 - CACHED_TOKEN_COST)),
+        "completion_tokens": stub.completion_tokens,
+        "contextualized_chunks": sum(1 for _, success in results if success)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5, help="Number of documents")
+    parser.add_argument("--chunks-per-document", type=int, default=40, help="Approximate chunks per document")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Chunk size in characters")
+    parser.add_argument("--seconds-per-1k-tokens", type=float, default=0.01, help="Simulated prompt processing time")
+    parser.add_argument("--seconds-per-call", type=float, default=0.2, help="Simulated fixed latency per call")
+    args = parser.parse_args()
+
+    stub = StubChatCompletions(args.seconds_per_1k_tokens, args.seconds_per_call)
+    utils.openai = SimpleNamespace(chat=SimpleNamespace(completions=stub))
+
+    documents, urls, contents = {}, [], []
+    for d in range(args.documents):
+        url = f"https://docs.example.com/page-{d}"
+        documents[url] = generate_markdown(args.chunks_per_document * args.chunk_size, seed=d)
+        for chunk in smart_chunk_markdown(documents[url], args.chunk_size):
+            urls.append(url)
+            contents.append(chunk)
+
+    results = [
+        measure("per_chunk", per_chunk_strategy, stub, urls, contents, documents),
+        measure("per_document", document_strategy, stub, urls, contents, documents)
+    ]
+    for result in results:
+        print(
+            f"{result['strategy']:>13}: {result['seconds']}s, {result['calls']} calls, "
+            f"{result['prompt_tokens']} prompt tokens ({result['billed_prompt_tokens']} billed), "
+            f"{result['contextualized_chunks']}/{len(contents)} chunks contextualized",
+            file=sys.stderr
+        )
+    print(json.dumps({"benchmark": "contextual_embeddings", "documents": args.documents, "chunks": len(contents),
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
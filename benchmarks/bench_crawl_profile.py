@@ -0,0 +1,110 @@
+"""
+Benchmark the text and full crawl profiles against a local static documentation site.
+
+Crawls the same set of pages with each profile and reports per-page latency, bytes
+fetched from the site (by resource type), peak browser memory and markdown size, so
+the effect of resource blocking can be measured without touching the network.
+
+Usage:
+    uv run python benchmarks/bench_crawl_profile.py --pages 50 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import psutil
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from crawl4ai import AsyncWebCrawler
+
+# Importing the server loads .env, so profile overrides below are applied afterwards
+from crawl4ai_mcp import build_browser_config, block_heavy_resources_hook, crawl_batch, get_crawl_profile
+from static_site import serve_static_site
+
+
+async def _sample_browser_memory(samples: List[int], stop: asyncio.Event, interval: float = 0.2):
+    """Record the total RSS of this process and its browser subprocesses until stopped."""
+    process = psutil.Process()
+    while not stop.is_set():
+        total = 0
+        for proc in [process] + process.children(recursive=True):
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        samples.append(total)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_profile(profile: str, urls: List[str], stats: Dict[str, Any], concurrency: int) -> Dict[str, Any]:
+    """Crawl urls with one profile and collect its measurements."""
+    os.environ["CRAWL_PROFILE"] = profile
+    stats["requests"].clear()
+    stats["bytes"].clear()
+
+    crawler = AsyncWebCrawler(config=build_browser_config())
+    if get_crawl_profile() == "text":
+        crawler.crawler_strategy.set_hook("on_page_context_created", block_heavy_resources_hook)
+    await crawler.__aenter__()
+
+    samples: List[int] = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_browser_memory(samples, stop))
+    try:
+        start = time.perf_counter()
+        results = await crawl_batch(crawler, urls, max_concurrent=concurrency)
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()
+        await sampler
+        await crawler.__aexit__(None, None, None)
+
+    return {
+        "profile": profile,
+        "pages_requested": len(urls),
+        "pages_crawled": len(results),
+        "total_seconds": round(elapsed, 3),
+        "seconds_per_page": round(elapsed / max(len(urls), 1), 4),
+        "bytes_fetched": sum(stats["bytes"].values()),
+        "bytes_by_type": dict(stats["bytes"]),
+        "requests_by_type": dict(stats["requests"]),
+        "peak_rss_mb": round(max(samples, default=0) / (1024 * 1024), 1),
+        "markdown_chars": sum(len(r["markdown"]) for r in results)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="Number of pages in the fixture site")
+    parser.add_argument("--concurrency", type=int, default=10, help="Maximum concurrent browser sessions")
+    parser.add_argument("--profiles", default="full,text", help="Comma-separated profiles to compare")
+    args = parser.parse_args()
+
+    with serve_static_site(num_pages=args.pages) as (base_url, stats):
+        urls = [f"{base_url}/page-{i}.html" for i in range(args.pages)]
+        results = []
+        for profile in args.profiles.split(","):
+            result = await run_profile(profile.strip(), urls, stats, args.concurrency)
+            results.append(result)
+            print(
+                f"{result['profile']:>5}: {result['seconds_per_page'] * 1000:.0f} ms/page, "
+                f"{result['bytes_fetched'] / 1024:.0f} KiB fetched, peak RSS {result['peak_rss_mb']} MB, "
+                f"{result['pages_crawled']}/{result['pages_requested']} pages",
+                file=sys.stderr
+            )
+
+    print(json.dumps({"benchmark": "crawl_profile", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,170 @@
+"""
+Benchmark ingestion and retrieval end-to-end without external APIs.
+
+Serves the static documentation fixture and the fake OpenAI-compatible API locally, then
+runs the server's own scrape pipeline (_process_multiple_urls: crawl, chunk, embed, store)
+and perform_rag_query against a local Supabase stack, reporting pages/s, chunks/s, API
+calls and query latency percentiles. Latency, error rate and rate limits of the fake API
+are tunable, so the effect of slow or throttled providers can be reproduced.
+
+Requires SUPABASE_URL and SUPABASE_SERVICE_KEY pointing at a local Supabase stack
+(`supabase start`) with crawled_pages.sql applied. Rows stored by the run are deleted
+afterwards unless --keep is given.
+
+Usage:
+    uv run python benchmarks/bench_ingestion.py --pages 50 --queries 50 --latency-ms 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from crawl4ai import AsyncWebCrawler
+
+# Importing the server loads .env, so the overrides below are applied afterwards
+import utils
+from crawl4ai_mcp import (
+    Crawl4AIContext, _process_multiple_urls, build_browser_config, block_heavy_resources_hook,
+    get_crawl_profile, perform_rag_query
+)
+from fake_openai_server import FakeServerOptions, serve_fake_openai
+from static_site import WORDS, serve_static_site
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def delete_source(supabase_client, source_id: str):
+    """Remove everything the run stored for source_id."""
+    for table in ("crawled_sections", "code_examples", "crawled_pages", "sources"):
+        try:
+            supabase_client.table(table).delete().eq("source_id", source_id).execute()
+        except Exception as e:
+            print(f"Error cleaning up {table}: {e}", file=sys.stderr)
+
+
+async def run(args, base_url: str, api_server) -> Dict[str, Any]:
+    urls = [f"{base_url}/page-{i}.html" for i in range(args.pages)]
+    source_id = urlparse(base_url).netloc
+
+    crawler = AsyncWebCrawler(config=build_browser_config())
+    if get_crawl_profile() == "text":
+        crawler.crawler_strategy.set_hook("on_page_context_created", block_heavy_resources_hook)
+    await crawler.__aenter__()
+    supabase_client = utils.get_supabase_client()
+    ctx = SimpleNamespace(request_context=SimpleNamespace(
+        lifespan_context=Crawl4AIContext(crawler=crawler, supabase_client=supabase_client)
+    ))
+
+    try:
+        api_server.snapshot(reset=True)
+        start = time.perf_counter()
+        ingestion = json.loads(await _process_multiple_urls(
+            crawler, supabase_client, urls, args.concurrency, args.batch_size, time.time()
+        ))
+        ingestion_seconds = time.perf_counter() - start
+        ingestion_api = api_server.snapshot(reset=True)
+        if not ingestion.get("success"):
+            raise RuntimeError(f"Ingestion failed: {ingestion.get('error')}")
+        summary = ingestion["summary"]
+
+        rng = random.Random(args.seed)
+        latencies = []
+        empty_results = 0
+        for _ in range(args.queries):
+            query = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+            start = time.perf_counter()
+            response = json.loads(await perform_rag_query(ctx, query, source=source_id, match_count=args.match_count))
+            latencies.append(time.perf_counter() - start)
+            empty_results += not response.get("results")
+        query_api = api_server.snapshot()
+    finally:
+        if not args.keep:
+            delete_source(supabase_client, source_id)
+        await crawler.__aexit__(None, None, None)
+
+    chunks = summary["total_chunks_stored"]
+    return {
+        "ingestion": {
+            "pages": summary["successful_urls"],
+            "failed_pages": summary["failed_urls"],
+            "chunks": chunks,
+            "code_examples": summary["total_code_examples_stored"],
+            "seconds": round(ingestion_seconds, 3),
+            "pages_per_second": round(summary["successful_urls"] / ingestion_seconds, 2),
+            "chunks_per_second": round(chunks / ingestion_seconds, 2),
+            "api": ingestion_api
+        },
+        "queries": {
+            "count": len(latencies),
+            "empty_results": empty_results,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(max(latencies, default=0.0) * 1000, 2),
+            "api": query_api
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="Number of pages in the fixture site")
+    parser.add_argument("--sections-per-page", type=int, default=6, help="Sections per fixture page")
+    parser.add_argument("--concurrency", type=int, default=10, help="Crawl concurrency")
+    parser.add_argument("--batch-size", type=int, default=20, help="Embedding and insert batch size")
+    parser.add_argument("--queries", type=int, default=50, help="Number of RAG queries to time")
+    parser.add_argument("--match-count", type=int, default=5, help="Results per RAG query")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fake API latency per request")
+    parser.add_argument("--latency-ms-per-1k-tokens", type=float, default=0.0, help="Fake API latency per 1000 tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake API requests failing with 500")
+    parser.add_argument("--rpm", type=int, default=0, help="Fake API requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=7, help="Query generation seed")
+    parser.add_argument("--keep", action="store_true", help="Keep the stored rows instead of deleting them")
+    args = parser.parse_args()
+
+    options = FakeServerOptions(
+        latency_ms=args.latency_ms,
+        latency_ms_per_1k_tokens=args.latency_ms_per_1k_tokens,
+        error_rate=args.error_rate,
+        rpm=args.rpm
+    )
+    with serve_fake_openai(options) as (api_url, api_server), \
+            serve_static_site(num_pages=args.pages, sections_per_page=args.sections_per_page) as (base_url, _):
+        os.environ["OPENAI_BASE_URL"] = api_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        utils.openai.base_url = api_url
+        utils.openai.api_key = os.environ["OPENAI_API_KEY"]
+        # Reranking loads a model and contextual embeddings would be deferred to a job queue
+        # this harness does not run; both are measured separately
+        os.environ["USE_RERANKING"] = "false"
+        os.environ["USE_CONTEXTUAL_EMBEDDINGS"] = "false"
+        results = asyncio.run(run(args, base_url, api_server))
+
+    ingestion, queries = results["ingestion"], results["queries"]
+    print(f"ingestion: {ingestion['pages']} pages, {ingestion['chunks']} chunks in {ingestion['seconds']}s "
+          f"({ingestion['pages_per_second']} pages/s, {ingestion['chunks_per_second']} chunks/s, "
+          f"{ingestion['api']['rate_limited']} rate limited, {ingestion['api']['errors']} errors)", file=sys.stderr)
+    print(f"  queries: {queries['count']} queries, p50 {queries['p50_ms']} ms, p99 {queries['p99_ms']} ms",
+          file=sys.stderr)
+    print(json.dumps({"benchmark": "ingestion", "pages": args.pages, "fake_api": vars(options),
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
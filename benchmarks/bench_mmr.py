@@ -0,0 +1,136 @@
+"""
+Benchmark maximal marginal relevance selection over retrieved candidate pools.
+
+perform_rag_query and search_code_examples with diversify=true fetch MMR_CANDIDATES
+candidates with their embeddings and pick match_count of them by MMR. This times the
+vectorized selection (vector_ranking.mmr_select, one matrix-vector product per pick)
+against a full pairwise similarity matrix and a pure-Python loop, on generated pools of
+1536-dimensional embeddings where every topic comes in several near-identical versions
+(like versioned or mirrored docs pages). It also checks that all three pick the same
+candidates, and counts the near-duplicates plain top-k similarity would have returned.
+
+Usage:
+    uv run python benchmarks/bench_mmr.py --pool 100 300 1000 --k 10
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from vector_ranking import mmr_select, normalize_rows
+
+
+def generate_pool(size: int, dimensions: int, versions: int, seed: int):
+    """Generate a query and a pool of candidates where each topic has `versions` near-identical copies."""
+    rng = np.random.default_rng(seed)
+    query = rng.normal(size=dimensions)
+    topics = rng.normal(size=(math.ceil(size / versions), dimensions)) + 0.3 * query
+    candidates = np.repeat(topics, versions, axis=0)[:size]
+    candidates += 0.02 * rng.normal(size=candidates.shape)
+    return query.astype(np.float32), candidates.astype(np.float32)
+
+
+def pairwise_mmr(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """MMR over a precomputed n x n similarity matrix."""
+    matrix = normalize_rows(candidates)
+    relevance = matrix @ normalize_rows(query)[0]
+    similarity = matrix @ matrix.T
+    selected = [int(np.argmax(relevance))]
+    available = np.ones(len(matrix), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, len(matrix)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * similarity[:, selected].max(axis=1)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+    return selected
+
+
+def loop_mmr(query: List[float], candidates: List[List[float]], k: int, lambda_mult: float) -> List[int]:
+    """Straightforward pure-Python MMR."""
+    def cosine(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
+
+    relevance = [cosine(query, candidate) for candidate in candidates]
+    selected: List[int] = []
+    while len(selected) < min(k, len(candidates)):
+        best, best_score = -1, -math.inf
+        for i, candidate in enumerate(candidates):
+            if i in selected:
+                continue
+            redundancy = max((cosine(candidate, candidates[j]) for j in selected), default=0.0)
+            score = relevance[i] if not selected else lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+def count_duplicates(candidates: np.ndarray, selected: List[int], threshold: float) -> int:
+    """Count selected candidates that are near-duplicates of an earlier selected one."""
+    matrix = normalize_rows(candidates[selected])
+    similarity = matrix @ matrix.T
+    return int(sum(1 for i in range(1, len(selected)) if similarity[i, :i].max() >= threshold))
+
+
+def measure(name: str, select, pool: int, repeat: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        selected = select()
+        timings.append(time.perf_counter() - start)
+    return {"strategy": f"{name}_{pool}", "pool": pool, "seconds": round(min(timings), 5), "selected": selected}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pool", type=int, nargs="+", default=[100, 300, 1000], help="Candidate pool sizes")
+    parser.add_argument("--k", type=int, default=10, help="Candidates to select")
+    parser.add_argument("--lambda-mult", type=float, default=0.5, help="MMR relevance/diversity trade-off")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--versions", type=int, default=4, help="Near-identical copies of each topic")
+    parser.add_argument("--loop-max-pool", type=int, default=300, help="Largest pool to run the pure-Python loop on")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per strategy (best time is reported)")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed")
+    args = parser.parse_args()
+
+    results = []
+    for pool in args.pool:
+        query, candidates = generate_pool(pool, args.dimensions, args.versions, args.seed)
+        runs = [
+            measure("vectorized", lambda: mmr_select(query, candidates, args.k, args.lambda_mult), pool, args.repeat),
+            measure("pairwise", lambda: pairwise_mmr(query, candidates, args.k, args.lambda_mult), pool, args.repeat)
+        ]
+        if pool <= args.loop_max_pool:
+            query_list, candidate_list = query.tolist(), candidates.tolist()
+            runs.append(measure("loop", lambda: loop_mmr(query_list, candidate_list, args.k, args.lambda_mult), pool, 1))
+
+        top_k = np.argsort(-(normalize_rows(candidates) @ normalize_rows(query)[0]), kind="stable")[:args.k].tolist()
+        reference = runs[0]["selected"]
+        for run in runs:
+            selected = run.pop("selected")
+            run["mismatches"] = int(selected != reference)
+            run["duplicates_selected"] = count_duplicates(candidates, selected, 0.97)
+            run["top_k_duplicates"] = count_duplicates(candidates, top_k, 0.97)
+            results.append(run)
+            print(f"{run['strategy']:>18}: {run['seconds'] * 1000:.2f} ms, {run['duplicates_selected']} duplicates "
+                  f"selected (top-k: {run['top_k_duplicates']}), {run['mismatches']} mismatches", file=sys.stderr)
+
+    print(json.dumps({"benchmark": "mmr", "k": args.k, "lambda_mult": args.lambda_mult,
+                      "dimensions": args.dimensions, "results": results}, indent=2))
+    if any(result["mismatches"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark per-page processing: the previous multi-pass pipeline against the single-pass parser.
+
+The previous pipeline scanned each page several times: the chunker, a header regex and
+split() per chunk, and a '```' position scan for code blocks. The current pipeline parses
+the page once (markdown_parser.parse_markdown) and derives chunks, chunk metadata and code
+blocks from that structure. Both are run on the same generated page with code extraction on.
+
+Usage:
+    uv run python benchmarks/bench_page_processing.py --megabytes 4
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_chunking import generate_markdown, legacy_smart_chunk_markdown
+from page_processing import process_page_markdown
+
+
+def legacy_extract_section_info(chunk: str) -> Dict[str, Any]:
+    headers = re.findall(r'^(#+)\s+(.+)$', chunk, re.MULTILINE)
+    header_str = '; '.join([f'{h[0]} {h[1]}' for h in headers]) if headers else ''
+    return {"headers": header_str, "char_count": len(chunk), "word_count": len(chunk.split())}
+
+
+def legacy_extract_code_blocks(markdown_content: str, min_length: int = 1000) -> List[Dict[str, Any]]:
+    """The '```' position scan this benchmark compares against."""
+    code_blocks = []
+    start_offset = 3 if markdown_content.strip().startswith('```') else 0
+    backtick_positions = []
+    pos = start_offset
+    while True:
+        pos = markdown_content.find('```', pos)
+        if pos == -1:
+            break
+        backtick_positions.append(pos)
+        pos += 3
+    i = 0
+    while i < len(backtick_positions) - 1:
+        start_pos = backtick_positions[i]
+        end_pos = backtick_positions[i + 1]
+        code_section = markdown_content[start_pos + 3:end_pos]
+        lines = code_section.split('\n', 1)
+        if len(lines) > 1 and lines[0].strip() and ' ' not in lines[0].strip() and len(lines[0].strip()) < 20:
+            language, code_content = lines[0].strip(), lines[1].strip()
+        else:
+            language, code_content = "", code_section.strip()
+        if len(code_content) >= min_length:
+            context_before = markdown_content[max(0, start_pos - 1000):start_pos].strip()
+            context_after = markdown_content[end_pos + 3:end_pos + 1003].strip()
+            code_blocks.append({
+                'code': code_content,
+                'language': language,
+                'context_before': context_before,
+                'context_after': context_after,
+                'full_context': f"{context_before}\n\n{code_content}\n\n{context_after}"
+            })
+        i += 2
+    return code_blocks
+
+
+def legacy_process_page(markdown: str, chunk_size: int) -> Dict[str, Any]:
+    chunks = legacy_smart_chunk_markdown(markdown, chunk_size)
+    sections = [legacy_extract_section_info(chunk) for chunk in chunks]
+    word_count = sum(section["word_count"] for section in sections)
+    return {"chunks": chunks, "sections": sections, "word_count": word_count,
+            "code_blocks": legacy_extract_code_blocks(markdown)}
+
+
+def single_pass_process_page(markdown: str, chunk_size: int) -> Dict[str, Any]:
+    result = process_page_markdown(markdown, chunk_size, extract_code=True)
+    result["word_count"] = sum(section["word_count"] for section in result["sections"])
+    return result
+
+
+def measure(name: str, process, markdown: str, chunk_size: int, repeat: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = process(markdown, chunk_size)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "pipeline": name,
+        "seconds": round(best, 4),
+        "megabytes_per_second": round(len(markdown) / best / 1_000_000, 2),
+        "chunks": len(result["sections"]),
+        "code_blocks": len(result["code_blocks"]),
+        "words": result["word_count"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=4, help="Size of the generated page")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Chunk size in characters")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per pipeline (best time is reported)")
+    args = parser.parse_args()
+
+    markdown = generate_markdown(int(args.megabytes * 1_000_000))
+    results = [
+        measure("multi_pass", legacy_process_page, markdown, args.chunk_size, args.repeat),
+        measure("single_pass", single_pass_process_page, markdown, args.chunk_size, args.repeat)
+    ]
+    for result in results:
+        print(
+            f"{result['pipeline']:>12}: {result['megabytes_per_second']} MB/s, {result['chunks']} chunks, "
+            f"{result['code_blocks']} code blocks, {result['words']} words",
+            file=sys.stderr
+        )
+    print(json.dumps({"benchmark": "page_processing", "page_characters": len(markdown), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
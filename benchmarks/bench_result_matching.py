@@ -0,0 +1,101 @@
+"""
+Benchmark matching requested URLs to crawl results for large scrape_urls batches.
+
+_process_multiple_urls used to scan the crawl results for every requested URL (in raw
+mode, in storage mode and again for the single-URL response), which is quadratic in the
+batch size and misses results whose URL is spelled differently from the request (http vs
+https, trailing slashes, tracking parameters). This compares that scan with the canonical
+URL index built once per batch, on generated batches where a share of the results come
+back under a variant spelling and the crawl results arrive out of order.
+
+Usage:
+    uv run python benchmarks/bench_result_matching.py --urls 1000 10000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils import find_crawl_result, index_crawl_results
+
+
+def generate_batch(url_count: int, variant_share: float, seed: int) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Generate requested URLs and their crawl results, some under a variant spelling, shuffled."""
+    rng = random.Random(seed)
+    urls = [f"https://docs{i % 50}.example.com/guide/page-{i}" for i in range(url_count)]
+    crawl_results = []
+    for url in urls:
+        crawled_url = url
+        if rng.random() < variant_share:
+            crawled_url = rng.choice([url + "/", url.replace("https://", "http://"), url + "?utm_source=search"])
+        crawl_results.append({"url": crawled_url, "markdown": "# Page", "links": {}, "redirected_url": None})
+    rng.shuffle(crawl_results)
+    return urls, crawl_results
+
+
+def linear_find(crawl_results: List[Dict[str, Any]], url: str) -> Optional[Dict[str, Any]]:
+    """The previous lookup: scan the results for one with exactly the requested URL."""
+    for cr in crawl_results:
+        if cr['url'] == url:
+            return cr
+    return None
+
+
+def measure(name: str, match, urls: List[str], crawl_results: List[Dict[str, Any]], passes: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    matched = match(urls, crawl_results, passes)
+    seconds = time.perf_counter() - start
+    lookups = len(urls) * passes
+    return {
+        "strategy": f"{name}_{len(urls)}",
+        "urls": len(urls),
+        "seconds": round(seconds, 4),
+        "lookups_per_second": round(lookups / seconds) if seconds else 0,
+        "unmatched": len(urls) - matched
+    }
+
+
+def match_linear(urls: List[str], crawl_results: List[Dict[str, Any]], passes: int) -> int:
+    matched = 0
+    for _ in range(passes):
+        matched = sum(1 for url in urls if linear_find(crawl_results, url) is not None)
+    return matched
+
+
+def match_indexed(urls: List[str], crawl_results: List[Dict[str, Any]], passes: int) -> int:
+    index = index_crawl_results(crawl_results)
+    matched = 0
+    for _ in range(passes):
+        matched = sum(1 for url in urls if find_crawl_result(index, url) is not None)
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, nargs="+", default=[100, 1000, 10000], help="Batch sizes to measure")
+    parser.add_argument("--variant-share", type=float, default=0.1,
+                        help="Share of results returned under a variant spelling of the requested URL")
+    parser.add_argument("--passes", type=int, default=2,
+                        help="Lookups per URL (storage mode matches each URL twice for a single-URL call)")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed")
+    args = parser.parse_args()
+
+    results = []
+    for url_count in args.urls:
+        urls, crawl_results = generate_batch(url_count, args.variant_share, args.seed)
+        for name, match in (("linear", match_linear), ("indexed", match_indexed)):
+            result = measure(name, match, urls, crawl_results, args.passes)
+            results.append(result)
+            print(f"{result['strategy']:>16}: {result['seconds']}s, {result['lookups_per_second']} lookups/s, "
+                  f"{result['unmatched']} unmatched", file=sys.stderr)
+    print(json.dumps({"benchmark": "result_matching", "variant_share": args.variant_share,
+                      "passes": args.passes, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+End-to-end ingestion and retrieval benchmark suite.
+
+Runs every stage of the crawl-to-searchable path against local fixtures only: the static
+documentation site, the fake OpenAI-compatible API and a local Supabase stack. The server
+context is built with the real crawl4ai_lifespan, so page processing workers, the job
+queue and the summary pool are configured exactly as in production (from .env).
+
+Stages:
+    crawl           crawl_batch over the fixture pages
+    chunking        PageProcessor.process_pages on the crawled markdown
+    embedding       create_embeddings_batch over all chunks, in --batch-size batches
+    insert          raw crawled_pages inserts of the embedded chunks
+    scrape_urls     the scrape_urls tool over all fixture pages
+    smart_crawl_url the smart_crawl_url tool from the site index
+    perform_rag_query  --queries RAG queries
+
+Each stage reports its wall time, throughput, peak RSS of the process and its browser
+subprocesses, and the fake API calls it made. The JSON on stdout carries the commit it was
+measured on; compare two runs with benchmarks/compare_benchmarks.py.
+
+Requires SUPABASE_URL and SUPABASE_SERVICE_KEY pointing at a local Supabase stack
+(`supabase start`) with crawled_pages.sql applied. Rows stored by the run are deleted
+afterwards.
+
+Usage:
+    uv run python benchmarks/bench_suite.py --pages 50 --queries 100 > before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Importing the server loads .env, so the overrides below are applied afterwards
+import utils
+from crawl4ai_mcp import (
+    crawl4ai_lifespan, crawl_batch, get_crawl_profile, mcp, perform_rag_query, scrape_urls, smart_crawl_url
+)
+from bench_crawl_profile import _sample_browser_memory
+from bench_ingestion import delete_source, percentile
+from fake_openai_server import FakeServerOptions, serve_fake_openai
+from static_site import WORDS, serve_static_site
+
+
+def get_commit() -> Dict[str, Any]:
+    """Get the commit the suite runs on and whether the tree has local changes."""
+    root = Path(__file__).resolve().parent.parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                    capture_output=True, text=True).stdout.strip())
+    except OSError:
+        return {"commit": None, "dirty": None}
+    return {"commit": commit or None, "dirty": dirty}
+
+
+async def measure_stage(name: str, run: Callable, api_server) -> Dict[str, Any]:
+    """
+    Run one stage, sampling peak RSS while it runs.
+
+    Args:
+        name: Stage name
+        run: Coroutine function returning a dictionary of stage metrics; it receives the
+            elapsed-seconds getter so it can derive throughputs
+        api_server: The fake API server, whose statistics are attributed to the stage
+
+    Returns:
+        Stage result with name, seconds, peak_rss_mb, the stage metrics and API usage
+    """
+    samples: List[int] = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_browser_memory(samples, stop, interval=0.1))
+    api_server.snapshot(reset=True)
+    start = time.perf_counter()
+    try:
+        metrics = await run(lambda: time.perf_counter() - start)
+    finally:
+        seconds = time.perf_counter() - start
+        stop.set()
+        await sampler
+    api = api_server.snapshot(reset=True)
+
+    result = {"name": name, "seconds": round(seconds, 3),
+              "peak_rss_mb": round(max(samples, default=0) / 1_000_000, 1)}
+    result.update(metrics)
+    requests = sum(api["requests"].values())
+    if requests:
+        result["api_requests"] = requests
+        result["api_rate_limited"] = api["rate_limited"]
+        result["api_errors"] = api["errors"]
+    print(f"{name:>17}: {result['seconds']}s, peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+    return result
+
+
+def _embedding_efficiency(api_server_snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    requests = api_server_snapshot["requests"].get("embeddings", 0)
+    if not requests:
+        return {}
+    return {
+        "embedding_requests": requests,
+        "texts_per_request": round(api_server_snapshot["items"]["embeddings"] / requests, 2),
+        "tokens_per_request": round(api_server_snapshot["tokens"]["embeddings"] / requests, 1)
+    }
+
+
+async def run_suite(args, base_url: str, api_server) -> List[Dict[str, Any]]:
+    urls = [f"{base_url}/page-{i}.html" for i in range(args.pages)]
+    source_id = base_url.split("://", 1)[1]
+    loop = asyncio.get_running_loop()
+    results = []
+
+    async with crawl4ai_lifespan(mcp) as context:
+        ctx = SimpleNamespace(request_context=SimpleNamespace(lifespan_context=context))
+        client = context.supabase_client
+        try:
+            pages: List[Dict[str, Any]] = []
+
+            async def crawl(elapsed):
+                pages.extend(await crawl_batch(context.crawler, urls, args.concurrency))
+                markdown_bytes = sum(len(page['markdown'].encode('utf-8')) for page in pages)
+                return {"pages": len(pages), "pages_per_second": round(len(pages) / elapsed(), 2),
+                        "markdown_mb": round(markdown_bytes / 1_000_000, 3)}
+            results.append(await measure_stage("crawl", crawl, api_server))
+
+            chunks: List[str] = []
+
+            async def chunking(elapsed):
+                processed = await loop.run_in_executor(None, lambda: context.page_processor.process_pages(
+                    [page['markdown'] for page in pages], extract_code=True))
+                seconds = elapsed()
+                for page in processed:
+                    chunks.extend(page['chunks'])
+                markdown_bytes = sum(len(page['markdown'].encode('utf-8')) for page in pages)
+                return {"chunks": len(chunks), "pages_per_second": round(len(pages) / seconds, 2),
+                        "megabytes_per_second": round(markdown_bytes / seconds / 1_000_000, 2),
+                        "code_blocks": sum(len(page['code_blocks']) for page in processed)}
+            results.append(await measure_stage("chunking", chunking, api_server))
+
+            embeddings: List[List[float]] = []
+
+            async def embedding(elapsed):
+                def embed_all():
+                    for i in range(0, len(chunks), args.batch_size):
+                        embeddings.extend(utils.create_embeddings_batch(chunks[i:i + args.batch_size]))
+                await loop.run_in_executor(None, embed_all)
+                metrics = {"texts": len(embeddings), "texts_per_second": round(len(embeddings) / elapsed(), 2)}
+                metrics.update(_embedding_efficiency(api_server.snapshot()))
+                return metrics
+            results.append(await measure_stage("embedding", embedding, api_server))
+
+            async def insert(elapsed):
+                utils.update_source_info(client, source_id, "Benchmark fixture site", 0)
+                rows = [{
+                    "url": f"{base_url}/insert-bench-{i // 10}",
+                    "chunk_number": i % 10,
+                    "content": chunk,
+                    "metadata": {"source": source_id},
+                    "source_id": source_id,
+                    "embedding": vector
+                } for i, (chunk, vector) in enumerate(zip(chunks, embeddings))]
+
+                def insert_all():
+                    for i in range(0, len(rows), args.batch_size):
+                        client.table("crawled_pages").insert(rows[i:i + args.batch_size]).execute()
+                await loop.run_in_executor(None, insert_all)
+                seconds = elapsed()
+                client.table("crawled_pages").delete().like("url", f"{base_url}/insert-bench-%").execute()
+                return {"rows": len(rows), "rows_per_second": round(len(rows) / seconds, 2)}
+            results.append(await measure_stage("insert", insert, api_server))
+
+            async def scrape(elapsed):
+                response = json.loads(await scrape_urls(ctx, urls, max_concurrent=args.concurrency,
+                                                        batch_size=args.batch_size))
+                summary = response.get("summary", {})
+                metrics = {"pages": summary.get("successful_urls", 0),
+                           "chunks": summary.get("total_chunks_stored", 0)}
+                seconds = elapsed()
+                metrics["pages_per_second"] = round(metrics["pages"] / seconds, 2)
+                metrics["chunks_per_second"] = round(metrics["chunks"] / seconds, 2)
+                metrics.update(_embedding_efficiency(api_server.snapshot()))
+                return metrics
+            results.append(await measure_stage("scrape_urls", scrape, api_server))
+
+            async def smart_crawl(elapsed):
+                response = json.loads(await smart_crawl_url(ctx, f"{base_url}/index.html", max_depth=2,
+                                                            max_concurrent=args.concurrency))
+                metrics = {"pages": response.get("pages_crawled", 0), "chunks": response.get("chunks_stored", 0)}
+                seconds = elapsed()
+                metrics["pages_per_second"] = round(metrics["pages"] / seconds, 2)
+                metrics["chunks_per_second"] = round(metrics["chunks"] / seconds, 2)
+                metrics.update(_embedding_efficiency(api_server.snapshot()))
+                return metrics
+            results.append(await measure_stage("smart_crawl_url", smart_crawl, api_server))
+
+            async def rag_queries(elapsed):
+                rng = random.Random(args.seed)
+                latencies = []
+                empty = 0
+                for _ in range(args.queries):
+                    query = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+                    start = time.perf_counter()
+                    response = json.loads(await perform_rag_query(ctx, query, source=source_id,
+                                                                  match_count=args.match_count))
+                    latencies.append(time.perf_counter() - start)
+                    empty += not response.get("results")
+                return {"queries": len(latencies), "empty_results": empty,
+                        "queries_per_second": round(len(latencies) / elapsed(), 2),
+                        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                        "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+            results.append(await measure_stage("perform_rag_query", rag_queries, api_server))
+        finally:
+            delete_source(client, source_id)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="Number of pages in the fixture site")
+    parser.add_argument("--sections-per-page", type=int, default=6, help="Sections per fixture page")
+    parser.add_argument("--concurrency", type=int, default=10, help="Crawl concurrency")
+    parser.add_argument("--batch-size", type=int, default=20, help="Embedding and insert batch size")
+    parser.add_argument("--queries", type=int, default=100, help="Number of RAG queries to time")
+    parser.add_argument("--match-count", type=int, default=5, help="Results per RAG query")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Fake API latency per request")
+    parser.add_argument("--latency-ms-per-1k-tokens", type=float, default=5.0, help="Fake API latency per 1000 tokens")
+    parser.add_argument("--seed", type=int, default=7, help="Query generation seed")
+    args = parser.parse_args()
+
+    options = FakeServerOptions(latency_ms=args.latency_ms, latency_ms_per_1k_tokens=args.latency_ms_per_1k_tokens)
+    with tempfile.TemporaryDirectory(prefix="crawl-bench-state-") as state_dir, \
+            serve_fake_openai(options) as (api_url, api_server), \
+            serve_static_site(num_pages=args.pages, sections_per_page=args.sections_per_page) as (base_url, _):
+        os.environ["OPENAI_BASE_URL"] = api_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        utils.openai.base_url = api_url
+        utils.openai.api_key = os.environ["OPENAI_API_KEY"]
+        # Fresh local state, so cached summaries and old crawl jobs do not skew runs
+        os.environ["CODE_SUMMARY_CACHE_DB"] = str(Path(state_dir) / "code_summaries.db")
+        os.environ["CRAWL_JOBS_DB"] = str(Path(state_dir) / "crawl_jobs.db")
+        os.environ["USE_RERANKING"] = "false"
+        os.environ["USE_KNOWLEDGE_GRAPH"] = "false"
+        results = asyncio.run(run_suite(args, base_url, api_server))
+
+    print(json.dumps({
+        "benchmark": "suite",
+        "git": get_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "crawl_profile": get_crawl_profile(),
+        "args": vars(args),
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
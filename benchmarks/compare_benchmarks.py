@@ -0,0 +1,111 @@
+"""
+Compare two benchmark JSON outputs and flag regressions.
+
+Works with the JSON of any script in benchmarks/: entries of "results" are matched by
+their first string field (name, strategy, extractor, profile, ...) and every numeric
+metric present in both runs is compared. Metrics are classified by name: throughputs
+(*_per_second, *_per_request) are better when higher; times, latencies, memory, errors
+and mismatches are better when lower; anything else is reported without judgement.
+
+Usage:
+    uv run python benchmarks/compare_benchmarks.py before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+HIGHER_IS_BETTER = ("_per_second", "_per_request")
+LOWER_IS_BETTER = ("seconds", "_ms", "rss_mb", "errors", "rate_limited", "mismatches", "empty_results")
+
+
+def metric_direction(metric: str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 if the metric is informational."""
+    if metric.endswith(HIGHER_IS_BETTER):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER) or metric.startswith("failed"):
+        return -1
+    return 0
+
+
+def _entry_key(entry: Dict[str, Any]) -> Optional[str]:
+    for value in entry.values():
+        if isinstance(value, str):
+            return value
+    return None
+
+
+def index_results(report: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Map each result entry's key to its numeric metrics."""
+    indexed = {}
+    for position, entry in enumerate(report.get("results", [])):
+        key = _entry_key(entry) or f"#{position}"
+        indexed[key] = {metric: value for metric, value in entry.items()
+                        if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    return indexed
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any], threshold: float) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Compare the results of two benchmark runs.
+
+    Args:
+        before: Baseline benchmark JSON
+        after: New benchmark JSON
+        threshold: Relative change in percent beyond which a change counts as a regression or improvement
+
+    Returns:
+        Tuple of (one row per compared metric, number of regressions)
+    """
+    rows = []
+    regressions = 0
+    before_results, after_results = index_results(before), index_results(after)
+    for key, after_metrics in after_results.items():
+        before_metrics = before_results.get(key)
+        if before_metrics is None:
+            continue
+        for metric, new in after_metrics.items():
+            old = before_metrics.get(metric)
+            if old is None:
+                continue
+            change = (new - old) / abs(old) * 100 if old else (0.0 if new == old else float("inf"))
+            direction = metric_direction(metric)
+            verdict = ""
+            if direction and abs(change) > threshold:
+                verdict = "improved" if change * direction > 0 else "REGRESSED"
+                regressions += verdict == "REGRESSED"
+            rows.append({"entry": key, "metric": metric, "before": old, "after": new,
+                         "change_percent": round(change, 1), "verdict": verdict})
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", help="Baseline benchmark JSON")
+    parser.add_argument("after", help="New benchmark JSON")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Relative change (%%) that counts")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("benchmark") != after.get("benchmark"):
+        print(f"Comparing different benchmarks: {before.get('benchmark')} vs {after.get('benchmark')}",
+              file=sys.stderr)
+
+    rows, regressions = compare(before, after, args.threshold)
+    commits = [(report.get("git") or {}).get("commit") for report in (before, after)]
+    if all(commits):
+        print(f"{commits[0][:10]} -> {commits[1][:10]}")
+    for row in rows:
+        print(f"{row['entry']:>18} {row['metric']:<22} {row['before']:>12} -> {row['after']:<12} "
+              f"{row['change_percent']:+7.1f}% {row['verdict']}")
+    print(f"{regressions} regression(s) beyond {args.threshold}%")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
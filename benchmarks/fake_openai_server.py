@@ -0,0 +1,249 @@
+"""
+Fake OpenAI-compatible API server for offline benchmarks.
+
+Serves /v1/embeddings and /v1/chat/completions with tunable latency, error rate and rate
+limiting (429 responses with Retry-After, which the openai client retries), so ingestion
+and retrieval throughput can be measured reproducibly without an API key. Embeddings are
+deterministic hashed bag-of-words vectors, so texts sharing words are similar and vector
+search returns meaningful neighbours.
+
+Point the server at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 (any OPENAI_API_KEY).
+
+Usage:
+    uv run python benchmarks/fake_openai_server.py --port 8089 --latency-ms 50 --rpm 3000
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Tuple
+
+_WORD_RE = re.compile(r'\w+')
+_CHUNK_ID_RE = re.compile(r'<chunk id="(\d+)">')
+
+
+@dataclass
+class FakeServerOptions:
+    """Behaviour of the fake server."""
+    latency_ms: float = 0.0                 # Fixed latency per request
+    latency_ms_per_1k_tokens: float = 0.0   # Additional latency per 1000 input tokens
+    error_rate: float = 0.0                 # Fraction of requests answered with a 500
+    rpm: int = 0                            # Requests per minute before 429s (0 = unlimited)
+    retry_after: float = 1.0                # Retry-After seconds sent with 429s
+    embedding_dimensions: int = 1536
+    seed: int = 0
+
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def fake_embedding(text: str, dimensions: int = 1536) -> List[float]:
+    """Hash the words of text into a normalized bag-of-words vector."""
+    vector = [0.0] * dimensions
+    for word in _WORD_RE.findall(text.lower()):
+        hashed = zlib.crc32(word.encode('utf-8'))
+        vector[hashed % dimensions] += 1.0 if (hashed >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: "FakeOpenAIServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str, error_type: str, headers: Dict[str, str] = None):
+        self._send_json(status, {"error": {"message": message, "type": error_type, "code": None}}, headers)
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            self._send_json(200, self.server.snapshot(reset="reset=1" in self.path))
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_error(400, "Invalid JSON body", "invalid_request_error")
+            return
+
+        endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+        outcome = self.server.admit(endpoint)
+        if outcome == "rate_limited":
+            self._send_error(429, "Rate limit reached", "rate_limit_error",
+                             {"Retry-After": str(self.server.options.retry_after)})
+            return
+        if outcome == "error":
+            self._send_error(500, "Injected server error", "server_error")
+            return
+
+        if endpoint == "embeddings":
+            texts = request.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            tokens = sum(_estimate_tokens(text) for text in texts)
+            self.server.wait_latency(tokens)
+            dimensions = self.server.options.embedding_dimensions
+            self.server.record(endpoint, tokens, len(texts))
+            self._send_json(200, {
+                "object": "list",
+                "model": request.get("model", "fake-embedding"),
+                "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+                         for i, text in enumerate(texts)],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+            })
+        elif endpoint == "completions":
+            messages = request.get("messages", [])
+            prompt = "\n".join(str(message.get("content", "")) for message in messages)
+            tokens = _estimate_tokens(prompt)
+            self.server.wait_latency(tokens)
+            if (request.get("response_format") or {}).get("type") == "json_object":
+                ids = [int(i) for i in _CHUNK_ID_RE.findall(prompt)]
+                content = json.dumps({"contexts": [{"id": i, "context": f"Section {i} of the document."} for i in ids]})
+            else:
+                content = "A short summary generated by the fake server."
+            completion_tokens = _estimate_tokens(content)
+            self.server.record(endpoint, tokens, 1)
+            self._send_json(200, {
+                "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model") or "fake-model",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": tokens + completion_tokens}
+            })
+        else:
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the fake API's options and request statistics."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], options: FakeServerOptions):
+        super().__init__(address, _FakeOpenAIHandler)
+        self.options = options
+        self._lock = threading.Lock()
+        self._rng = random.Random(options.seed)
+        self._recent = deque()
+        self.stats = {"requests": Counter(), "items": Counter(), "tokens": Counter(), "rate_limited": 0, "errors": 0}
+
+    def admit(self, endpoint: str) -> str:
+        """Decide whether a request is served, rate limited or answered with an injected error."""
+        with self._lock:
+            now = time.monotonic()
+            if self.options.rpm:
+                while self._recent and now - self._recent[0] > 60.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.options.rpm:
+                    self.stats["rate_limited"] += 1
+                    return "rate_limited"
+                self._recent.append(now)
+            if self.options.error_rate and self._rng.random() < self.options.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+        return "ok"
+
+    def wait_latency(self, tokens: int):
+        delay = self.options.latency_ms + self.options.latency_ms_per_1k_tokens * tokens / 1000
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def record(self, endpoint: str, tokens: int, items: int):
+        with self._lock:
+            self.stats["requests"][endpoint] += 1
+            self.stats["items"][endpoint] += items
+            self.stats["tokens"][endpoint] += tokens
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """Get the request statistics, optionally resetting them."""
+        with self._lock:
+            snapshot = {
+                "requests": dict(self.stats["requests"]),
+                "items": dict(self.stats["items"]),
+                "tokens": dict(self.stats["tokens"]),
+                "rate_limited": self.stats["rate_limited"],
+                "errors": self.stats["errors"]
+            }
+            if reset:
+                for counter in ("requests", "items", "tokens"):
+                    self.stats[counter].clear()
+                self.stats["rate_limited"] = 0
+                self.stats["errors"] = 0
+        return snapshot
+
+
+@contextmanager
+def serve_fake_openai(options: FakeServerOptions = None, port: int = 0) -> Iterator[Tuple[str, FakeOpenAIServer]]:
+    """
+    Run the fake server on a background thread.
+
+    Yields:
+        Tuple of (base URL ending in /v1, server); server.snapshot() returns its statistics
+    """
+    server = FakeOpenAIServer(("127.0.0.1", port), options or FakeServerOptions())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1", server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089, help="Port to listen on")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fixed latency per request")
+    parser.add_argument("--latency-ms-per-1k-tokens", type=float, default=0.0, help="Latency per 1000 input tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    options = FakeServerOptions(
+        latency_ms=args.latency_ms,
+        latency_ms_per_1k_tokens=args.latency_ms_per_1k_tokens,
+        error_rate=args.error_rate,
+        rpm=args.rpm,
+        retry_after=args.retry_after
+    )
+    server = FakeOpenAIServer(("127.0.0.1", args.port), options)
+    print(f"Fake OpenAI API listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
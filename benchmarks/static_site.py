@@ -0,0 +1,136 @@
+"""
+Local static documentation site fixture for crawl benchmarks.
+
+Generates a docs-like site (navigation, prose, code blocks, images, fonts, stylesheets
+and an analytics script) in a temporary directory and serves it over HTTP, counting the
+requests and bytes served per resource type so crawl profiles can be compared.
+"""
+import os
+import random
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+WORDS = (
+    "crawler browser markdown chunk embedding vector index query source page request "
+    "response session context document section example install configure deploy server "
+    "client token cache batch worker pipeline retrieval summary metadata header"
+).split()
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<title>{title}</title>
+<link rel="stylesheet" href="/assets/site.css">
+<link rel="preload" href="/assets/font.woff2" as="font" crossorigin>
+<script src="/assets/analytics.js" async></script>
+</head>
+<body>
+<nav>{nav}</nav>
+<main>
+<h1>{title}</h1>
+<img src="/assets/hero-{image}.png" alt="hero">
+{sections}
+</main>
+</body>
+</html>
+"""
+
+SECTION_TEMPLATE = """<h2>{heading}</h2>
+<p>{paragraph}</p>
+<pre><code class="language-python">{code}</code></pre>
+<p>{paragraph2}</p>
+<img src="/assets/diagram-{image}.png" alt="diagram">
+"""
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def generate_site(root: Path, num_pages: int = 50, sections_per_page: int = 6, seed: int = 7) -> None:
+    """
+    Generate the fixture site under root.
+
+    Args:
+        root: Directory to write the site into
+        num_pages: Number of HTML pages
+        sections_per_page: Number of sections (heading, prose, code, image) per page
+        seed: Random seed so runs are comparable
+    """
+    rng = random.Random(seed)
+    assets = root / "assets"
+    assets.mkdir(parents=True, exist_ok=True)
+
+    # Heavy assets the text profile should never download
+    (assets / "site.css").write_text("body { font-family: 'Docs'; }\n" + ".x { color: #333; }\n" * 20000)
+    (assets / "font.woff2").write_bytes(os.urandom(150_000))
+    (assets / "analytics.js").write_text("(function(){ var t = Date.now(); while (Date.now() - t < 20) {} })();\n")
+    for i in range(20):
+        (assets / f"hero-{i}.png").write_bytes(os.urandom(200_000))
+        (assets / f"diagram-{i}.png").write_bytes(os.urandom(80_000))
+
+    nav = "".join(f'<a href="/page-{i}.html">Page {i}</a> ' for i in range(num_pages))
+    for page in range(num_pages):
+        sections = "".join(
+            SECTION_TEMPLATE.format(
+                heading=_sentence(rng, 4),
+                paragraph=" ".join(_sentence(rng, 14) for _ in range(6)),
+                code="\n".join(f"value_{i} = client.call('{rng.choice(WORDS)}', retries={i})" for i in range(12)),
+                paragraph2=" ".join(_sentence(rng, 12) for _ in range(4)),
+                image=rng.randrange(20)
+            )
+            for _ in range(sections_per_page)
+        )
+        html = PAGE_TEMPLATE.format(title=f"Page {page}", nav=nav, image=page % 20, sections=sections)
+        (root / f"page-{page}.html").write_text(html)
+
+    (root / "index.html").write_text(PAGE_TEMPLATE.format(title="Docs", nav=nav, image=0, sections=""))
+
+
+class _CountingHandler(SimpleHTTPRequestHandler):
+    """Static file handler that records requests and bytes served per file extension."""
+
+    def __init__(self, *args, stats: Dict[str, Counter], **kwargs):
+        self._stats = stats
+        super().__init__(*args, **kwargs)
+
+    def copyfile(self, source, outputfile):
+        extension = Path(self.path.split("?")[0]).suffix.lstrip(".") or "html"
+        data = source.read()
+        outputfile.write(data)
+        self._stats["requests"][extension] += 1
+        self._stats["bytes"][extension] += len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_static_site(num_pages: int = 50, sections_per_page: int = 6) -> Iterator[Tuple[str, Dict[str, Counter]]]:
+    """
+    Generate and serve the fixture site on a free local port.
+
+    Yields:
+        Tuple of (base URL, stats) where stats holds 'requests' and 'bytes' Counters keyed by
+        file extension. Call stats['requests'].clear() / stats['bytes'].clear() between runs.
+    """
+    with tempfile.TemporaryDirectory(prefix="crawl-bench-site-") as tmp:
+        root = Path(tmp)
+        generate_site(root, num_pages=num_pages, sections_per_page=sections_per_page)
+
+        stats = {"requests": Counter(), "bytes": Counter()}
+        handler = partial(_CountingHandler, directory=str(root), stats=stats)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_address[1]}", stats
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -3,6 +3,7 @@ create extension if not exists vector;
 
 -- Drop tables if they exist (to allow rerunning the script)
 drop table if exists crawled_pages;
+drop table if exists crawled_sections;
 drop table if exists code_examples;
 drop table if exists sources;
 
@@ -24,6 +25,7 @@ create table crawled_pages (
     metadata jsonb not null default '{}'::jsonb,
     source_id text not null,
     embedding vector(1536),  -- OpenAI embeddings are 1536 dimensions
+    embedding_version smallint not null default 0,  -- 0 = plain chunk embedding, 1 = contextual embedding
     created_at timestamp with time zone default timezone('utc'::text, now()) not null,
     
     -- Add a unique constraint to prevent duplicate chunks for the same URL
@@ -42,6 +44,9 @@ create index idx_crawled_pages_metadata on crawled_pages using gin (metadata);
 -- Create an index on source_id for faster filtering
 CREATE INDEX idx_crawled_pages_source_id ON crawled_pages (source_id);
 
+-- Existing databases can add the column with:
+-- alter table crawled_pages add column if not exists embedding_version smallint not null default 0;
+
 -- Create a function to search for documentation chunks
 create or replace function match_crawled_pages (
   query_embedding vector(1536),
@@ -78,6 +83,162 @@ begin
 end;
 $$;
 
+-- Create a function to search the chunks of a given set of pages, returning the best
+-- match_count_per_url chunks of each page (one call for all pages of a search)
+create or replace function match_crawled_pages_by_url (
+  query_embedding vector(1536),
+  url_filter text[],
+  match_count_per_url int default 5,
+  filter jsonb DEFAULT '{}'::jsonb
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  metadata jsonb,
+  source_id text,
+  similarity float
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  return query
+  select
+    ranked.id,
+    ranked.url,
+    ranked.chunk_number,
+    ranked.content,
+    ranked.metadata,
+    ranked.source_id,
+    ranked.similarity
+  from (
+    select
+      id,
+      url,
+      chunk_number,
+      content,
+      metadata,
+      source_id,
+      1 - (crawled_pages.embedding <=> query_embedding) as similarity,
+      row_number() over (partition by url order by crawled_pages.embedding <=> query_embedding) as url_rank
+    from crawled_pages
+    where url = ANY(url_filter)
+      AND metadata @> filter
+  ) ranked
+  where ranked.url_rank <= match_count_per_url
+  order by ranked.url, ranked.similarity desc;
+end;
+$$;
+
+-- Create a function to search the chunks of several sources in one ranked list, optionally
+-- keeping at most per_source_limit chunks of each source (NULL for no quota)
+create or replace function match_crawled_pages_multi_source (
+  query_embedding vector(1536),
+  source_filters text[],
+  match_count int default 10,
+  per_source_limit int default NULL,
+  filter jsonb DEFAULT '{}'::jsonb
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  metadata jsonb,
+  source_id text,
+  similarity float
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  -- Without a per-source limit, a plain nearest-neighbour query that can use the vector index
+  if per_source_limit IS NULL then
+    return query
+    select
+      id,
+      url,
+      chunk_number,
+      content,
+      metadata,
+      source_id,
+      1 - (crawled_pages.embedding <=> query_embedding) as similarity
+    from crawled_pages
+    where source_id = ANY(source_filters)
+      AND metadata @> filter
+    order by crawled_pages.embedding <=> query_embedding
+    limit match_count;
+    return;
+  end if;
+
+  return query
+  select
+    ranked.id,
+    ranked.url,
+    ranked.chunk_number,
+    ranked.content,
+    ranked.metadata,
+    ranked.source_id,
+    ranked.similarity
+  from (
+    select
+      id,
+      url,
+      chunk_number,
+      content,
+      metadata,
+      source_id,
+      1 - (crawled_pages.embedding <=> query_embedding) as similarity,
+      row_number() over (partition by source_id order by crawled_pages.embedding <=> query_embedding) as source_rank
+    from crawled_pages
+    where source_id = ANY(source_filters)
+      AND metadata @> filter
+  ) ranked
+  where ranked.source_rank <= per_source_limit
+  order by ranked.similarity desc
+  limit match_count;
+end;
+$$;
+
+-- Create a function returning the best matching chunks together with their embeddings, as the
+-- candidate pool for maximal marginal relevance (diversity) re-ranking on the server
+create or replace function match_crawled_pages_candidates (
+  query_embedding vector(1536),
+  match_count int default 20,
+  source_filters text[] DEFAULT NULL,
+  filter jsonb DEFAULT '{}'::jsonb
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  metadata jsonb,
+  source_id text,
+  similarity float,
+  embedding real[]
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  return query
+  select
+    id,
+    url,
+    chunk_number,
+    content,
+    metadata,
+    source_id,
+    1 - (crawled_pages.embedding <=> query_embedding) as similarity,
+    crawled_pages.embedding::real[] as embedding
+  from crawled_pages
+  where metadata @> filter
+    AND (source_filters IS NULL OR source_id = ANY(source_filters))
+  order by crawled_pages.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
+
 -- Enable RLS on the crawled_pages table
 alter table crawled_pages enable row level security;
 
@@ -98,6 +259,40 @@ create policy "Allow public read access to sources"
   to public
   using (true);
 
+-- Create the heading sections table (the parent level of the chunk hierarchy).
+-- Each row holds a section's own text, from its heading to the next heading of any level;
+-- chunks point to their section through metadata->>'section_index'. A section's full text
+-- is the concatenation of its rows from section_index through last_descendant.
+create table crawled_sections (
+    id bigserial primary key,
+    url varchar not null,
+    section_index integer not null,
+    parent_index integer not null default -1,
+    last_descendant integer not null,
+    level integer not null,
+    title text not null,
+    heading_path text[] not null default '{}',
+    content text not null,
+    source_id text not null,
+    created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    
+    -- Add a unique constraint to prevent duplicate sections for the same URL
+    unique(url, section_index),
+    
+    -- Add foreign key constraint to sources table
+    foreign key (source_id) references sources(source_id)
+);
+
+-- Enable RLS on the crawled_sections table
+alter table crawled_sections enable row level security;
+
+-- Create a policy that allows anyone to read crawled_sections
+create policy "Allow public read access to crawled_sections"
+  on crawled_sections
+  for select
+  to public
+  using (true);
+
 -- Create the code_examples table
 create table code_examples (
     id bigserial primary key,
@@ -164,6 +359,47 @@ begin
 end;
 $$;
 
+-- Create a function returning the best matching code examples together with their embeddings
+-- (the candidate pool for maximal marginal relevance re-ranking)
+create or replace function match_code_examples_candidates (
+  query_embedding vector(1536),
+  match_count int default 20,
+  source_filter text DEFAULT NULL,
+  filter jsonb DEFAULT '{}'::jsonb
+) returns table (
+  id bigint,
+  url varchar,
+  chunk_number integer,
+  content text,
+  summary text,
+  metadata jsonb,
+  source_id text,
+  similarity float,
+  embedding real[]
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  return query
+  select
+    id,
+    url,
+    chunk_number,
+    content,
+    summary,
+    metadata,
+    source_id,
+    1 - (code_examples.embedding <=> query_embedding) as similarity,
+    code_examples.embedding::real[] as embedding
+  from code_examples
+  where metadata @> filter
+    AND (source_filter IS NULL OR source_id = source_filter)
+  order by code_examples.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
+
 -- Enable RLS on the code_examples table
 alter table code_examples enable row level security;
 
@@ -0,0 +1,167 @@
+"""
+Cached, bounded generation of code example summaries.
+
+Docs sites repeat the same snippets (install commands, quick starts) on many pages and
+across crawls. Summaries are cached in a local SQLite database keyed by a hash of exactly
+what the summary prompt sees (the trimmed code and context) plus the model, and all
+summary calls of the server go through one bounded thread pool.
+"""
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+from metrics import increment, propagate, span
+from utils import DEFAULT_CODE_SUMMARY, generate_code_example_summary, trim_code_example
+
+_SCHEMA = """
+create table if not exists code_summaries (
+    key text primary key,
+    model text not null,
+    summary text not null,
+    created_at real not null
+);
+"""
+
+
+def get_default_cache_path() -> str:
+    """Get the summary cache database path from CODE_SUMMARY_CACHE_DB or the project's data folder."""
+    default_path = Path(__file__).resolve().parent.parent / 'data' / 'code_summaries.db'
+    return os.getenv("CODE_SUMMARY_CACHE_DB", str(default_path))
+
+
+def code_summary_key(code: str, context_before: str, context_after: str, model: str) -> str:
+    """Hash the trimmed code example and context, as sent to the model, together with the model name."""
+    digest = hashlib.sha256()
+    for part in (model, *trim_code_example(code, context_before, context_after)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CodeSummaryCache:
+    """SQLite-backed cache of code example summaries."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or get_default_cache_path()
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """Get the cached summaries for the given keys, as a key -> summary dictionary."""
+        summaries = {}
+        unique_keys = list(set(keys))
+        with self._lock:
+            # Stay under SQLite's default limit on query parameters
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"select key, summary from code_summaries where key in ({', '.join('?' * len(batch))})", batch
+                ).fetchall()
+                summaries.update(rows)
+        return summaries
+
+    def put_many(self, entries: List[Tuple[str, str, str]]):
+        """Store (key, model, summary) entries."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "insert or replace into code_summaries (key, model, summary, created_at) values (?, ?, ?, ?)",
+                [(key, model, summary, now) for key, model, summary in entries]
+            )
+
+
+class CodeSummarizer:
+    """Generates code example summaries through a shared bounded pool, reusing cached summaries."""
+
+    def __init__(self, max_workers: int = 10, cache: Optional[CodeSummaryCache] = None):
+        self.max_workers = max(1, max_workers)
+        self.cache = cache
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                               thread_name_prefix="code-summary")
+
+    @classmethod
+    def from_env(cls) -> "CodeSummarizer":
+        """
+        Create a summarizer configured from CODE_SUMMARY_WORKERS (default 10) and
+        USE_CODE_SUMMARY_CACHE (default true).
+        """
+        cache = None
+        if os.getenv("USE_CODE_SUMMARY_CACHE", "true") == "true":
+            try:
+                cache = CodeSummaryCache()
+            except Exception as e:
+                print(f"Failed to open code summary cache: {e}")
+        return cls(max_workers=int(os.getenv("CODE_SUMMARY_WORKERS", "10")), cache=cache)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.cache:
+            self.cache.close()
+
+    @span("code_summaries")
+    def summarize(self, examples: List[Tuple[str, str, str]]) -> List[str]:
+        """
+        Summarize code examples.
+
+        Cached summaries are reused, identical examples in the list are summarized once, and
+        the remaining LLM calls run on the shared pool. Failed calls return the default
+        summary and are not cached.
+
+        Args:
+            examples: List of (code, context_before, context_after) tuples
+
+        Returns:
+            List of summaries, in the same order as examples
+        """
+        if not examples:
+            return []
+        model = os.getenv("MODEL_CHOICE") or ""
+        keys = [code_summary_key(code, before, after, model) for code, before, after in examples]
+
+        summaries: Dict[str, str] = {}
+        if self.cache:
+            try:
+                summaries = self.cache.get_many(keys)
+            except Exception as e:
+                print(f"Error reading code summary cache: {e}")
+        increment("code_summary_cache_hits", sum(1 for key in keys if key in summaries))
+
+        futures = {}
+        for key, example in zip(keys, examples):
+            if key not in summaries and key not in futures:
+                futures[key] = self._executor.submit(propagate(generate_code_example_summary), *example)
+
+        generated = []
+        for key, future in futures.items():
+            try:
+                summaries[key] = future.result()
+            except Exception as e:
+                print(f"Error generating code example summary: {e}")
+                summaries[key] = DEFAULT_CODE_SUMMARY
+            if summaries[key] != DEFAULT_CODE_SUMMARY:
+                increment("code_summaries_generated")
+                generated.append((key, model, summaries[key]))
+
+        if self.cache and generated:
+            try:
+                self.cache.put_many(generated)
+            except Exception as e:
+                print(f"Error writing code summary cache: {e}")
+
+        if futures:
+            print(f"Summarized {len(futures)} code examples ({len(examples) - len(futures)} reused)")
+        return [summaries[key] for key in keys]
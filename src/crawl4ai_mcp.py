@@ -10,17 +10,17 @@ from sentence_transformers import CrossEncoder
 from contextlib import asynccontextmanager
 from collections.abc import AsyncIterator
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Tuple
 from urllib.parse import urlparse, urldefrag
 from xml.etree import ElementTree
 from dotenv import load_dotenv
 from supabase import Client
 from pathlib import Path
 import requests
+import httpx
 import asyncio
 import json
 import os
-import re
 import concurrent.futures
 import sys
 import time
@@ -34,14 +34,50 @@ sys.path.append(str(knowledge_graphs_path))
 from utils import (
     get_supabase_client, 
     add_documents_to_supabase, 
+    add_sections_to_supabase,
+    expand_results_to_sections,
+    contextualize_stored_pages,
+    contextual_embeddings_deferred,
     search_documents,
-    extract_code_blocks,
-    generate_code_example_summary,
+    search_documents_by_url,
+    search_documents_in_sources,
+    search_documents_diverse,
+    search_code_examples_diverse,
+    mmr_settings,
+    create_embeddings_batch,
     add_code_examples_to_supabase,
     update_source_info,
     extract_source_summary,
-    search_code_examples
+    search_code_examples,
+    canonicalize_url,
+    extract_canonical_url,
+    index_crawl_results,
+    find_crawl_result,
+    compute_simhash,
+    create_near_duplicate_detector
 )
+from crawl_jobs import (
+    CrawlJobStore,
+    JOB_RUNNING,
+    JOB_INTERRUPTED,
+    JOB_COMPLETED,
+    JOB_CANCELLED,
+    JOB_FAILED,
+    PAGE_PENDING,
+    PAGE_IN_PROGRESS,
+    PAGE_DONE,
+    PAGE_DUPLICATE,
+    PAGE_FAILED,
+    PAGE_WAITING
+)
+from job_queue import JobQueue, report_job_progress, LANE_INTERACTIVE, LANE_BULK
+from page_processing import PageProcessor, deduplicate_code_blocks
+from code_summaries import CodeSummarizer
+from searxng_client import SearxngClient
+from vector_ranking import cosine_similarities, top_k_per_group
+from responses import dumps, get_document, load_page
+from metrics import increment, propagate, span, start_metrics_server, traced_tool
+from retrieval_cache import RETRIEVAL_CACHE
 
 # Import knowledge graph modules
 from knowledge_graph_validator import KnowledgeGraphValidator
@@ -122,6 +158,100 @@ class Crawl4AIContext:
     reranking_model: Optional[CrossEncoder] = None
     knowledge_validator: Optional[Any] = None  # KnowledgeGraphValidator when available
     repo_extractor: Optional[Any] = None       # DirectNeo4jExtractor when available
+    crawl_job_store: Optional[CrawlJobStore] = None
+    job_queue: Optional[JobQueue] = None
+    page_processor: Optional[PageProcessor] = None
+    code_summarizer: Optional[CodeSummarizer] = None
+    searxng_client: Optional[SearxngClient] = None
+
+# Resource types the text extraction crawl profile never downloads - only the DOM is needed for markdown
+TEXT_PROFILE_BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet", "texttrack", "manifest"}
+
+# Analytics, tag manager and ad hosts whose scripts never contribute page content
+TEXT_PROFILE_BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "connect.facebook.net",
+    "hotjar.com",
+    "segment.io",
+    "segment.com",
+    "mixpanel.com",
+    "clarity.ms",
+    "nr-data.net",
+    "intercomcdn.com",
+    "plausible.io"
+)
+
+def get_crawl_profile() -> str:
+    """Get the crawl profile: 'text' (lean, text extraction only) or 'full' (unmodified browser)."""
+    return os.getenv("CRAWL_PROFILE", "text").strip().lower()
+
+def build_browser_config() -> BrowserConfig:
+    """
+    Build the browser configuration for the active crawl profile.
+    
+    The text profile runs Chromium in light mode (no background networking, extensions,
+    sync, translate, ...) with image loading disabled. JavaScript stays enabled so
+    client-rendered documentation sites still produce content.
+    
+    Returns:
+        BrowserConfig for the crawler
+    """
+    if get_crawl_profile() != "text":
+        return BrowserConfig(headless=True, verbose=False)
+    
+    return BrowserConfig(
+        headless=True,
+        verbose=False,
+        light_mode=True,
+        extra_args=[
+            "--blink-settings=imagesEnabled=false",
+            "--disable-remote-fonts",
+            "--autoplay-policy=user-gesture-required",
+            "--disable-notifications"
+        ]
+    )
+
+def build_crawler_run_config(**kwargs) -> CrawlerRunConfig:
+    """
+    Build a per-crawl configuration for the active crawl profile.
+    
+    The text profile caps page-load and settle times (CRAWL_PAGE_TIMEOUT_MS, CRAWL_DELAY_BEFORE_RETURN)
+    and returns as soon as the DOM is ready.
+    
+    Args:
+        **kwargs: Additional CrawlerRunConfig options (cache_mode, stream, ...)
+        
+    Returns:
+        CrawlerRunConfig for the crawl
+    """
+    if get_crawl_profile() != "text":
+        return CrawlerRunConfig(**kwargs)
+    
+    return CrawlerRunConfig(
+        wait_until="domcontentloaded",
+        page_timeout=int(os.getenv("CRAWL_PAGE_TIMEOUT_MS", "30000")),
+        delay_before_return_html=float(os.getenv("CRAWL_DELAY_BEFORE_RETURN", "0.05")),
+        wait_for_images=False,
+        **kwargs
+    )
+
+async def _abort_heavy_resources(route):
+    """Playwright route handler that aborts requests the text profile does not need."""
+    request = route.request
+    host = urlparse(request.url).hostname or ""
+    blocked_host = any(host == blocked or host.endswith("." + blocked) for blocked in TEXT_PROFILE_BLOCKED_HOSTS)
+    if request.resource_type in TEXT_PROFILE_BLOCKED_RESOURCE_TYPES or blocked_host:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def block_heavy_resources_hook(page, context=None, **kwargs):
+    """Crawl4AI on_page_context_created hook that installs resource blocking on every new page."""
+    await page.route("**/*", _abort_heavy_resources)
+    return page
 
 @asynccontextmanager
 async def crawl4ai_lifespan(server: FastMCP) -> AsyncIterator[Crawl4AIContext]:
@@ -134,19 +264,38 @@ async def crawl4ai_lifespan(server: FastMCP) -> AsyncIterator[Crawl4AIContext]:
     Yields:
         Crawl4AIContext: The context containing the Crawl4AI crawler and Supabase client
     """
-    # Create browser configuration
-    browser_config = BrowserConfig(
-        headless=True,
-        verbose=False
-    )
+    # Start page processing workers first, so they are forked before the browser and other clients exist
+    page_processor = PageProcessor.from_env()
+    try:
+        page_processor.start()
+        if page_processor.worker_processes:
+            print(f"Started {page_processor.worker_processes} page processing worker process(es)")
+    except Exception as e:
+        print(f"Failed to start page processing workers, processing pages inline: {e}")
+        page_processor = PageProcessor()
+    
+    # Create browser configuration for the active crawl profile
+    browser_config = build_browser_config()
     
     # Initialize the crawler
     crawler = AsyncWebCrawler(config=browser_config)
+    if get_crawl_profile() == "text":
+        crawler.crawler_strategy.set_hook("on_page_context_created", block_heavy_resources_hook)
     await crawler.__aenter__()
     
     # Initialize Supabase client
     supabase_client = get_supabase_client()
     
+    # Initialize the crawl job store; jobs left running by a previous process can be resumed
+    crawl_job_store = None
+    try:
+        crawl_job_store = CrawlJobStore()
+        interrupted_jobs = crawl_job_store.mark_running_jobs_interrupted()
+        if interrupted_jobs:
+            print(f"{interrupted_jobs} crawl job(s) were interrupted and can be resumed with resume_crawl_job")
+    except Exception as e:
+        print(f"Failed to open crawl job store: {e}")
+    
     # Initialize cross-encoder model for reranking if enabled
     reranking_model = None
     if os.getenv("USE_RERANKING", "false") == "true":
@@ -191,16 +340,52 @@ async def crawl4ai_lifespan(server: FastMCP) -> AsyncIterator[Crawl4AIContext]:
     else:
         print("Knowledge graph functionality disabled - set USE_KNOWLEDGE_GRAPH=true to enable")
     
+    # Start the background job workers
+    job_queue = JobQueue.from_env()
+    await job_queue.start()
+    
+    # One bounded pool (and summary cache) for all code example summaries of the server
+    code_summarizer = CodeSummarizer.from_env()
+    
+    # One pooled, caching SearXNG client for all searches of the server
+    searxng_client = SearxngClient.from_env()
+    
+    # Prometheus metrics endpoint, when METRICS_PORT is set
+    metrics_server = None
     try:
-        yield Crawl4AIContext(
-            crawler=crawler,
-            supabase_client=supabase_client,
-            reranking_model=reranking_model,
-            knowledge_validator=knowledge_validator,
-            repo_extractor=repo_extractor
-        )
+        metrics_server = start_metrics_server()
+        if metrics_server:
+            print(f"Serving metrics on port {metrics_server.server_address[1]} at /metrics")
+    except Exception as e:
+        print(f"Failed to start metrics server: {e}")
+    
+    context = Crawl4AIContext(
+        crawler=crawler,
+        supabase_client=supabase_client,
+        reranking_model=reranking_model,
+        knowledge_validator=knowledge_validator,
+        repo_extractor=repo_extractor,
+        crawl_job_store=crawl_job_store,
+        job_queue=job_queue,
+        page_processor=page_processor,
+        code_summarizer=code_summarizer,
+        searxng_client=searxng_client
+    )
+    
+    try:
+        yield context
     finally:
         # Clean up all components
+        if metrics_server:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        await job_queue.shutdown()
+        if searxng_client:
+            await searxng_client.close()
+        if crawl_job_store:
+            crawl_job_store.close()
+        code_summarizer.shutdown()
+        page_processor.shutdown()
         await crawler.__aexit__(None, None, None)
         if knowledge_validator:
             try:
@@ -224,6 +409,7 @@ mcp = FastMCP(
     port=os.getenv("PORT", "8051")
 )
 
+@span("rerank")
 def rerank_results(model: CrossEncoder, query: str, results: List[Dict[str, Any]], content_key: str = "content") -> List[Dict[str, Any]]:
     """
     Rerank search results using a cross-encoder model.
@@ -308,86 +494,688 @@ def parse_sitemap(sitemap_url: str) -> List[str]:
 
     return urls
 
-def smart_chunk_markdown(text: str, chunk_size: int = 5000) -> List[str]:
-    """Split text into chunks, respecting code blocks and paragraphs."""
-    chunks = []
-    start = 0
-    text_length = len(text)
+def drop_duplicate_pages(crawl_results: List[Dict[str, Any]], near_duplicates: bool = True) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Remove pages that are canonical or near-duplicate copies of an earlier page.
+    
+    Pages are first keyed by their <link rel="canonical"> target (or their own canonicalized
+    URL), then compared by SimHash of their markdown, so duplicates are dropped before chunking.
+    
+    Args:
+        crawl_results: List of crawl result dictionaries with 'url' and 'markdown'
+        near_duplicates: Whether to also drop near-duplicates. Pass False for URLs the caller
+            listed explicitly, which must stay retrievable under their own URL.
+        
+    Returns:
+        Tuple containing:
+        - The unique crawl results, in their original order
+        - A list of {"url", "duplicate_of", "reason"} entries for the dropped pages
+    """
+    detector = create_near_duplicate_detector() if near_duplicates else None
+    canonical_owners = {}
+    unique_results = []
+    duplicates = []
+    
+    for doc in crawl_results:
+        canonical_key = canonicalize_url(doc.get('canonical_url') or doc['url'], drop_scheme=True)
+        if canonical_key in canonical_owners:
+            duplicates.append({"url": doc['url'], "duplicate_of": canonical_owners[canonical_key], "reason": "canonical"})
+            continue
+        
+        near_duplicate_of = detector.check(doc['url'], doc['markdown']) if detector else None
+        if near_duplicate_of:
+            duplicates.append({"url": doc['url'], "duplicate_of": near_duplicate_of, "reason": "near_duplicate"})
+            continue
+        
+        canonical_owners[canonical_key] = doc['url']
+        unique_results.append(doc)
+    
+    if duplicates:
+        print(f"Skipped {len(duplicates)} duplicate pages out of {len(crawl_results)}")
+    
+    return unique_results, duplicates
 
-    while start < text_length:
-        # Calculate end position
-        end = start + chunk_size
+def _store_code_examples(
+    supabase_client: Client,
+    pages: List[Tuple[str, List[Any]]],
+    batch_size: int = 20,
+    code_summarizer: Optional[CodeSummarizer] = None
+) -> int:
+    """
+    Summarize and store the code examples of crawled pages.
+    
+    Blocks repeated across pages of a site are summarized and stored once, and summaries
+    come from the code summarizer's cache where possible.
+    
+    Args:
+        supabase_client: Supabase client
+        pages: (url, code blocks) for each page, in crawl order
+        batch_size: Batch size for database operations
+        code_summarizer: Shared CodeSummarizer (a temporary one without a cache is used if not given)
+        
+    Returns:
+        Number of code examples stored
+    """
+    unique_blocks = deduplicate_code_blocks(pages)
+    if not unique_blocks:
+        return 0
+    
+    summarizer = code_summarizer or CodeSummarizer()
+    try:
+        summaries = summarizer.summarize(
+            [(block.code, block.context_before, block.context_after) for _, block, _ in unique_blocks]
+        )
+    finally:
+        if code_summarizer is None:
+            summarizer.shutdown()
+    
+    code_urls = []
+    code_chunk_numbers = []
+    code_examples = []
+    code_metadatas = []
+    for (source_url, block, duplicate_urls), summary in zip(unique_blocks, summaries):
+        parsed_url = urlparse(source_url)
+        source_id = parsed_url.netloc or parsed_url.path
+        code = block.code
+        
+        code_urls.append(source_url)
+        code_chunk_numbers.append(len(code_examples))  # Use global code example index
+        code_examples.append(code)
+        
+        code_meta = {
+            "chunk_index": len(code_examples) - 1,
+            "url": source_url,
+            "source": source_id,
+            "char_count": len(code),
+            "word_count": len(code.split())
+        }
+        if duplicate_urls:
+            code_meta["duplicate_urls"] = duplicate_urls
+        code_metadatas.append(code_meta)
+    
+    add_code_examples_to_supabase(
+        supabase_client,
+        code_urls,
+        code_chunk_numbers,
+        code_examples,
+        summaries,
+        code_metadatas,
+        batch_size=batch_size
+    )
+    return len(code_examples)
 
-        # If we're at the end of the text, just take what's left
-        if end >= text_length:
-            chunks.append(text[start:].strip())
-            break
+def _defer_contextual_embeddings(
+    job_queue: Optional[JobQueue],
+    supabase_client: Client,
+    url_to_full_document: Dict[str, str],
+    batch_size: int = 20
+) -> Optional[str]:
+    """
+    Queue the second ingestion phase: contextual embeddings for pages just stored with plain ones.
+    
+    Args:
+        job_queue: The server's job queue
+        supabase_client: Supabase client
+        url_to_full_document: Dictionary mapping the stored URLs to their full document content
+        batch_size: Batch size for embedding requests
+        
+    Returns:
+        ID of the queued bulk-lane job, or None if contextual embeddings are not deferred
+    """
+    if not url_to_full_document or not contextual_embeddings_deferred():
+        return None
+    if job_queue is None:
+        print("No job queue available; stored pages keep their plain embeddings")
+        return None
+    
+    async def run(job):
+        return await asyncio.get_event_loop().run_in_executor(
+            None,
+            propagate(lambda: contextualize_stored_pages(supabase_client, list(url_to_full_document), url_to_full_document, batch_size=batch_size))
+        )
+    
+    job = job_queue.submit(
+        "contextualize_pages",
+        run,
+        description=f"Contextual embeddings for {len(url_to_full_document)} page(s)",
+        lane=LANE_BULK
+    )
+    return job.job_id
 
-        # Try to find a code block boundary first (```)
-        chunk = text[start:end]
-        code_block = chunk.rfind('```')
-        if code_block != -1 and code_block > chunk_size * 0.3:
-            end = start + code_block
+def _store_crawl_results(
+    supabase_client: Client,
+    crawl_results: List[Dict[str, Any]],
+    crawl_type: str,
+    crawl_time: str,
+    chunk_size: int = 5000,
+    batch_size: int = 20,
+    known_sources: Optional[set] = None,
+    page_processor: Optional[PageProcessor] = None,
+    code_summarizer: Optional[CodeSummarizer] = None
+) -> Dict[str, Any]:
+    """
+    Chunk crawled pages and store them (and their code examples) in Supabase.
+    
+    Args:
+        supabase_client: Supabase client
+        crawl_results: List of crawl result dictionaries with 'url' and 'markdown'
+        crawl_type: Crawl type recorded in each chunk's metadata
+        crawl_time: Crawl time marker recorded in each chunk's metadata
+        chunk_size: Maximum size of each content chunk in characters
+        batch_size: Batch size for database operations
+        known_sources: Optional set of source IDs whose summaries already exist. Summaries are only
+            generated for sources not in the set, and new sources are added to it.
+        page_processor: Optional PageProcessor for chunking pages on worker processes
+        code_summarizer: Optional shared CodeSummarizer for code example summaries
+        
+    Returns:
+        Dictionary with chunks_stored, code_examples_stored, sources_updated, chunks_per_url and
+        url_to_full_document (the stored pages, for _defer_contextual_embeddings)
+    """
+    urls = []
+    chunk_numbers = []
+    contents = []
+    metadatas = []
+    chunks_per_url = {}
+    
+    # Track sources and their content
+    source_content_map = {}
+    source_word_counts = {}
+    
+    # Chunk pages and extract section info and code blocks (on worker processes if configured)
+    extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
+    with span("chunking"):
+        processed_pages = (page_processor or PageProcessor()).process_pages(
+            [doc['markdown'] for doc in crawl_results],
+            chunk_size=chunk_size,
+            extract_code=extract_code_examples_enabled
+        )
+    
+    # Process documentation chunks
+    for doc, processed in zip(crawl_results, processed_pages):
+        source_url = doc['url']
+        md = doc['markdown']
+        chunks = processed['chunks']
+        chunks_per_url[source_url] = len(chunks)
+        
+        # Extract source_id
+        parsed_url = urlparse(source_url)
+        source_id = parsed_url.netloc or parsed_url.path
+        
+        # Store content for source summary generation
+        if source_id not in source_content_map:
+            source_content_map[source_id] = md[:5000]  # Store first 5000 chars
+            source_word_counts[source_id] = 0
+        
+        for i, (chunk, meta) in enumerate(zip(chunks, processed['sections'])):
+            urls.append(source_url)
+            chunk_numbers.append(i)
+            contents.append(chunk)
+            
+            # Add metadata
+            meta["chunk_index"] = i
+            meta["url"] = source_url
+            meta["source"] = source_id
+            meta["crawl_type"] = crawl_type
+            meta["crawl_time"] = crawl_time
+            metadatas.append(meta)
+            
+            # Accumulate word count
+            source_word_counts[source_id] += meta.get("word_count", 0)
+    
+    # Create url_to_full_document mapping
+    url_to_full_document = {}
+    for doc in crawl_results:
+        url_to_full_document[doc['url']] = doc['markdown']
+    
+    # Update source information for each unique source FIRST (before inserting documents)
+    if known_sources is not None:
+        source_content_map = {source_id: content for source_id, content in source_content_map.items()
+                              if source_id not in known_sources}
+        known_sources.update(source_content_map)
+    
+    if source_content_map:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+            source_summary_args = [(source_id, content) for source_id, content in source_content_map.items()]
+            source_summaries = list(executor.map(propagate(lambda args: extract_source_summary(args[0], args[1])), source_summary_args))
+        
+        for (source_id, _), summary in zip(source_summary_args, source_summaries):
+            word_count = source_word_counts.get(source_id, 0)
+            update_source_info(supabase_client, source_id, summary, word_count)
+    
+    # Add documentation chunks to Supabase (AFTER sources exist)
+    if contents:
+        add_documents_to_supabase(supabase_client, urls, chunk_numbers, contents, metadatas, url_to_full_document, batch_size=batch_size)
+        add_sections_to_supabase(
+            supabase_client,
+            [doc['url'] for doc in crawl_results],
+            [processed['outline'] for processed in processed_pages],
+            batch_size=batch_size
+        )
+    
+    # Extract and process code examples from all documents only if enabled
+    code_examples_stored = 0
+    if extract_code_examples_enabled:
+        # Code blocks were extracted from all documents along with their chunks
+        code_examples_stored = _store_code_examples(
+            supabase_client,
+            [(doc['url'], processed['code_blocks']) for doc, processed in zip(crawl_results, processed_pages)],
+            batch_size=batch_size,
+            code_summarizer=code_summarizer
+        )
+    
+    return {
+        "chunks_stored": len(contents),
+        "code_examples_stored": code_examples_stored,
+        "sources_updated": list(source_content_map),
+        "chunks_per_url": chunks_per_url,
+        "url_to_full_document": url_to_full_document if contents else {}
+    }
 
-        # If no code block, try to break at a paragraph
-        elif '\n\n' in chunk:
-            # Find the last paragraph break
-            last_break = chunk.rfind('\n\n')
-            if last_break > chunk_size * 0.3:  # Only break if we're past 30% of chunk_size
-                end = start + last_break
+def _submit_background_job(ctx: Context, kind: str, description: str, lane: str, run_tool) -> str:
+    """
+    Run a tool invocation as a background job and return its job ID right away.
+    
+    Args:
+        ctx: The MCP server provided context
+        kind: Job kind (the tool name)
+        description: Human-readable description of the job
+        lane: LANE_INTERACTIVE or LANE_BULK
+        run_tool: Zero-argument coroutine function returning the tool's JSON string result
+        
+    Returns:
+        JSON string with the job ID and lane
+    """
+    async def run(job):
+        result_str = await run_tool()
+        try:
+            return json.loads(result_str)
+        except json.JSONDecodeError:
+            return result_str
+    
+    job = ctx.request_context.lifespan_context.job_queue.submit(kind, run, description=description, lane=lane)
+    return dumps({
+        "success": True,
+        "background": True,
+        "job_id": job.job_id,
+        "kind": kind,
+        "lane": lane,
+        "status": job.status,
+        "message": "Job queued. Use wait_for_job to stream its progress or get_job_status to poll it."
+    })
 
-        # If no paragraph break, try to break at a sentence
-        elif '. ' in chunk:
-            # Find the last sentence break
-            last_period = chunk.rfind('. ')
-            if last_period > chunk_size * 0.3:  # Only break if we're past 30% of chunk_size
-                end = start + last_period + 1
+def _format_url_rag_results(rag_result: Dict[str, Any]) -> Union[List[Dict[str, Any]], str]:
+    """Reduce a perform_rag_query result to the per-URL entries of the search response, or an explanation."""
+    if rag_result.get("success", False) and rag_result.get("results"):
+        return [{
+            "content": result.get("content", ""),
+            "similarity": result.get("similarity", 0),
+            "metadata": result.get("metadata", {})
+        } for result in rag_result["results"]]
+    return f"No relevant results: {rag_result.get('error', 'No RAG results found')}"
 
-        # Extract chunk and clean it up
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
+def _combine_hybrid_results(vector_results: List[Dict[str, Any]], keyword_results: List[Dict[str, Any]], match_count: int) -> List[Dict[str, Any]]:
+    """
+    Combine vector and keyword search results on crawled pages, preferring chunks found by both.
+    
+    Args:
+        vector_results: Vector search rows (with similarity)
+        keyword_results: Keyword (ILIKE) search rows
+        match_count: Maximum number of results
+        
+    Returns:
+        Chunks found by both searches (similarity boosted), then the other vector matches,
+        then keyword-only matches
+    """
+    seen_ids = set()
+    combined_results = []
+    
+    # First, add items that appear in both searches (these are the best matches)
+    vector_ids = {r.get('id') for r in vector_results if r.get('id')}
+    for kr in keyword_results:
+        if kr['id'] in vector_ids and kr['id'] not in seen_ids:
+            # Find the vector result to get similarity score
+            for vr in vector_results:
+                if vr.get('id') == kr['id']:
+                    # Boost similarity score for items in both results
+                    vr['similarity'] = min(1.0, vr.get('similarity', 0) * 1.2)
+                    combined_results.append(vr)
+                    seen_ids.add(kr['id'])
+                    break
+    
+    # Then add remaining vector results (semantic matches without exact keyword)
+    for vr in vector_results:
+        if vr.get('id') and vr['id'] not in seen_ids and len(combined_results) < match_count:
+            combined_results.append(vr)
+            seen_ids.add(vr['id'])
+    
+    # Finally, add pure keyword matches if we still need more results
+    for kr in keyword_results:
+        if kr['id'] not in seen_ids and len(combined_results) < match_count:
+            # Convert keyword result to match vector result format
+            combined_results.append({
+                'id': kr['id'],
+                'url': kr['url'],
+                'chunk_number': kr['chunk_number'],
+                'content': kr['content'],
+                'metadata': kr['metadata'],
+                'source_id': kr['source_id'],
+                'similarity': 0.5  # Default similarity for keyword-only matches
+            })
+            seen_ids.add(kr['id'])
+    
+    return combined_results[:match_count]
 
-        # Move start position for next chunk
-        start = end
+async def _rag_query_by_url(ctx: Context, query: str, urls: List[str], match_count: int = 5, max_rerank_workers: int = 5, stored_as: Optional[Dict[str, str]] = None) -> Dict[str, Union[List[Dict[str, Any]], str]]:
+    """
+    Query the stored chunks of each of the given pages, with one embedding and one RPC for all of them.
+    
+    With USE_HYBRID_SEARCH, one keyword query over all the pages is merged into each page's
+    vector results, as in perform_rag_query.
+    
+    Args:
+        ctx: The MCP server provided context
+        query: The search query
+        urls: URLs of the stored pages
+        match_count: Maximum results per URL
+        max_rerank_workers: Maximum URLs reranked concurrently (if reranking is enabled)
+        stored_as: URLs whose page was stored under another URL (duplicate_of), queried under that URL
+        
+    Returns:
+        Dictionary mapping each URL to its search response entries, or an explanation
+    """
+    if stored_as:
+        owner_results = await _rag_query_by_url(
+            ctx, query, list(dict.fromkeys(stored_as.get(url, url) for url in urls)), match_count, max_rerank_workers
+        )
+        return {url: owner_results[stored_as.get(url, url)] for url in urls}
+    
+    lifespan_context = ctx.request_context.lifespan_context
+    supabase_client = lifespan_context.supabase_client
+    use_hybrid_search = os.getenv("USE_HYBRID_SEARCH", "false") == "true"
+    # Hybrid search gets double the vector results to have room for the keyword matches
+    vector_count = match_count * 2 if use_hybrid_search else match_count
+    try:
+        results_by_url = await asyncio.wait_for(
+            asyncio.get_event_loop().run_in_executor(
+                None,
+                propagate(lambda: search_documents_by_url(supabase_client, query, urls, vector_count))
+            ),
+            timeout=30.0
+        )
+    except asyncio.TimeoutError:
+        return {url: "RAG query timed out after 30 seconds" for url in urls}
+    
+    if use_hybrid_search:
+        try:
+            keyword_query = supabase_client.from_('crawled_pages')\
+                .select('id, url, chunk_number, content, metadata, source_id')\
+                .ilike('content', f'%{query}%')\
+                .in_('url', list(dict.fromkeys(urls)))\
+                .limit(match_count * 2 * len(urls))
+            with span("keyword_search"):
+                keyword_response = await asyncio.wait_for(
+                    asyncio.get_event_loop().run_in_executor(None, lambda: keyword_query.execute()),
+                    timeout=10.0
+                )
+            keyword_results = keyword_response.data or []
+        except asyncio.TimeoutError:
+            print("Keyword search timed out")
+            keyword_results = []
+        except Exception as e:
+            print(f"Keyword search failed: {e}")
+            keyword_results = []
+        
+        keyword_by_url: Dict[str, List[Dict[str, Any]]] = {}
+        for row in keyword_results:
+            keyword_by_url.setdefault(row['url'], []).append(row)
+        results_by_url = {
+            url: _combine_hybrid_results(results_by_url.get(url, []), keyword_by_url.get(url, []), match_count)
+            for url in urls
+        }
+    
+    reranking_model = lifespan_context.reranking_model
+    if os.getenv("USE_RERANKING", "false") == "true" and reranking_model is not None:
+        semaphore = asyncio.Semaphore(max_rerank_workers)
+        
+        async def rerank(url: str, url_results: List[Dict[str, Any]]):
+            async with semaphore:
+                try:
+                    results_by_url[url] = await asyncio.get_event_loop().run_in_executor(
+                        None,
+                        propagate(lambda: rerank_results(reranking_model, query, url_results, content_key="content"))
+                    )
+                except Exception as e:
+                    print(f"Reranking failed for {url}: {e}, using original results")
+        
+        await asyncio.gather(*(rerank(url, url_results) for url, url_results in list(results_by_url.items())))
+    
+    return {
+        url: _format_url_rag_results({"success": True, "results": results_by_url.get(url),
+                                      "error": "No matching chunks stored for this URL"})
+        for url in urls
+    }
 
-    return chunks
+def _persist_crawl_results_in_background(lifespan_context: Crawl4AIContext, crawl_results: List[Dict[str, Any]], crawl_type: str, batch_size: int = 20) -> Optional[str]:
+    """
+    Queue storing already crawled pages (chunks, code examples, sections and sources) as a bulk-lane job.
+    
+    Returns:
+        ID of the queued job, or None if there is nothing to store or no job queue
+    """
+    if not crawl_results or lifespan_context.job_queue is None:
+        return None
+    supabase_client = lifespan_context.supabase_client
+    
+    async def run(job):
+        pages, _ = drop_duplicate_pages(crawl_results, near_duplicates=False)
+        store_stats = await asyncio.get_event_loop().run_in_executor(
+            None,
+            propagate(lambda: _store_crawl_results(
+                supabase_client,
+                pages,
+                crawl_type,
+                crawl_time=f"persist_job:{job.job_id}",
+                batch_size=batch_size,
+                page_processor=lifespan_context.page_processor,
+                code_summarizer=lifespan_context.code_summarizer
+            ))
+        )
+        contextualization_job_id = _defer_contextual_embeddings(
+            lifespan_context.job_queue, supabase_client, store_stats["url_to_full_document"], batch_size
+        )
+        return {
+            "chunks_stored": store_stats["chunks_stored"],
+            "code_examples_stored": store_stats["code_examples_stored"],
+            "contextualization_job_id": contextualization_job_id
+        }
+    
+    job = lifespan_context.job_queue.submit(
+        "persist_pages",
+        run,
+        description=f"Store {len(crawl_results)} page(s) from {crawl_type}",
+        lane=LANE_BULK
+    )
+    return job.job_id
 
-def extract_section_info(chunk: str) -> Dict[str, Any]:
+async def _ephemeral_search(ctx: Context, query: str, urls: List[str], batch_size: int, max_concurrent: int, match_count: int = 5, persist: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
-    Extracts headers and stats from a chunk.
+    Rank the chunks of freshly crawled pages against the query in memory, without storing them first.
+    
+    Pages are crawled and chunked, the query and chunks are embedded together, and the best
+    chunks of each page are selected by cosine similarity with NumPy (then reranked if enabled).
     
     Args:
-        chunk: Markdown chunk
+        ctx: The MCP server provided context
+        query: The search query
+        urls: URLs to crawl and rank
+        batch_size: Embedding batch size
+        max_concurrent: Maximum concurrent browser sessions
+        match_count: Maximum results per URL
+        persist: Also store the pages in the database in a background job
         
     Returns:
-        Dictionary with headers and stats
+        Tuple of (results by URL, statistics with chunks_ranked and persist_job_id)
     """
-    headers = re.findall(r'^(#+)\s+(.+)$', chunk, re.MULTILINE)
-    header_str = '; '.join([f'{h[0]} {h[1]}' for h in headers]) if headers else ''
+    lifespan_context = ctx.request_context.lifespan_context
+    crawl_results = await crawl_batch(lifespan_context.crawler, urls, max_concurrent)
+    results_data: Dict[str, Any] = {url: "No content retrieved" for url in urls}
+    if not crawl_results:
+        return results_data, {"chunks_ranked": 0, "persist_job_id": None}
+    
+    page_processor = lifespan_context.page_processor or PageProcessor()
+    with span("chunking"):
+        processed_pages = await asyncio.get_event_loop().run_in_executor(
+            None,
+            lambda: page_processor.process_pages([cr['markdown'] for cr in crawl_results], chunk_size=5000)
+        )
+    
+    chunk_urls, chunk_texts, chunk_metadatas = [], [], []
+    for cr, processed in zip(crawl_results, processed_pages):
+        for i, (chunk, section) in enumerate(zip(processed['chunks'], processed['sections'])):
+            chunk_urls.append(cr['url'])
+            chunk_texts.append(chunk)
+            chunk_metadatas.append({
+                "url": cr['url'],
+                "chunk_index": i,
+                "headers": section.get("headers", ""),
+                "heading_path": section.get("heading_path", []),
+                "source": urlparse(cr['url']).netloc or urlparse(cr['url']).path
+            })
+    
+    # The query rides along in the first embedding batch
+    def embed_all() -> List[List[float]]:
+        texts = [query] + chunk_texts
+        embeddings = []
+        for i in range(0, len(texts), batch_size):
+            embeddings.extend(create_embeddings_batch(texts[i:i + batch_size]))
+        return embeddings
+    
+    persist_job_id = None
+    if persist:
+        persist_job_id = _persist_crawl_results_in_background(lifespan_context, crawl_results, "search", batch_size)
+    stats = {"chunks_ranked": len(chunk_texts), "persist_job_id": persist_job_id}
+    
+    embeddings = await asyncio.get_event_loop().run_in_executor(None, propagate(embed_all))
+    # A failed embedding comes back as zeros, which would rank every chunk at 0.0
+    if all(v == 0.0 for v in embeddings[0]):
+        print("[ERROR] Failed to create valid embedding")
+        return {url: "RAG query failed: could not create the query embedding" for url in urls}, {**stats, "chunks_ranked": 0}
+    
+    with span("rank"):
+        scores = cosine_similarities(embeddings[0], embeddings[1:])
+        best_by_url = top_k_per_group(scores, chunk_urls, match_count)
+    
+    reranking_model = lifespan_context.reranking_model
+    use_reranking = os.getenv("USE_RERANKING", "false") == "true" and reranking_model is not None
+    crawl_index = index_crawl_results(crawl_results)
+    for url in urls:
+        crawl_result = find_crawl_result(crawl_index, url)
+        if crawl_result is None:
+            continue
+        url_results = [{
+            "content": chunk_texts[i],
+            "similarity": round(score, 4),
+            "metadata": chunk_metadatas[i]
+        } for i, score in best_by_url.get(crawl_result['url'], [])]
+        if use_reranking and url_results:
+            url_results = await asyncio.get_event_loop().run_in_executor(
+                None,
+                propagate(lambda: rerank_results(reranking_model, query, url_results, content_key="content"))
+            )
+        results_data[url] = url_results or "No relevant results: page produced no chunks"
+    
+    return results_data, stats
 
-    return {
-        "headers": header_str,
-        "char_count": len(chunk),
-        "word_count": len(chunk.split())
-    }
+# Per-URL search pipelines still indexing after their search returned at its deadline
+_background_search_tasks = set()
 
-def process_code_example(args):
+async def _progressive_search(ctx: Context, query: str, urls: List[str], batch_size: int, max_concurrent: int, deadline_seconds: float) -> Tuple[Dict[str, Any], Dict[str, Any]]:
     """
-    Process a single code example to generate its summary.
-    This function is designed to be used with concurrent.futures.
+    Run crawl, chunk, embed, store and RAG query for each URL on its own, collecting results as they finish.
+    
+    Each finished URL is reported right away as an MCP progress notification plus a log message
+    carrying its results. At the deadline, whatever is ready is returned; the remaining URLs
+    keep being indexed in the background so later queries can find them.
     
     Args:
-        args: Tuple containing (code, context_before, context_after)
+        ctx: The MCP server provided context
+        query: The search query to run against each indexed URL
+        urls: URLs to index and query
+        batch_size: Batch size for database operations
+        max_concurrent: Maximum URLs indexed at once
+        deadline_seconds: Seconds until the results gathered so far are returned
         
     Returns:
-        The generated summary
+        Tuple of (results by URL, pipeline statistics)
     """
-    code, context_before, context_after = args
-    return generate_code_example_summary(code, context_before, context_after)
+    lifespan_context = ctx.request_context.lifespan_context
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(max(1, max_concurrent))
+    
+    async def pipeline(url: str):
+        async with semaphore:
+            ingest_result = json.loads(await _process_multiple_urls(
+                lifespan_context.crawler,
+                lifespan_context.supabase_client,
+                [url],
+                1,
+                batch_size,
+                time.time(),
+                page_processor=lifespan_context.page_processor,
+                code_summarizer=lifespan_context.code_summarizer,
+                job_queue=lifespan_context.job_queue
+            ))
+        if not ingest_result.get("success"):
+            return url, f"Scraping failed: {ingest_result.get('error', 'No content retrieved')}"
+        if time.time() - start_time >= deadline_seconds:
+            # Answered without this URL; it is indexed now, so skip the query embedding and RPC
+            return url, None
+        return url, (await _rag_query_by_url(ctx, query, [url], match_count=5))[url]
+    
+    async def notify(done: int, url: str, url_results: Any):
+        try:
+            await ctx.report_progress(done, len(urls))
+            await ctx.info(json.dumps({"url": url, "results": url_results}))
+        except Exception as e:
+            print(f"Could not send progress for {url}: {e}")
+    
+    tasks = {asyncio.create_task(pipeline(url)): url for url in urls}
+    results_data = {}
+    first_result_seconds = None
+    pending = set(tasks)
+    while pending:
+        remaining = deadline_seconds - (time.time() - start_time)
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            url = tasks[task]
+            try:
+                _, url_results = task.result()
+            except Exception as e:
+                url_results = f"Processing error: {str(e)}"
+            if url_results is None:
+                url_results = f"Indexed after the {deadline_seconds}s deadline"
+            results_data[url] = url_results
+            if isinstance(url_results, list) and first_result_seconds is None:
+                first_result_seconds = round(time.time() - start_time, 2)
+            await notify(len(results_data), url, url_results)
+    
+    for task in pending:
+        results_data[tasks[task]] = f"Still indexing after the {deadline_seconds}s deadline"
+        _background_search_tasks.add(task)
+        task.add_done_callback(_background_search_tasks.discard)
+    
+    return {url: results_data[url] for url in urls}, {
+        "first_result_seconds": first_result_seconds,
+        "urls_pending": len(pending),
+        "deadline_seconds": deadline_seconds
+    }
 
 @mcp.tool()
-async def search(ctx: Context, query: str, return_raw_markdown: bool = False, num_results: int = 6, batch_size: int = 20, max_concurrent: int = 10, max_rag_workers: int = 5) -> str:
+@traced_tool
+async def search(ctx: Context, query: str, return_raw_markdown: bool = False, num_results: int = 6, batch_size: int = 20, max_concurrent: int = 10, max_rag_workers: int = 5, progressive: bool = False, deadline_seconds: float = None, ephemeral: bool = False, persist: bool = None) -> str:
     """
     Comprehensive search tool that integrates SearXNG search with scraping and RAG functionality.
     Optionally, use `return_raw_markdown=true` to return raw markdown for more detailed analysis.
@@ -398,13 +1186,25 @@ async def search(ctx: Context, query: str, return_raw_markdown: bool = False, nu
     3. Scrapes all returned URLs using existing scraping functionality
     4. Returns organized results with comprehensive metadata
     
+    With `progressive=true`, each URL is crawled, stored and queried on its own, and its
+    results are sent as a progress notification as soon as they are ready. The tool returns
+    what is ready at `deadline_seconds`; slower URLs keep being indexed in the background.
+    
+    With `ephemeral=true`, the crawled pages are chunked, embedded and ranked against the
+    query in memory, without waiting for them to be stored; with `persist=true` they are
+    also stored in the database by a background job.
+    
     Args:
         query: The search query for SearXNG
-        return_raw_markdown: If True, skip embedding/RAG and return raw markdown content (default: False)
+        return_raw_markdown: If True, return the crawled markdown without embedding or storing it (default: False)
         num_results: Number of search results to return from SearXNG (default: 6)
         batch_size: Batch size for database operations (default: 20)
         max_concurrent: Maximum concurrent browser sessions for scraping (default: 10)
-        max_rag_workers: Maximum concurrent RAG query workers for parallel processing (default: 5)
+        max_rag_workers: Maximum URLs reranked concurrently (default: 5)
+        progressive: Query each URL as soon as it is indexed instead of after all URLs (default: False)
+        deadline_seconds: Progressive mode time budget (default: SEARCH_DEADLINE_SECONDS or 60)
+        ephemeral: Rank fresh chunks in memory instead of querying the database (default: False)
+        persist: Ephemeral and raw markdown modes also store the pages in the background (default: SEARCH_EPHEMERAL_PERSIST or false)
     
     Returns:
         JSON string with search results, or raw markdown of each URL if `return_raw_markdown=true`
@@ -413,90 +1213,55 @@ async def search(ctx: Context, query: str, return_raw_markdown: bool = False, nu
     
     try:
         # Step 1: Environment validation - check if SEARXNG_URL is configured
-        searxng_url = os.getenv("SEARXNG_URL")
-        if not searxng_url:
-            return json.dumps({
+        searxng_client = ctx.request_context.lifespan_context.searxng_client
+        if not searxng_client:
+            return dumps({
                 "success": False,
                 "error": "SEARXNG_URL environment variable is not configured. Please set it to your SearXNG instance URL."
-            }, indent=2)
-        
-        searxng_url = searxng_url.rstrip('/')  # Remove trailing slash
-        search_endpoint = f"{searxng_url}/search"
-        
-        # Get optional configuration
-        user_agent = os.getenv("SEARXNG_USER_AGENT", "MCP-Crawl4AI-RAG-Server/1.0")
-        timeout = int(os.getenv("SEARXNG_TIMEOUT", "30"))
-        default_engines = os.getenv("SEARXNG_DEFAULT_ENGINES", "")
-        
-        # Step 2: SearXNG request - make HTTP GET request with parameters
-        headers = {
-            "User-Agent": user_agent,
-            "Accept": "application/json"
-        }
-        
-        # Prepare request parameters
-        params = {
-            "q": query,
-            "format": "json",
-            "categories": "general",
-            "limit": num_results  # SearXNG uses 'limit'
-        }
+            })
         
-        # Add engines if specified
-        if default_engines:
-            params["engines"] = default_engines
+        searxng_url = searxng_client.base_urls[0]
+        search_endpoint = searxng_client.search_endpoint
+        timeout = searxng_client.timeout
         
+        # Step 2: SearXNG request on the shared pooled client (cached, hedged across instances)
         print(f"Making SearXNG request to: {search_endpoint}")
-        print(f"Parameters: {params}")
-        
-        # Make the HTTP request to SearXNG
         try:
-            response = requests.get(
-                search_endpoint,
-                params=params,
-                headers=headers,
-                timeout=timeout
-            )
-            response.raise_for_status()  # Raise exception for HTTP errors
-            
-        except requests.exceptions.Timeout:
-            return json.dumps({
+            search_data, searxng_cached = await searxng_client.search(query, num_results=num_results)
+        except httpx.TimeoutException:
+            return dumps({
                 "success": False,
                 "error": f"SearXNG request timed out after {timeout} seconds. Check your SearXNG instance."
-            }, indent=2)
-        except requests.exceptions.ConnectionError:
-            return json.dumps({
+            })
+        except httpx.ConnectError:
+            return dumps({
                 "success": False,
                 "error": f"Cannot connect to SearXNG at {searxng_url}. Check the URL and ensure SearXNG is running."
-            }, indent=2)
-        except requests.exceptions.HTTPError as e:
-            return json.dumps({
+            })
+        except httpx.HTTPStatusError as e:
+            return dumps({
                 "success": False,
                 "error": f"SearXNG HTTP error: {e}. Check your SearXNG configuration."
-            }, indent=2)
-        except Exception as e:
-            return json.dumps({
-                "success": False,
-                "error": f"SearXNG request failed: {str(e)}"
-            }, indent=2)
-        
-        # Step 3: Response parsing - extract URLs from SearXNG JSON response
-        try:
-            search_data = response.json()
+            })
         except json.JSONDecodeError as e:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": f"Invalid JSON response from SearXNG: {str(e)}"
-            }, indent=2)
+            })
+        except Exception as e:
+            return dumps({
+                "success": False,
+                "error": f"SearXNG request failed: {str(e)}"
+            })
         
         # Extract results from response
         results = search_data.get("results", [])
         if not results:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "query": query,
                 "error": "No search results returned from SearXNG"
-            }, indent=2)
+            })
         
         # Step 4: URL filtering - limit to num_results and validate URLs
         valid_urls = []
@@ -506,151 +1271,139 @@ async def search(ctx: Context, query: str, return_raw_markdown: bool = False, nu
                 valid_urls.append(url)
         
         if not valid_urls:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "query": query,
                 "error": "No valid URLs found in search results"
-            }, indent=2)
+            })
         
         print(f"Found {len(valid_urls)} valid URLs to process")
         
-        # Step 5: Content processing - use existing scrape_urls function
-        try:
-            # Use the existing scrape_urls function to scrape all URLs
-            scrape_result_str = await scrape_urls(ctx, valid_urls, max_concurrent, batch_size)
-            scrape_result = json.loads(scrape_result_str)
-            
-            if not scrape_result.get("success", False):
-                return json.dumps({
-                    "success": False,
-                    "query": query,
-                    "searxng_results": valid_urls,
-                    "error": f"Scraping failed: {scrape_result.get('error', 'Unknown error')}"
-                }, indent=2)
-            
-        except Exception as e:
-            return json.dumps({
-                "success": False,
+        # Ephemeral mode: rank the fresh chunks in memory, storing them is optional and off the hot path
+        if ephemeral and not return_raw_markdown:
+            if persist is None:
+                persist = os.getenv("SEARCH_EPHEMERAL_PERSIST", "false") == "true"
+            results_data, ranking_stats = await _ephemeral_search(
+                ctx, query, valid_urls, batch_size, max_concurrent, persist=persist
+            )
+            processing_time = time.time() - start_time
+            return dumps({
+                "success": True,
                 "query": query,
                 "searxng_results": valid_urls,
-                "error": f"Scraping error: {str(e)}"
-            }, indent=2)
+                "mode": "ephemeral_rag_query",
+                "results": results_data,
+                "summary": {
+                    "urls_found": len(results),
+                    "urls_scraped": len(valid_urls),
+                    "urls_processed": sum(1 for value in results_data.values() if isinstance(value, list)),
+                    "chunks_ranked": ranking_stats["chunks_ranked"],
+                    "persist_job_id": ranking_stats["persist_job_id"],
+                    "processing_time_seconds": round(processing_time, 2)
+                },
+                "performance": {
+                    "num_results": num_results,
+                    "batch_size": batch_size,
+                    "max_concurrent": max_concurrent,
+                    "searxng_endpoint": search_endpoint,
+                    "searxng_cached": searxng_cached
+                }
+            })
         
-        # Step 6: Results processing based on return_raw_markdown flag
+        # Progressive mode: every URL flows through crawl -> store -> query on its own
+        if progressive and not return_raw_markdown:
+            if deadline_seconds is None:
+                deadline_seconds = float(os.getenv("SEARCH_DEADLINE_SECONDS", "60"))
+            results_data, pipeline_stats = await _progressive_search(
+                ctx, query, valid_urls, batch_size, max_concurrent, deadline_seconds
+            )
+            processing_time = time.time() - start_time
+            return dumps({
+                "success": True,
+                "query": query,
+                "searxng_results": valid_urls,
+                "mode": "progressive_rag_query",
+                "results": results_data,
+                "summary": {
+                    "urls_found": len(results),
+                    "urls_scraped": len(valid_urls),
+                    "urls_processed": sum(1 for value in results_data.values() if isinstance(value, list)),
+                    "urls_pending": pipeline_stats["urls_pending"],
+                    "first_result_seconds": pipeline_stats["first_result_seconds"],
+                    "deadline_seconds": pipeline_stats["deadline_seconds"],
+                    "processing_time_seconds": round(processing_time, 2)
+                },
+                "performance": {
+                    "num_results": num_results,
+                    "batch_size": batch_size,
+                    "max_concurrent": max_concurrent,
+                    "searxng_endpoint": search_endpoint,
+                    "searxng_cached": searxng_cached
+                }
+            })
+        
+        # Step 5: Content processing based on return_raw_markdown flag
         results_data = {}
         processed_urls = 0
+        persist_job_id = None
         
         if return_raw_markdown:
-            # Raw markdown mode - just return scraped content without RAG
-            # Get content from database for each URL
-            supabase_client = ctx.request_context.lifespan_context.supabase_client
-            
+            # Raw markdown mode - return the crawled markdown as is, without embedding or storing it
+            lifespan_context = ctx.request_context.lifespan_context
+            crawl_results = await crawl_batch(lifespan_context.crawler, valid_urls, max_concurrent)
+            crawl_index = index_crawl_results(crawl_results)
             for url in valid_urls:
-                try:
-                    # Query the database for content from this URL
-                    result = supabase_client.from_('crawled_pages')\
-                        .select('content')\
-                        .eq('url', url)\
-                        .execute()
-                    
-                    if result.data:
-                        # Combine all chunks for this URL
-                        content_chunks = [row['content'] for row in result.data]
-                        combined_content = '\n\n'.join(content_chunks)
-                        results_data[url] = combined_content
-                        processed_urls += 1
-                    else:
-                        results_data[url] = "No content found"
-                        
-                except Exception as e:
-                    results_data[url] = f"Error retrieving content: {str(e)}"
+                crawl_result = find_crawl_result(crawl_index, url)
+                if crawl_result:
+                    results_data[url] = crawl_result['markdown']
+                    processed_urls += 1
+                else:
+                    results_data[url] = "No content found"
+            
+            if persist is None:
+                persist = os.getenv("SEARCH_EPHEMERAL_PERSIST", "false") == "true"
+            if persist:
+                persist_job_id = _persist_crawl_results_in_background(lifespan_context, crawl_results, "search", batch_size)
         
         else:
-            # RAG mode - perform RAG query for each URL with parallel processing
-            import asyncio
-            
-            # Prepare RAG query tasks
-            async def process_rag_query_for_url(url: str):
-                """Process RAG query for a single URL."""
-                url_start_time = time.time()
-                print(f"Processing RAG query for URL: {url}")
+            # Scrape and store all URLs with the existing scrape_urls function
+            try:
+                # Use the existing scrape_urls function to scrape all URLs
+                scrape_result_str = await scrape_urls(ctx, valid_urls, max_concurrent, batch_size)
+                scrape_result = json.loads(scrape_result_str)
                 
-                try:
-                    # Extract source_id from URL for RAG filtering
-                    parsed_url = urlparse(url)
-                    source_id = parsed_url.netloc or parsed_url.path
-                    
-                    # Validate source_id
-                    if not source_id or source_id.strip() == "":
-                        print(f"Warning: Empty source_id for URL {url}, using fallback")
-                        source_id = "unknown_source"
-                    
-                    print(f"Using source_id: '{source_id}' for URL: {url}")
-                    
-                    # Perform RAG query with timeout protection (30 second timeout)
-                    try:
-                        rag_result_str = await asyncio.wait_for(
-                            perform_rag_query(ctx, query, source_id, match_count=5),
-                            timeout=30.0
-                        )
-                        print(f"RAG query completed for {url} in {time.time() - url_start_time:.2f}s")
-                    except asyncio.TimeoutError:
-                        print(f"RAG query timeout for URL: {url}")
-                        return url, "RAG query timed out after 30 seconds"
-                    
-                    # Parse JSON with error handling
-                    try:
-                        rag_result = json.loads(rag_result_str)
-                    except json.JSONDecodeError as e:
-                        print(f"JSON decode error for URL {url}: {e}")
-                        return url, f"JSON parsing error: {str(e)}"
-                    
-                    if rag_result.get("success", False) and rag_result.get("results"):
-                        # Format RAG results for this URL
-                        formatted_results = []
-                        for result in rag_result["results"]:
-                            formatted_results.append({
-                                "content": result.get("content", ""),
-                                "similarity": result.get("similarity", 0),
-                                "metadata": result.get("metadata", {})
-                            })
-                        print(f"Successfully processed RAG results for {url}: {len(formatted_results)} results")
-                        return url, formatted_results
-                    else:
-                        error_msg = rag_result.get("error", "No RAG results found")
-                        print(f"No RAG results for {url}: {error_msg}")
-                        return url, f"No relevant results: {error_msg}"
-                        
-                except Exception as e:
-                    print(f"Unexpected error processing URL {url}: {str(e)}")
-                    return url, f"RAG query error: {str(e)}"
+                if not scrape_result.get("success", False):
+                    return dumps({
+                        "success": False,
+                        "query": query,
+                        "searxng_results": valid_urls,
+                        "error": f"Scraping failed: {scrape_result.get('error', 'Unknown error')}"
+                    })
+                
+            except Exception as e:
+                return dumps({
+                    "success": False,
+                    "query": query,
+                    "searxng_results": valid_urls,
+                    "error": f"Scraping error: {str(e)}"
+                })
             
-            # Use provided max_rag_workers or get from environment or use default
+            # RAG mode - one query over the chunks of all scraped pages, grouped per URL
             if max_rag_workers is None:
                 max_rag_workers = int(os.getenv("MAX_RAG_WORKERS", "5"))
-            
-            # Create tasks for parallel execution with semaphore for rate limiting
-            semaphore = asyncio.Semaphore(max_rag_workers)
-            
-            async def rate_limited_rag_query(url):
-                async with semaphore:
-                    return await process_rag_query_for_url(url)
-            
-            # Execute all RAG queries in parallel
-            rag_tasks = [rate_limited_rag_query(url) for url in valid_urls]
-            rag_results = await asyncio.gather(*rag_tasks)
-            
-            # Process results
-            for url, result in rag_results:
-                results_data[url] = result
-                if isinstance(result, list):  # Successfully got results
-                    processed_urls += 1
+            # URLs dropped as canonical duplicates are answered from the page they duplicate
+            stored_as = {
+                url_result["url"]: url_result["duplicate_of"]
+                for url_result in scrape_result.get("results", []) if isinstance(url_result, dict) and url_result.get("duplicate_of")
+            }
+            results_data = await _rag_query_by_url(ctx, query, valid_urls, match_count=5, max_rerank_workers=max_rag_workers, stored_as=stored_as)
+            processed_urls = sum(1 for result in results_data.values() if isinstance(result, list))
         
         # Calculate processing statistics
         processing_time = time.time() - start_time
         
         # Step 7: Format final results according to specification
-        return json.dumps({
+        return dumps({
             "success": True,
             "query": query,
             "searxng_results": valid_urls,
@@ -660,6 +1413,7 @@ async def search(ctx: Context, query: str, return_raw_markdown: bool = False, nu
                 "urls_found": len(results),
                 "urls_scraped": len(valid_urls),
                 "urls_processed": processed_urls,
+                "persist_job_id": persist_job_id,
                 "processing_time_seconds": round(processing_time, 2)
             },
             "performance": {
@@ -667,21 +1421,23 @@ async def search(ctx: Context, query: str, return_raw_markdown: bool = False, nu
                 "batch_size": batch_size,
                 "max_concurrent": max_concurrent,
                 "max_rag_workers": max_rag_workers,
-                "searxng_endpoint": search_endpoint
+                "searxng_endpoint": search_endpoint,
+                "searxng_cached": searxng_cached
             }
-        }, indent=2)
+        })
         
     except Exception as e:
         processing_time = time.time() - start_time
-        return json.dumps({
+        return dumps({
             "success": False,
             "query": query,
             "error": f"Search operation failed: {str(e)}",
             "processing_time_seconds": round(processing_time, 2)
-        }, indent=2)
+        })
 
 @mcp.tool()
-async def scrape_urls(ctx: Context, url: Union[str, List[str]], max_concurrent: int = 10, batch_size: int = 20, return_raw_markdown: bool = False) -> str:
+@traced_tool
+async def scrape_urls(ctx: Context, url: Union[str, List[str]], max_concurrent: int = 10, batch_size: int = 20, return_raw_markdown: bool = False, background: bool = False) -> str:
     """
     Scrape **one or more URLs** and store their contents as embedding chunks in Supabase.
     Optionally, use `return_raw_markdown=true` to return raw markdown content without storing.
@@ -694,12 +1450,23 @@ async def scrape_urls(ctx: Context, url: Union[str, List[str]], max_concurrent:
         max_concurrent: Maximum number of concurrent browser sessions for multi-URL mode (default: 10)
         batch_size: Size of batches for database operations (default: 20)
         return_raw_markdown: If True, skip database storage and return raw markdown content (default: False)
+        background: If True, queue the scrape as a background job and return its job ID immediately (default: False)
     
     Returns:
         Summary of the scraping operation and storage in Supabase, or raw markdown content if requested
     """
     start_time = time.time()
     
+    if background:
+        url_count = len(url) if isinstance(url, list) else 1
+        return _submit_background_job(
+            ctx,
+            "scrape_urls",
+            f"Scrape {url_count} URL(s)",
+            LANE_INTERACTIVE if url_count <= 5 else LANE_BULK,
+            lambda: scrape_urls(ctx, url, max_concurrent, batch_size, return_raw_markdown)
+        )
+    
     try:
         # Input validation and type detection
         if isinstance(url, str):
@@ -708,59 +1475,66 @@ async def scrape_urls(ctx: Context, url: Union[str, List[str]], max_concurrent:
         elif isinstance(url, list):
             # Multiple URLs
             if not url:
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "error": "URL list cannot be empty"
-                }, indent=2)
+                })
             
             # Validate all URLs are strings and remove duplicates
             validated_urls = []
             for i, u in enumerate(url):
                 if not isinstance(u, str):
-                    return json.dumps({
+                    return dumps({
                         "success": False,
                         "error": f"URL at index {i} must be a string, got {type(u).__name__}"
-                    }, indent=2)
+                    })
                 if u.strip():  # Only add non-empty URLs
                     validated_urls.append(u.strip())
             
             if not validated_urls:
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "error": "No valid URLs found in the list"
-                }, indent=2)
+                })
             
-            # Remove duplicates while preserving order
+            # Remove duplicates (including differently spelled copies of the same URL) while preserving order
             seen = set()
             urls_to_process = []
             for u in validated_urls:
-                if u not in seen:
-                    seen.add(u)
+                url_key = canonicalize_url(u, drop_scheme=True)
+                if url_key not in seen:
+                    seen.add(url_key)
                     urls_to_process.append(u)
         else:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": f"URL must be a string or list of strings, got {type(url).__name__}"
-            }, indent=2)
+            })
         
         # Get context components
         crawler = ctx.request_context.lifespan_context.crawler
         supabase_client = ctx.request_context.lifespan_context.supabase_client
+        page_processor = ctx.request_context.lifespan_context.page_processor
+        code_summarizer = ctx.request_context.lifespan_context.code_summarizer
+        job_queue = ctx.request_context.lifespan_context.job_queue
         
         # Always use unified processing (handles both single and multiple URLs seamlessly)
         return await _process_multiple_urls(
             crawler, supabase_client, urls_to_process,
-            max_concurrent, batch_size, start_time, return_raw_markdown
+            max_concurrent, batch_size, start_time, return_raw_markdown,
+            page_processor=page_processor,
+            code_summarizer=code_summarizer,
+            job_queue=job_queue
         )
             
     except Exception as e:
         processing_time = time.time() - start_time
-        return json.dumps({
+        return dumps({
             "success": False,
             "url": url if isinstance(url, str) else f"[{len(url)} URLs]" if isinstance(url, list) else str(url),
             "error": str(e),
             "processing_time_seconds": round(processing_time, 2)
-        }, indent=2)
+        })
 
 
 async def _process_multiple_urls(
@@ -770,7 +1544,10 @@ async def _process_multiple_urls(
     max_concurrent: int,
     batch_size: int,
     start_time: float,
-    return_raw_markdown: bool = False
+    return_raw_markdown: bool = False,
+    page_processor: Optional[PageProcessor] = None,
+    code_summarizer: Optional[CodeSummarizer] = None,
+    job_queue: Optional[JobQueue] = None
 ) -> str:
     """
     Process one or more URLs using batch crawling and enhanced error handling.
@@ -786,13 +1563,22 @@ async def _process_multiple_urls(
         max_concurrent: Maximum concurrent browser sessions
         batch_size: Batch size for database operations
         start_time: Start time for performance tracking
+        return_raw_markdown: If True, return the markdown without storing it
+        page_processor: Optional PageProcessor for chunking pages on worker processes
+        code_summarizer: Optional shared CodeSummarizer for code example summaries
+        job_queue: Optional job queue for deferred contextual embeddings
         
     Returns:
         JSON string with crawl results (single URL format for 1 URL, multi format for multiple)
     """
     try:
         # Batch crawl all URLs using existing infrastructure
+        report_job_progress(0, 3, f"Crawling {len(urls)} URL(s)")
         crawl_results = await crawl_batch(crawler, urls, max_concurrent=max_concurrent)
+        report_job_progress(1, 3, f"Crawled {len(crawl_results)}/{len(urls)} URL(s)")
+        
+        # Match requested URLs to their results (also through redirects) once per batch
+        crawl_index = index_crawl_results(crawl_results)
         
         # Raw markdown mode - return immediately without storing
         if return_raw_markdown:
@@ -801,13 +1587,7 @@ async def _process_multiple_urls(
             urls_processed = 0
             
             for original_url in urls:
-                # Find matching result
-                crawl_result = None
-                for cr in crawl_results:
-                    if cr['url'] == original_url:
-                        crawl_result = cr
-                        break
-                
+                crawl_result = find_crawl_result(crawl_index, original_url)
                 if crawl_result and crawl_result.get('markdown'):
                     results[original_url] = crawl_result['markdown']
                     total_content_length += len(crawl_result['markdown'])
@@ -818,7 +1598,7 @@ async def _process_multiple_urls(
             # Calculate processing time
             processing_time = time.time() - start_time
             
-            return json.dumps({
+            return dumps({
                 "success": True,
                 "mode": "raw_markdown",
                 "results": results,
@@ -827,7 +1607,34 @@ async def _process_multiple_urls(
                     "total_content_length": total_content_length,
                     "processing_time_seconds": round(processing_time, 2)
                 }
-            }, indent=2)
+            })
+        
+        # Drop canonical duplicates before chunking and embedding them; a dropped URL is reported
+        # with the requested URL its page is stored under (duplicate_of). Near-duplicate detection
+        # is left to recursive crawls, so other listed pages are always stored under their own URL.
+        crawl_results, duplicate_pages = drop_duplicate_pages(crawl_results, near_duplicates=False)
+        requested_url_by_result = {}
+        for original_url in urls:
+            crawl_result = find_crawl_result(crawl_index, original_url)
+            if crawl_result:
+                requested_url_by_result.setdefault(crawl_result['url'], original_url)
+        duplicate_of = {
+            dup['url']: requested_url_by_result.get(dup['duplicate_of'], dup['duplicate_of'])
+            for dup in duplicate_pages
+        }
+        
+        # Chunk pages and extract section info and code blocks off the event loop
+        # (on worker processes if configured)
+        extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
+        with span("chunking"):
+            processed_pages = await asyncio.get_event_loop().run_in_executor(
+                None,
+                lambda: (page_processor or PageProcessor()).process_pages(
+                    [cr['markdown'] for cr in crawl_results],
+                    extract_code=extract_code_examples_enabled
+                )
+            )
+        processed_by_url = {cr['url']: processed for cr, processed in zip(crawl_results, processed_pages)}
         
         # Initialize tracking variables for normal (database storage) mode
         all_urls = []
@@ -850,13 +1657,19 @@ async def _process_multiple_urls(
         errors = []
         
         # Process each crawl result
+        outline_by_url = {}
         for original_url in urls:
-            # Find matching result
-            crawl_result = None
-            for cr in crawl_results:
-                if cr['url'] == original_url:
-                    crawl_result = cr
-                    break
+            crawl_result = find_crawl_result(crawl_index, original_url)
+            if crawl_result and crawl_result['url'] in duplicate_of:
+                # Duplicate of another page in this batch - nothing new to store
+                url_results.append({
+                    "url": original_url,
+                    "success": True,
+                    "chunks_stored": 0,
+                    "duplicate_of": duplicate_of[crawl_result['url']]
+                })
+                successful_urls += 1
+                continue
             
             if crawl_result and crawl_result.get('markdown'):
                 # Successful crawl
@@ -865,8 +1678,9 @@ async def _process_multiple_urls(
                     parsed_url = urlparse(original_url)
                     source_id = parsed_url.netloc or parsed_url.path
                     
-                    # Chunk the content
-                    chunks = smart_chunk_markdown(crawl_result['markdown'])
+                    # Chunked content
+                    processed = processed_by_url[crawl_result['url']]
+                    chunks = processed['chunks']
                     
                     # Store content for source summary generation
                     if source_id not in source_content_map:
@@ -876,13 +1690,12 @@ async def _process_multiple_urls(
                     url_word_count = 0
                     
                     # Process chunks
-                    for i, chunk in enumerate(chunks):
+                    for i, (chunk, meta) in enumerate(zip(chunks, processed['sections'])):
                         all_urls.append(original_url)
                         all_chunk_numbers.append(i)
                         all_contents.append(chunk)
                         
-                        # Extract metadata
-                        meta = extract_section_info(chunk)
+                        # Add metadata
                         meta["chunk_index"] = i
                         meta["url"] = original_url
                         meta["source"] = source_id
@@ -898,6 +1711,7 @@ async def _process_multiple_urls(
                     
                     # Store full document mapping
                     all_url_to_full_document[original_url] = crawl_result['markdown']
+                    outline_by_url[original_url] = processed['outline']
                     
                     # Track successful URL result
                     url_results.append({
@@ -943,83 +1757,58 @@ async def _process_multiple_urls(
                 })
                 failed_urls += 1
         
-        # Update source information in parallel (if any successful crawls)
-        if source_content_map:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                source_summary_args = [(source_id, content) for source_id, content in source_content_map.items()]
-                source_summaries = list(executor.map(lambda args: extract_source_summary(args[0], args[1]), source_summary_args))
+        def store_pages():
+            # Update source information in parallel (if any successful crawls)
+            if source_content_map:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+                    source_summary_args = [(source_id, content) for source_id, content in source_content_map.items()]
+                    source_summaries = list(executor.map(propagate(lambda args: extract_source_summary(args[0], args[1])), source_summary_args))
+                
+                for (source_id, _), summary in zip(source_summary_args, source_summaries):
+                    word_count = source_word_counts.get(source_id, 0)
+                    update_source_info(supabase_client, source_id, summary, word_count)
             
-            for (source_id, _), summary in zip(source_summary_args, source_summaries):
-                word_count = source_word_counts.get(source_id, 0)
-                update_source_info(supabase_client, source_id, summary, word_count)
+            # Add documentation chunks to Supabase in batches (if any)
+            if all_contents:
+                add_documents_to_supabase(
+                    supabase_client,
+                    all_urls,
+                    all_chunk_numbers,
+                    all_contents,
+                    all_metadatas,
+                    all_url_to_full_document,
+                    batch_size=batch_size
+                )
+                stored_urls = list(all_url_to_full_document)
+                add_sections_to_supabase(
+                    supabase_client,
+                    stored_urls,
+                    [outline_by_url[url] for url in stored_urls],
+                    batch_size=batch_size
+                )
         
-        # Add documentation chunks to Supabase in batches (if any)
-        if all_contents:
-            add_documents_to_supabase(
-                supabase_client,
-                all_urls,
-                all_chunk_numbers,
-                all_contents,
-                all_metadatas,
-                all_url_to_full_document,
-                batch_size=batch_size
-            )
+        # Store off the event loop so other tool calls (and job status polls) keep being served
+        await asyncio.get_event_loop().run_in_executor(None, propagate(store_pages))
+        
+        # Pages are searchable now; contextual embeddings (if deferred) follow in the background
+        contextualization_job_id = _defer_contextual_embeddings(
+            job_queue, supabase_client, all_url_to_full_document if all_contents else {}, batch_size=batch_size
+        )
+        
+        report_job_progress(2, 3, f"Stored {total_chunks} chunks")
         
         # Process code examples from all successful documents (if enabled)
         total_code_examples = 0
-        extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
         if extract_code_examples_enabled and crawl_results:
-            code_urls = []
-            code_chunk_numbers = []
-            code_examples = []
-            code_summaries = []
-            code_metadatas = []
-            
-            # Extract code blocks from all successful documents
-            for doc in crawl_results:
-                if doc.get('markdown'):
-                    source_url = doc['url']
-                    md = doc['markdown']
-                    code_blocks = extract_code_blocks(md)
-                    
-                    if code_blocks:
-                        # Process code examples in parallel
-                        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                            summary_args = [(block['code'], block['context_before'], block['context_after'])
-                                            for block in code_blocks]
-                            summaries = list(executor.map(process_code_example, summary_args))
-                        
-                        # Prepare code example data
-                        parsed_url = urlparse(source_url)
-                        source_id = parsed_url.netloc or parsed_url.path
-                        
-                        for i, (block, summary) in enumerate(zip(code_blocks, summaries)):
-                            code_urls.append(source_url)
-                            code_chunk_numbers.append(len(code_examples))
-                            code_examples.append(block['code'])
-                            code_summaries.append(summary)
-                            
-                            code_meta = {
-                                "chunk_index": len(code_examples) - 1,
-                                "url": source_url,
-                                "source": source_id,
-                                "char_count": len(block['code']),
-                                "word_count": len(block['code'].split())
-                            }
-                            code_metadatas.append(code_meta)
-            
-            # Add all code examples to Supabase
-            if code_examples:
-                add_code_examples_to_supabase(
-                    supabase_client,
-                    code_urls,
-                    code_chunk_numbers,
-                    code_examples,
-                    code_summaries,
-                    code_metadatas,
-                    batch_size=batch_size
-                )
-                total_code_examples = len(code_examples)
+            # Code blocks were extracted from all successful documents along with their chunks;
+            # summarize and store them off the event loop
+            code_pages = [(doc['url'], processed_by_url[doc['url']]['code_blocks'])
+                          for doc in crawl_results if doc.get('markdown') and doc['url'] in processed_by_url]
+            total_code_examples = await asyncio.get_event_loop().run_in_executor(
+                None,
+                propagate(lambda: _store_code_examples(supabase_client, code_pages, batch_size=batch_size,
+                                                       code_summarizer=code_summarizer))
+            )
         
         # Calculate processing time
         processing_time = time.time() - start_time
@@ -1030,17 +1819,14 @@ async def _process_multiple_urls(
             single_url_result = url_results[0] if url_results else None
             if single_url_result and single_url_result["success"]:
                 # Get the first crawl result for links information
-                first_crawl_result = None
-                for cr in crawl_results:
-                    if cr['url'] == urls[0]:
-                        first_crawl_result = cr
-                        break
+                first_crawl_result = find_crawl_result(crawl_index, urls[0])
                 
-                return json.dumps({
+                return dumps({
                     "success": True,
                     "url": urls[0],
                     "chunks_stored": single_url_result.get("chunks_stored", 0),
                     "code_examples_stored": total_code_examples,
+                    "contextualization_job_id": contextualization_job_id,
                     "content_length": single_url_result.get("content_length", 0),
                     "total_word_count": single_url_result.get("word_count", 0),
                     "source_id": single_url_result.get("source_id", ""),
@@ -1048,18 +1834,18 @@ async def _process_multiple_urls(
                         "internal": len(first_crawl_result.get("links", {}).get("internal", [])) if first_crawl_result else 0,
                         "external": len(first_crawl_result.get("links", {}).get("external", [])) if first_crawl_result else 0
                     }
-                }, indent=2)
+                })
             else:
                 # Single URL failed
                 error_msg = single_url_result.get("error", "No content retrieved") if single_url_result else "No content retrieved"
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "url": urls[0],
                     "error": error_msg
-                }, indent=2)
+                })
         else:
             # Multiple URLs mode - return comprehensive results
-            return json.dumps({
+            return dumps({
                 "success": True,
                 "mode": "multi_url",
                 "summary": {
@@ -1068,9 +1854,11 @@ async def _process_multiple_urls(
                     "failed_urls": failed_urls,
                     "total_chunks_stored": total_chunks,
                     "total_code_examples_stored": total_code_examples,
+                    "duplicate_pages_skipped": len(duplicate_pages),
                     "total_content_length": total_content_length,
                     "total_word_count": total_word_count,
                     "sources_updated": len(source_content_map),
+                    "contextualization_job_id": contextualization_job_id,
                     "processing_time_seconds": round(processing_time, 2)
                 },
                 "results": url_results,
@@ -1080,20 +1868,20 @@ async def _process_multiple_urls(
                     "batch_size": batch_size,
                     "average_time_per_url": round(processing_time / len(urls), 2) if urls else 0
                 }
-            }, indent=2)
+            })
         
     except Exception as e:
         processing_time = time.time() - start_time
         if len(urls) == 1:
             # Single URL error - return legacy-compatible format
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "url": urls[0],
                 "error": str(e)
-            }, indent=2)
+            })
         else:
             # Multiple URLs error
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "mode": "multi_url",
                 "error": str(e),
@@ -1101,10 +1889,11 @@ async def _process_multiple_urls(
                     "total_urls": len(urls),
                     "processing_time_seconds": round(processing_time, 2)
                 }
-            }, indent=2)
+            })
 
 @mcp.tool()
-async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concurrent: int = 10, chunk_size: int = 5000, return_raw_markdown: bool = False, query: List[str] = None, max_rag_workers: int = 5) -> str:
+@traced_tool
+async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concurrent: int = 10, chunk_size: int = 5000, return_raw_markdown: bool = False, query: List[str] = None, max_rag_workers: int = 5, background: bool = False) -> str:
     """
     Intelligently crawl a URL based on its type and store content in Supabase.
     Enhanced with raw markdown return and RAG query capabilities.
@@ -1124,10 +1913,20 @@ async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concur
         return_raw_markdown: If True, return raw markdown content instead of just storing (default: False)
         query: List of queries to perform RAG search on crawled content (default: None)
         max_rag_workers: Maximum concurrent RAG query workers for parallel processing (default: 5)
+        background: If True, queue the crawl as a background job and return its job ID immediately (default: False)
     
     Returns:
         JSON string with crawl summary, raw markdown (if requested), or RAG query results
     """
+    if background:
+        return _submit_background_job(
+            ctx,
+            "smart_crawl_url",
+            f"Crawl {url}",
+            LANE_BULK,
+            lambda: smart_crawl_url(ctx, url, max_depth, max_concurrent, chunk_size, return_raw_markdown, query, max_rag_workers)
+        )
+    
     try:
         # Get the crawler from the context
         crawler = ctx.request_context.lifespan_context.crawler
@@ -1135,6 +1934,7 @@ async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concur
         
         # Determine the crawl strategy
         crawl_results = []
+        duplicate_pages = []
         crawl_type = None
         
         if is_txt(url):
@@ -1145,12 +1945,13 @@ async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concur
             # For sitemaps, extract URLs and crawl in parallel
             sitemap_urls = parse_sitemap(url)
             if not sitemap_urls:
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "url": url,
                     "error": "No URLs found in sitemap"
-                }, indent=2)
+                })
             crawl_results = await crawl_batch(crawler, sitemap_urls, max_concurrent=max_concurrent)
+            crawl_results, duplicate_pages = drop_duplicate_pages(crawl_results)
             crawl_type = "sitemap"
         else:
             # For regular URLs, use recursive crawl
@@ -1158,11 +1959,13 @@ async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concur
             crawl_type = "webpage"
         
         if not crawl_results:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "url": url,
                 "error": "No content found"
-            }, indent=2)
+            })
+        
+        report_job_progress(1, 3, f"Crawled {len(crawl_results)} page(s)")
         
         # Raw markdown mode - return immediately without storing
         if return_raw_markdown:
@@ -1173,7 +1976,7 @@ async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concur
                 results[doc['url']] = doc['markdown']
                 total_content_length += len(doc['markdown'])
             
-            return json.dumps({
+            return dumps({
                 "success": True,
                 "mode": "raw_markdown",
                 "crawl_type": crawl_type,
@@ -1182,222 +1985,768 @@ async def smart_crawl_url(ctx: Context, url: str, max_depth: int = 3, max_concur
                     "pages_crawled": len(crawl_results),
                     "total_content_length": total_content_length
                 }
-            }, indent=2)
+            })
+        
+        # Process results and store in Supabase for default and query modes, off the event
+        # loop so other tool calls (and job status polls) keep being served
+        crawl_time = str(asyncio.current_task().get_coro().__name__)
+        store_stats = await asyncio.get_event_loop().run_in_executor(
+            None,
+            propagate(lambda: _store_crawl_results(
+                supabase_client,
+                crawl_results,
+                crawl_type,
+                crawl_time=crawl_time,
+                chunk_size=chunk_size,
+                page_processor=ctx.request_context.lifespan_context.page_processor,
+                code_summarizer=ctx.request_context.lifespan_context.code_summarizer
+            ))
+        )
+        chunk_count = store_stats["chunks_stored"]
+        contextualization_job_id = _defer_contextual_embeddings(
+            ctx.request_context.lifespan_context.job_queue,
+            supabase_client,
+            store_stats["url_to_full_document"]
+        )
+        report_job_progress(2, 3, f"Stored {chunk_count} chunks")
+        
+        # Query mode - perform RAG queries on all crawled URLs with parallel processing
+        if query and len(query) > 0:
+            results = {}
+            total_rag_queries = 0
+            
+            # Prepare all RAG query tasks for parallel execution
+            async def process_single_rag_query(doc_url: str, q: str, source_id: str):
+                """Process a single RAG query for a URL and query combination."""
+                try:
+                    # Perform RAG query using existing function
+                    rag_result_str = await perform_rag_query(ctx, q, source_id, match_count=5)
+                    rag_result = json.loads(rag_result_str)
+                    
+                    if rag_result.get("success", False) and rag_result.get("results"):
+                        # Format RAG results for this URL and query
+                        formatted_results = []
+                        for result in rag_result["results"]:
+                            formatted_results.append({
+                                "content": result.get("content", ""),
+                                "similarity": result.get("similarity", 0),
+                                "metadata": result.get("metadata", {})
+                            })
+                        return doc_url, q, formatted_results
+                    else:
+                        return doc_url, q, "No relevant results found"
+                    
+                except Exception as e:
+                    return doc_url, q, f"RAG query error: {str(e)}"
+            
+            # Use provided max_rag_workers or get from environment or use default
+            if max_rag_workers is None:
+                max_rag_workers = int(os.getenv("MAX_RAG_WORKERS", "5"))
+            
+            # Create semaphore for rate limiting
+            semaphore = asyncio.Semaphore(max_rag_workers)
+            
+            async def rate_limited_query(doc_url, q, source_id):
+                async with semaphore:
+                    return await process_single_rag_query(doc_url, q, source_id)
+            
+            # Build list of all query tasks
+            query_tasks = []
+            for doc in crawl_results:
+                doc_url = doc['url']
+                # Extract source_id from URL for RAG filtering
+                parsed_url = urlparse(doc_url)
+                source_id = parsed_url.netloc or parsed_url.path
+                
+                results[doc_url] = {}
+                
+                for q in query:
+                    query_tasks.append(rate_limited_query(doc_url, q, source_id))
+            
+            # Execute all queries in parallel
+            query_results = await asyncio.gather(*query_tasks)
+            
+            # Process results
+            for doc_url, q, result in query_results:
+                results[doc_url][q] = result
+                total_rag_queries += 1
+            
+            return dumps({
+                "success": True,
+                "mode": "rag_query",
+                "crawl_type": crawl_type,
+                "results": results,
+                "summary": {
+                    "pages_crawled": len(crawl_results),
+                    "queries_processed": len(query),
+                    "total_rag_queries": total_rag_queries,
+                    "max_rag_workers": max_rag_workers
+                }
+            })
+        
+        # Default mode - return crawl statistics as before
+        return dumps({
+            "success": True,
+            "url": url,
+            "crawl_type": crawl_type,
+            "pages_crawled": len(crawl_results),
+            "chunks_stored": chunk_count,
+            "code_examples_stored": store_stats["code_examples_stored"],
+            "duplicate_pages_skipped": len(duplicate_pages),
+            "sources_updated": len(store_stats["sources_updated"]),
+            "contextualization_job_id": contextualization_job_id,
+            "urls_crawled": [doc['url'] for doc in crawl_results][:5] + (["..."] if len(crawl_results) > 5 else [])
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "url": url,
+            "error": str(e)
+        })
+
+async def _run_crawl_job(lifespan_context: Crawl4AIContext, job_id: str) -> None:
+    """
+    Crawl a job's frontier batch by batch, checkpointing progress after every batch.
+    
+    Pages are claimed from the persisted frontier, crawled, stored in Supabase and marked
+    done before the next batch starts, so an interrupted job only redoes its current batch.
+    
+    Args:
+        lifespan_context: The server's Crawl4AIContext
+        job_id: ID of the job to run
+    """
+    store = lifespan_context.crawl_job_store
+    crawler = lifespan_context.crawler
+    supabase_client = lifespan_context.supabase_client
+    
+    job = store.get_job(job_id)
+    params = job["params"]
+    stats = {
+        "pages_stored": 0,
+        "chunks_stored": 0,
+        "code_examples_stored": 0,
+        "duplicate_pages_skipped": 0,
+        "failed_pages": 0,
+        "sources": [],
+        **job["stats"]
+    }
+    known_sources = set(stats["sources"])
+    max_depth = params["max_depth"]
+    max_concurrent = params["max_concurrent"]
+    
+    run_config = build_crawler_run_config(cache_mode=CacheMode.BYPASS, stream=False)
+    dispatcher = MemoryAdaptiveDispatcher(
+        memory_threshold_percent=70.0,
+        check_interval=1.0,
+        max_session_permit=max_concurrent
+    )
+    detector = create_near_duplicate_detector()
+    if detector:
+        # Pages stored before the job was interrupted still count as seen
+        for stored_url, fingerprint in store.get_page_fingerprints(job_id):
+            detector.add(stored_url, fingerprint)
+    
+    def url_key(url):
+        return canonicalize_url(url, drop_scheme=True)
+    
+    store.release_in_progress_pages(job_id)
+    store.update_job(job_id, status=JOB_RUNNING)
+    print(f"Crawl job {job_id} running for {job['start_url']}")
+    
+    try:
+        while True:
+            pages = store.claim_pending_pages(job_id, max_concurrent * 2)
+            if not pages:
+                break
+            
+            page_by_key = {page["url_key"]: page for page in pages}
+            with span("crawl"):
+                results = await crawler.arun_many(urls=[page["url"] for page in pages], config=run_config, dispatcher=dispatcher)
+            increment("pages_crawled", sum(1 for result in results if result.success))
+            
+            docs = []
+            page_updates = {}
+            fingerprints = {}
+            waiting_on = {}
+            # Canonical URLs whose content this batch stores under another page, by canonical key
+            canonical_claims = {}
+            new_pages = []
+            
+            for result in results:
+                key = url_key(result.url)
+                page = page_by_key.get(key)
+                if page is None:
+                    continue
+                
+                if not (result.success and result.markdown):
+                    page_updates[key] = (key, PAGE_FAILED, result.error_message or "No content retrieved", 0)
+                    continue
+                
+                if key in canonical_claims:
+                    # An earlier page of this batch already pointed here and is stored in its place
+                    page_updates[key] = (key, PAGE_DUPLICATE, None, 0)
+                    continue
+                
+                # Pages pointing at a stored canonical URL are duplicates, and pages pointing at a
+                # queued one wait for its outcome. Otherwise (unknown or failed) the page is stored
+                # in its place, and the canonical URL is recorded as done once the batch is stored.
+                canonical_url = extract_canonical_url(result.html, result.url)
+                canonical_key = url_key(canonical_url) if canonical_url else key
+                if canonical_key != key:
+                    if canonical_key in page_by_key:
+                        canonical_status = page_updates.get(canonical_key, (None, None))[1]
+                    else:
+                        canonical_status = store.get_page_status(job_id, canonical_key)
+                    if canonical_status == PAGE_DONE or canonical_key in canonical_claims:
+                        page_updates[key] = (key, PAGE_DUPLICATE, None, 0)
+                        continue
+                    if canonical_status in (PAGE_PENDING, PAGE_IN_PROGRESS):
+                        page_updates[key] = (key, PAGE_WAITING, None, 0)
+                        waiting_on[key] = canonical_key
+                        continue
+                    canonical_claims[canonical_key] = (canonical_key, canonical_url, page["depth"])
+                
+                if detector:
+                    fingerprint = compute_simhash(result.markdown)
+                    if detector.find(fingerprint):
+                        page_updates[key] = (key, PAGE_DUPLICATE, None, 0)
+                        canonical_claims.pop(canonical_key, None)
+                        continue
+                    detector.add(result.url, fingerprint)
+                    fingerprints[key] = fingerprint
+                
+                docs.append({'url': result.url, 'markdown': result.markdown})
+                page_updates[key] = (key, PAGE_DONE, None, 0)
+                
+                if page["depth"] + 1 < max_depth:
+                    for link in result.links.get("internal", []):
+                        next_url = urldefrag(link["href"])[0]
+                        new_pages.append((url_key(next_url), next_url, page["depth"] + 1))
+            
+            # Store the batch off the event loop so other tool calls keep being served
+            if docs:
+                store_stats = await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    propagate(lambda: _store_crawl_results(
+                        supabase_client,
+                        docs,
+                        params["crawl_type"],
+                        crawl_time=f"crawl_job:{job_id}",
+                        chunk_size=params["chunk_size"],
+                        known_sources=known_sources,
+                        page_processor=lifespan_context.page_processor,
+                        code_summarizer=lifespan_context.code_summarizer
+                    ))
+                )
+                _defer_contextual_embeddings(lifespan_context.job_queue, supabase_client, store_stats["url_to_full_document"])
+                for doc in docs:
+                    key = url_key(doc['url'])
+                    page_updates[key] = (key, PAGE_DONE, None, store_stats["chunks_per_url"].get(doc['url'], 0))
+                stats["pages_stored"] += len(docs)
+                stats["chunks_stored"] += store_stats["chunks_stored"]
+                stats["code_examples_stored"] += store_stats["code_examples_stored"]
+            
+            # Pages the crawler returned no result for go back to the frontier's failed set
+            for key in page_by_key:
+                if key not in page_updates:
+                    page_updates[key] = (key, PAGE_FAILED, "No crawl result returned", 0)
+            
+            stats["duplicate_pages_skipped"] += sum(1 for update in page_updates.values() if update[1] == PAGE_DUPLICATE)
+            stats["failed_pages"] += sum(1 for update in page_updates.values() if update[1] == PAGE_FAILED)
+            stats["sources"] = sorted(known_sources)
+            
+            # Checkpoint: page outcomes, newly discovered links and job stats
+            settled_duplicates, _ = store.complete_pages(
+                job_id, list(page_updates.values()), fingerprints, waiting_on, list(canonical_claims.values())
+            )
+            stats["duplicate_pages_skipped"] += settled_duplicates
+            store.add_pages(job_id, new_pages)
+            store.update_job(job_id, stats=stats)
+            
+            page_counts = store.get_page_counts(job_id)
+            total_pages = sum(page_counts.values())
+            pending_pages = sum(page_counts.get(status, 0) for status in (PAGE_PENDING, PAGE_IN_PROGRESS, PAGE_WAITING))
+            report_job_progress(
+                total_pages - pending_pages,
+                total_pages,
+                f"{stats['pages_stored']} pages stored, {pending_pages} pages left in the frontier"
+            )
+        
+        store.update_job(job_id, status=JOB_COMPLETED, stats=stats)
+        print(f"Crawl job {job_id} completed: {stats['pages_stored']} pages, {stats['chunks_stored']} chunks")
+    except asyncio.CancelledError:
+        store.release_in_progress_pages(job_id)
+        current_status = store.get_job(job_id)["status"]
+        store.update_job(job_id, status=JOB_CANCELLED if current_status == JOB_CANCELLED else JOB_INTERRUPTED, stats=stats)
+        raise
+    except Exception as e:
+        print(f"Crawl job {job_id} failed: {e}")
+        store.release_in_progress_pages(job_id)
+        store.update_job(job_id, status=JOB_FAILED, stats=stats, error=str(e))
+        # Let the job queue record the failure too, so get_job_status agrees with the job store
+        raise
+
+def _launch_crawl_job(lifespan_context: Crawl4AIContext, job_id: str, start_url: str) -> None:
+    """Queue a crawl job on the bulk lane of the background job queue."""
+    lifespan_context.job_queue.submit(
+        "crawl_job",
+        lambda job: _run_crawl_job(lifespan_context, job_id),
+        description=f"Crawl {start_url}",
+        lane=LANE_BULK,
+        job_id=job_id
+    )
+
+def _format_crawl_job(lifespan_context: Crawl4AIContext, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Format a crawl job and its frontier progress for a tool response."""
+    store = lifespan_context.crawl_job_store
+    page_counts = store.get_page_counts(job["job_id"])
+    total_pages = sum(page_counts.values())
+    finished_pages = total_pages - sum(page_counts.get(status, 0) for status in (PAGE_PENDING, PAGE_IN_PROGRESS, PAGE_WAITING))
+    
+    return {
+        "job_id": job["job_id"],
+        "url": job["start_url"],
+        "status": job["status"],
+        "active": lifespan_context.job_queue.is_active(job["job_id"]),
+        "crawl_type": job["params"].get("crawl_type"),
+        "params": job["params"],
+        "progress": {
+            "pages_discovered": total_pages,
+            "pages_finished": finished_pages,
+            "pages_by_status": page_counts
+        },
+        "stats": job["stats"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+@mcp.tool()
+@traced_tool
+async def start_crawl_job(ctx: Context, url: str, max_depth: int = 3, max_concurrent: int = 10, chunk_size: int = 5000) -> str:
+    """
+    Start a resumable background crawl of a URL and store its content in Supabase.
+    
+    Like smart_crawl_url, but the crawl runs in the background with its frontier, visited set
+    and per-page status persisted after every batch, so large crawls survive client disconnects,
+    timeouts and server restarts. The tool returns a job ID immediately; use get_crawl_job_status
+    to follow progress, resume_crawl_job to continue an interrupted job and cancel_crawl_job to stop it.
+    
+    Args:
+        url: URL to crawl (can be a regular webpage, sitemap.xml, or .txt file)
+        max_depth: Maximum recursion depth for regular URLs (default: 3)
+        max_concurrent: Maximum number of concurrent browser sessions (default: 10)
+        chunk_size: Maximum size of each content chunk in characters (default: 5000)
+    
+    Returns:
+        JSON string with the job ID and initial frontier size
+    """
+    try:
+        lifespan_context = ctx.request_context.lifespan_context
+        store = lifespan_context.crawl_job_store
+        if not store:
+            return dumps({
+                "success": False,
+                "error": "Crawl job store not available. Check CRAWL_JOBS_DB and the server logs."
+            })
+        
+        # Seed the frontier based on the URL type
+        if is_txt(url):
+            crawl_type = "text_file"
+            seed_urls = [url]
+            max_depth = 1
+        elif is_sitemap(url):
+            crawl_type = "sitemap"
+            seed_urls = parse_sitemap(url)
+            max_depth = 1
+            if not seed_urls:
+                return dumps({
+                    "success": False,
+                    "url": url,
+                    "error": "No URLs found in sitemap"
+                })
+        else:
+            crawl_type = "webpage"
+            seed_urls = [urldefrag(url)[0]]
+        
+        job_id = store.create_job(url, {
+            "crawl_type": crawl_type,
+            "max_depth": max_depth,
+            "max_concurrent": max_concurrent,
+            "chunk_size": chunk_size
+        })
+        pages_queued = store.add_pages(job_id, [(canonicalize_url(u, drop_scheme=True), u, 0) for u in seed_urls])
+        _launch_crawl_job(lifespan_context, job_id, url)
+        
+        return dumps({
+            "success": True,
+            "job_id": job_id,
+            "url": url,
+            "crawl_type": crawl_type,
+            "pages_queued": pages_queued,
+            "message": "Crawl job started. Use get_crawl_job_status to follow progress."
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "url": url,
+            "error": str(e)
+        })
+
+@mcp.tool()
+@traced_tool
+async def resume_crawl_job(ctx: Context, job_id: str) -> str:
+    """
+    Resume an interrupted, failed or cancelled crawl job from its last checkpoint.
+    
+    Pages that were already stored are not crawled again; pages that were in flight when the
+    job stopped are returned to the frontier.
+    
+    Args:
+        job_id: ID of the job to resume (from start_crawl_job or get_crawl_job_status)
+    
+    Returns:
+        JSON string with the job's status and progress
+    """
+    try:
+        lifespan_context = ctx.request_context.lifespan_context
+        store = lifespan_context.crawl_job_store
+        job = store.get_job(job_id) if store else None
+        if not job:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Crawl job '{job_id}' not found"
+            })
+        
+        if lifespan_context.job_queue.is_active(job_id):
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": "Crawl job is already running"
+            })
+        
+        if job["status"] == JOB_COMPLETED:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": "Crawl job has already completed"
+            })
+        
+        _launch_crawl_job(lifespan_context, job_id, job["start_url"])
+        
+        return dumps({
+            "success": True,
+            "message": "Crawl job resumed",
+            "job": _format_crawl_job(lifespan_context, store.get_job(job_id))
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        })
+
+@mcp.tool()
+@traced_tool
+async def get_crawl_job_status(ctx: Context, job_id: str = None) -> str:
+    """
+    Get the status and progress of a crawl job, or list recent crawl jobs.
+    
+    Args:
+        job_id: Optional ID of the job to inspect. If omitted, the 20 most recently updated jobs are listed.
+    
+    Returns:
+        JSON string with job status, frontier progress and storage statistics
+    """
+    try:
+        lifespan_context = ctx.request_context.lifespan_context
+        store = lifespan_context.crawl_job_store
+        if not store:
+            return dumps({
+                "success": False,
+                "error": "Crawl job store not available. Check CRAWL_JOBS_DB and the server logs."
+            })
+        
+        if not job_id:
+            jobs = [_format_crawl_job(lifespan_context, job) for job in store.list_jobs()]
+            return dumps({
+                "success": True,
+                "jobs": jobs,
+                "count": len(jobs)
+            })
+        
+        job = store.get_job(job_id)
+        if not job:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Crawl job '{job_id}' not found"
+            })
+        
+        return dumps({
+            "success": True,
+            "job": _format_crawl_job(lifespan_context, job),
+            "failed_pages_sample": store.get_failed_pages(job_id)
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        })
+
+@mcp.tool()
+@traced_tool
+async def cancel_crawl_job(ctx: Context, job_id: str) -> str:
+    """
+    Cancel a crawl job. Content stored so far is kept and the job can later be resumed.
+    
+    Args:
+        job_id: ID of the job to cancel
+    
+    Returns:
+        JSON string with the job's final status and progress
+    """
+    try:
+        lifespan_context = ctx.request_context.lifespan_context
+        store = lifespan_context.crawl_job_store
+        job = store.get_job(job_id) if store else None
+        if not job:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Crawl job '{job_id}' not found"
+            })
+        
+        if job["status"] in (JOB_COMPLETED, JOB_CANCELLED):
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Crawl job is already {job['status']}"
+            })
         
-        # Process results and store in Supabase for default and query modes
-        urls = []
-        chunk_numbers = []
-        contents = []
-        metadatas = []
-        chunk_count = 0
+        store.update_job(job_id, status=JOB_CANCELLED)
+        if lifespan_context.job_queue.cancel(job_id):
+            await lifespan_context.job_queue.wait(job_id, timeout=30.0)
         
-        # Track sources and their content
-        source_content_map = {}
-        source_word_counts = {}
+        return dumps({
+            "success": True,
+            "message": "Crawl job cancelled",
+            "job": _format_crawl_job(lifespan_context, store.get_job(job_id))
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        })
+
+@mcp.tool()
+@traced_tool
+async def get_job_status(ctx: Context, job_id: str = None) -> str:
+    """
+    Get the status, progress and result of a background job, or list recent jobs.
+    
+    Background jobs are created by calling scrape_urls, smart_crawl_url or
+    parse_github_repository with `background=true`, and by start_crawl_job.
+    
+    Args:
+        job_id: Optional ID of the job to inspect. If omitted, the 20 most recent jobs are listed (without results).
+    
+    Returns:
+        JSON string with the job's status, progress and (once finished) result
+    """
+    try:
+        job_queue = ctx.request_context.lifespan_context.job_queue
         
-        # Process documentation chunks
-        for doc in crawl_results:
-            source_url = doc['url']
-            md = doc['markdown']
-            chunks = smart_chunk_markdown(md, chunk_size=chunk_size)
-            
-            # Extract source_id
-            parsed_url = urlparse(source_url)
-            source_id = parsed_url.netloc or parsed_url.path
-            
-            # Store content for source summary generation
-            if source_id not in source_content_map:
-                source_content_map[source_id] = md[:5000]  # Store first 5000 chars
-                source_word_counts[source_id] = 0
-            
-            for i, chunk in enumerate(chunks):
-                urls.append(source_url)
-                chunk_numbers.append(i)
-                contents.append(chunk)
-                
-                # Extract metadata
-                meta = extract_section_info(chunk)
-                meta["chunk_index"] = i
-                meta["url"] = source_url
-                meta["source"] = source_id
-                meta["crawl_type"] = crawl_type
-                meta["crawl_time"] = str(asyncio.current_task().get_coro().__name__)
-                metadatas.append(meta)
-                
-                # Accumulate word count
-                source_word_counts[source_id] += meta.get("word_count", 0)
-                
-                chunk_count += 1
+        if not job_id:
+            jobs = []
+            for job in job_queue.list_jobs():
+                job_info = job.to_dict()
+                job_info.pop("result")
+                jobs.append(job_info)
+            return dumps({
+                "success": True,
+                "jobs": jobs,
+                "count": len(jobs)
+            })
         
-        # Create url_to_full_document mapping
-        url_to_full_document = {}
-        for doc in crawl_results:
-            url_to_full_document[doc['url']] = doc['markdown']
+        job = job_queue.get(job_id)
+        if not job:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Job '{job_id}' not found"
+            })
         
-        # Update source information for each unique source FIRST (before inserting documents)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            source_summary_args = [(source_id, content) for source_id, content in source_content_map.items()]
-            source_summaries = list(executor.map(lambda args: extract_source_summary(args[0], args[1]), source_summary_args))
+        return dumps({
+            "success": True,
+            "job": job.to_dict()
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        })
+
+@mcp.tool()
+@traced_tool
+async def wait_for_job(ctx: Context, job_id: str, timeout_seconds: float = 60) -> str:
+    """
+    Wait for a background job to finish, streaming its progress as MCP progress notifications.
+    
+    Returns as soon as the job finishes or the timeout expires; call again to keep waiting.
+    
+    Args:
+        job_id: ID of the job to wait for
+        timeout_seconds: Maximum number of seconds to wait (default: 60)
+    
+    Returns:
+        JSON string with the job's status, progress and (once finished) result
+    """
+    try:
+        job_queue = ctx.request_context.lifespan_context.job_queue
         
-        for (source_id, _), summary in zip(source_summary_args, source_summaries):
-            word_count = source_word_counts.get(source_id, 0)
-            update_source_info(supabase_client, source_id, summary, word_count)
+        async def on_progress(job):
+            await ctx.report_progress(job.progress, job.total)
         
-        # Add documentation chunks to Supabase (AFTER sources exist)
-        batch_size = 20
-        add_documents_to_supabase(supabase_client, urls, chunk_numbers, contents, metadatas, url_to_full_document, batch_size=batch_size)
+        job = await job_queue.wait(job_id, timeout=max(0.0, timeout_seconds), on_progress=on_progress)
+        if not job:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Job '{job_id}' not found"
+            })
         
-        # Extract and process code examples from all documents only if enabled
-        code_examples = []
-        extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
-        if extract_code_examples_enabled:
-            all_code_blocks = []
-            code_urls = []
-            code_chunk_numbers = []
-            code_summaries = []
-            code_metadatas = []
-            
-            # Extract code blocks from all documents
-            for doc in crawl_results:
-                source_url = doc['url']
-                md = doc['markdown']
-                code_blocks = extract_code_blocks(md)
-                
-                if code_blocks:
-                    # Process code examples in parallel
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                        # Prepare arguments for parallel processing
-                        summary_args = [(block['code'], block['context_before'], block['context_after'])
-                                        for block in code_blocks]
-                        
-                        # Generate summaries in parallel
-                        summaries = list(executor.map(process_code_example, summary_args))
-                    
-                    # Prepare code example data
-                    parsed_url = urlparse(source_url)
-                    source_id = parsed_url.netloc or parsed_url.path
-                    
-                    for i, (block, summary) in enumerate(zip(code_blocks, summaries)):
-                        code_urls.append(source_url)
-                        code_chunk_numbers.append(len(code_examples))  # Use global code example index
-                        code_examples.append(block['code'])
-                        code_summaries.append(summary)
-                        
-                        # Create metadata for code example
-                        code_meta = {
-                            "chunk_index": len(code_examples) - 1,
-                            "url": source_url,
-                            "source": source_id,
-                            "char_count": len(block['code']),
-                            "word_count": len(block['code'].split())
-                        }
-                        code_metadatas.append(code_meta)
-            
-            # Add all code examples to Supabase
-            if code_examples:
-                add_code_examples_to_supabase(
-                    supabase_client,
-                    code_urls,
-                    code_chunk_numbers,
-                    code_examples,
-                    code_summaries,
-                    code_metadatas,
-                    batch_size=batch_size
-                )
+        return dumps({
+            "success": True,
+            "finished": job.finished,
+            "job": job.to_dict()
+        })
+    except Exception as e:
+        return dumps({
+            "success": False,
+            "job_id": job_id,
+            "error": str(e)
+        })
+
+@mcp.tool()
+@traced_tool
+async def cancel_job(ctx: Context, job_id: str) -> str:
+    """
+    Cancel a queued or running background job.
+    
+    Args:
+        job_id: ID of the job to cancel
+    
+    Returns:
+        JSON string indicating whether the job was cancelled
+    """
+    try:
+        lifespan_context = ctx.request_context.lifespan_context
+        job = lifespan_context.job_queue.get(job_id)
+        if not job:
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Job '{job_id}' not found"
+            })
         
-        # Query mode - perform RAG queries on all crawled URLs with parallel processing
-        if query and len(query) > 0:
-            results = {}
-            total_rag_queries = 0
-            
-            # Prepare all RAG query tasks for parallel execution
-            async def process_single_rag_query(doc_url: str, q: str, source_id: str):
-                """Process a single RAG query for a URL and query combination."""
-                try:
-                    # Perform RAG query using existing function
-                    rag_result_str = await perform_rag_query(ctx, q, source_id, match_count=5)
-                    rag_result = json.loads(rag_result_str)
-                    
-                    if rag_result.get("success", False) and rag_result.get("results"):
-                        # Format RAG results for this URL and query
-                        formatted_results = []
-                        for result in rag_result["results"]:
-                            formatted_results.append({
-                                "content": result.get("content", ""),
-                                "similarity": result.get("similarity", 0),
-                                "metadata": result.get("metadata", {})
-                            })
-                        return doc_url, q, formatted_results
-                    else:
-                        return doc_url, q, "No relevant results found"
-                    
-                except Exception as e:
-                    return doc_url, q, f"RAG query error: {str(e)}"
-            
-            # Use provided max_rag_workers or get from environment or use default
-            if max_rag_workers is None:
-                max_rag_workers = int(os.getenv("MAX_RAG_WORKERS", "5"))
-            
-            # Create semaphore for rate limiting
-            semaphore = asyncio.Semaphore(max_rag_workers)
-            
-            async def rate_limited_query(doc_url, q, source_id):
-                async with semaphore:
-                    return await process_single_rag_query(doc_url, q, source_id)
-            
-            # Build list of all query tasks
-            query_tasks = []
-            for doc in crawl_results:
-                doc_url = doc['url']
-                # Extract source_id from URL for RAG filtering
-                parsed_url = urlparse(doc_url)
-                source_id = parsed_url.netloc or parsed_url.path
-                
-                results[doc_url] = {}
-                
-                for q in query:
-                    query_tasks.append(rate_limited_query(doc_url, q, source_id))
-            
-            # Execute all queries in parallel
-            query_results = await asyncio.gather(*query_tasks)
-            
-            # Process results
-            for doc_url, q, result in query_results:
-                results[doc_url][q] = result
-                total_rag_queries += 1
-            
-            return json.dumps({
-                "success": True,
-                "mode": "rag_query",
-                "crawl_type": crawl_type,
-                "results": results,
-                "summary": {
-                    "pages_crawled": len(crawl_results),
-                    "queries_processed": len(query),
-                    "total_rag_queries": total_rag_queries,
-                    "max_rag_workers": max_rag_workers
-                }
-            }, indent=2)
+        # Crawl jobs keep their checkpoint so they can be resumed later
+        if job.kind == "crawl_job" and lifespan_context.crawl_job_store:
+            lifespan_context.crawl_job_store.update_job(job_id, status=JOB_CANCELLED)
         
-        # Default mode - return crawl statistics as before
-        return json.dumps({
+        if not lifespan_context.job_queue.cancel(job_id):
+            return dumps({
+                "success": False,
+                "job_id": job_id,
+                "error": f"Job is already {job.status}"
+            })
+        
+        job = await lifespan_context.job_queue.wait(job_id, timeout=30.0)
+        return dumps({
             "success": True,
-            "url": url,
-            "crawl_type": crawl_type,
-            "pages_crawled": len(crawl_results),
-            "chunks_stored": chunk_count,
-            "code_examples_stored": len(code_examples),
-            "sources_updated": len(source_content_map),
-            "urls_crawled": [doc['url'] for doc in crawl_results][:5] + (["..."] if len(crawl_results) > 5 else [])
-        }, indent=2)
+            "job": job.to_dict()
+        })
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
-            "url": url,
+            "job_id": job_id,
             "error": str(e)
-        }, indent=2)
+        })
+
+@mcp.resource("crawl4ai://documents/{document_id}", mime_type="text/markdown")
+def read_linked_document(document_id: str) -> str:
+    """Full content of a document linked from a size-capped tool response."""
+    document = get_document(document_id)
+    if document is None:
+        raise ValueError(f"Document {document_id} not found or expired")
+    return document["content"]
+
+@mcp.tool()
+@traced_tool
+async def get_response_page(ctx: Context, cursor: str) -> str:
+    """
+    Get the next page of results of a tool response that was too large to return at once.
+    
+    Large responses carry a "pagination" object; pass its next_cursor here until it is null.
+    
+    Args:
+        cursor: The next_cursor of the previous page
+    
+    Returns:
+        JSON string with the page's results and pagination
+    """
+    page = load_page(cursor)
+    if page is None:
+        return dumps({
+            "success": False,
+            "cursor": cursor,
+            "error": "Unknown or expired cursor"
+        })
+    return dumps({"success": True, **page})
+
+@mcp.tool()
+@traced_tool
+async def get_linked_document(ctx: Context, resource_uri: str, offset: int = 0, max_chars: int = 50000) -> str:
+    """
+    Read a document that a size-capped tool response linked instead of returning inline.
+    
+    Clients that support MCP resources can read the resource_uri directly; this tool returns
+    the same content in slices of at most max_chars characters.
+    
+    Args:
+        resource_uri: The crawl4ai://documents/... URI from the response
+        offset: Character offset to start reading at (default: 0)
+        max_chars: Maximum characters to return (default: 50000)
+    
+    Returns:
+        JSON string with the content slice and the offset of the next slice (null at the end)
+    """
+    document = get_document(resource_uri)
+    if document is None:
+        return dumps({
+            "success": False,
+            "resource_uri": resource_uri,
+            "error": "Document not found or expired"
+        })
+    content = document["content"]
+    offset = max(offset, 0)
+    end = offset + max(max_chars, 1)
+    return dumps({
+        "success": True,
+        "resource_uri": resource_uri,
+        "url": document.get("url"),
+        "content": content[offset:end],
+        "offset": offset,
+        "content_length": len(content),
+        "next_offset": end if end < len(content) else None
+    })
 
 @mcp.tool()
+@traced_tool
 async def get_available_sources(ctx: Context) -> str:
     """
     Get all available sources from the sources table.
@@ -1437,30 +2786,42 @@ async def get_available_sources(ctx: Context) -> str:
                     "updated_at": source.get("updated_at")
                 })
         
-        return json.dumps({
+        return dumps({
             "success": True,
             "sources": sources,
             "count": len(sources)
-        }, indent=2)
+        })
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
             "error": str(e)
-        }, indent=2)
+        })
 
 @mcp.tool()
-async def perform_rag_query(ctx: Context, query: str, source: str = None, match_count: int = 5) -> str:
+@traced_tool
+async def perform_rag_query(ctx: Context, query: str, source: Union[str, List[str]] = None, match_count: int = 5, expand_to_section: bool = False, per_source_limit: int = None, diversify: bool = None) -> str:
     """
     Perform a RAG (Retrieval Augmented Generation) query on the stored content.
     
     This tool searches the vector database for content relevant to the query and returns
-    the matching documents. Optionally filter by source domain.
+    the matching documents. Optionally filter by source domain, or by a list of source
+    domains to search them all at once in one ranked list.
     Get the source by using the get_available_sources tool before calling this search!
     
+    With expand_to_section, each matching chunk is replaced by the full heading section it
+    belongs to (up to RAG_SECTION_MAX_CHARS characters), and chunks from the same section
+    are returned once.
+    
+    With diversify, results are picked by maximal marginal relevance from a larger candidate
+    pool, so near-identical chunks (e.g. from versioned or mirrored pages) are returned once.
+    
     Args:
         query: The search query
-        source: Optional source domain to filter results (e.g., 'example.com')
+        source: Optional source domain, or list of source domains, to filter results (e.g., 'example.com')
         match_count: Maximum number of results to return (default: 5)
+        expand_to_section: Return the enclosing section of each match instead of the chunk (default: False)
+        per_source_limit: With several sources, the maximum number of results from each (default: no limit)
+        diversify: Diversify the results by maximal marginal relevance (default: USE_MMR or false)
     
     Returns:
         JSON string with the search results
@@ -1474,43 +2835,79 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
         
         # Input validation
         if not query or not query.strip():
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Query cannot be empty"
-            }, indent=2)
+            })
         
         if match_count <= 0:
             match_count = 5
         elif match_count > 50:  # Reasonable limit
             match_count = 50
         
-        # Validate and sanitize source filter
-        if source:
-            source = source.strip()
-            if not source:
-                source = None
-            elif len(source) > 200:  # Reasonable limit
-                return json.dumps({
-                    "success": False,
-                    "error": "Source filter too long (max 200 characters)"
-                }, indent=2)
+        # Validate and sanitize source filter (one source ID or a list of them)
+        sources = source if isinstance(source, list) else [source]
+        sources = list(dict.fromkeys(s.strip() for s in sources if isinstance(s, str) and s.strip()))
+        if any(len(s) > 200 for s in sources):  # Reasonable limit
+            return dumps({
+                "success": False,
+                "error": "Source filter too long (max 200 characters)"
+            })
+        if len(sources) > 20:
+            return dumps({
+                "success": False,
+                "error": "Too many sources (max 20)"
+            })
+        source = sources[0] if len(sources) == 1 else None
+        multi_source = len(sources) > 1
+        if not multi_source or (per_source_limit is not None and per_source_limit <= 0):
+            per_source_limit = None
+        cache_source = tuple(sorted(sources)) if multi_source else source
+        if diversify is None:
+            diversify = os.getenv("USE_MMR", "false") == "true"
         
         # Get the Supabase client from the context
         supabase_client = ctx.request_context.lifespan_context.supabase_client
         
         if not supabase_client:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Database client not available"
-            }, indent=2)
+            })
         
         # Check if hybrid search is enabled
         use_hybrid_search = os.getenv("USE_HYBRID_SEARCH", "false") == "true"
         
+        # Repeated queries are answered from the cache until the source gets new content
+        reranking_enabled = os.getenv("USE_RERANKING", "false") == "true" and ctx.request_context.lifespan_context.reranking_model is not None
+        section_chars = int(os.getenv("RAG_SECTION_MAX_CHARS", "8000")) if expand_to_section else 0
+        cache_key = RETRIEVAL_CACHE.key("rag", query, cache_source, match_count,
+                                        (use_hybrid_search, reranking_enabled, section_chars, per_source_limit,
+                                         mmr_settings() if diversify else None))
+        cached = RETRIEVAL_CACHE.get(cache_key, cache_source)
+        if cached is not None:
+            increment("retrieval_cache_hits")
+            return dumps({**cached, "cached": True, "processing_time_seconds": round(time.time() - query_start_time, 4)})
+        cache_generation = RETRIEVAL_CACHE.generation(cache_source)
+        hybrid_requested = use_hybrid_search
+        
         # Prepare source filter if source is provided and not empty
         # The source parameter should be the source_id (domain) not full URL
-        if source:
-            print(f"[DEBUG] Using source filter: '{source}'")
+        if sources:
+            print(f"[DEBUG] Using source filter: {sources}")
+        
+        def vector_search(count: int) -> List[Dict[str, Any]]:
+            if diversify:
+                return search_documents_diverse(supabase_client, query, count, sources or None, per_source_limit)
+            # Several sources are searched in one ranked list with a single embedding and RPC
+            if multi_source:
+                return search_documents_in_sources(supabase_client, query, sources, count, per_source_limit)
+            return search_documents(
+                client=supabase_client,
+                query=query,
+                match_count=count,
+                source_id_filter=source  # Use source_id_filter instead of filter_metadata
+            )
         
         results = []
         
@@ -1525,12 +2922,7 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
                     vector_results = await asyncio.wait_for(
                         asyncio.get_event_loop().run_in_executor(
                             None,
-                            lambda: search_documents(
-                                client=supabase_client,
-                                query=query,
-                                match_count=match_count * 2,  # Get double to have room for filtering
-                                source_id_filter=source  # Use source_id_filter instead of filter_metadata
-                            )
+                            propagate(lambda: vector_search(match_count * 2))  # Get double to have room for filtering
                         ),
                         timeout=15.0
                     )
@@ -1552,15 +2944,18 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
                     # Apply source filter if provided
                     if source:
                         keyword_query = keyword_query.eq('source_id', source)
+                    elif multi_source:
+                        keyword_query = keyword_query.in_('source_id', sources)
                     
                     # Execute keyword search with timeout
-                    keyword_response = await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(
-                            None,
-                            lambda: keyword_query.limit(match_count * 2).execute()
-                        ),
-                        timeout=10.0
-                    )
+                    with span("keyword_search"):
+                        keyword_response = await asyncio.wait_for(
+                            asyncio.get_event_loop().run_in_executor(
+                                None,
+                                lambda: keyword_query.limit(match_count * 2).execute()
+                            ),
+                            timeout=10.0
+                        )
                     keyword_results = keyword_response.data if keyword_response.data else []
                     print(f"Keyword search completed: {len(keyword_results)} results")
                 except asyncio.TimeoutError:
@@ -1572,45 +2967,7 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
                 
                 # 3. Combine results with preference for items appearing in both
                 if vector_results or keyword_results:
-                    seen_ids = set()
-                    combined_results = []
-                    
-                    # First, add items that appear in both searches (these are the best matches)
-                    vector_ids = {r.get('id') for r in vector_results if r.get('id')}
-                    for kr in keyword_results:
-                        if kr['id'] in vector_ids and kr['id'] not in seen_ids:
-                            # Find the vector result to get similarity score
-                            for vr in vector_results:
-                                if vr.get('id') == kr['id']:
-                                    # Boost similarity score for items in both results
-                                    vr['similarity'] = min(1.0, vr.get('similarity', 0) * 1.2)
-                                    combined_results.append(vr)
-                                    seen_ids.add(kr['id'])
-                                    break
-                    
-                    # Then add remaining vector results (semantic matches without exact keyword)
-                    for vr in vector_results:
-                        if vr.get('id') and vr['id'] not in seen_ids and len(combined_results) < match_count:
-                            combined_results.append(vr)
-                            seen_ids.add(vr['id'])
-                    
-                    # Finally, add pure keyword matches if we still need more results
-                    for kr in keyword_results:
-                        if kr['id'] not in seen_ids and len(combined_results) < match_count:
-                            # Convert keyword result to match vector result format
-                            combined_results.append({
-                                'id': kr['id'],
-                                'url': kr['url'],
-                                'chunk_number': kr['chunk_number'],
-                                'content': kr['content'],
-                                'metadata': kr['metadata'],
-                                'source_id': kr['source_id'],
-                                'similarity': 0.5  # Default similarity for keyword-only matches
-                            })
-                            seen_ids.add(kr['id'])
-                    
-                    # Use combined results
-                    results = combined_results[:match_count]
+                    results = _combine_hybrid_results(vector_results, keyword_results, match_count)
                     print(f"Hybrid search combined: {len(results)} final results")
                 else:
                     print("No results from either vector or keyword search")
@@ -1627,30 +2984,36 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
                 results = await asyncio.wait_for(
                     asyncio.get_event_loop().run_in_executor(
                         None,
-                        lambda: search_documents(
-                            client=supabase_client,
-                            query=query,
-                            match_count=match_count,
-                            source_id_filter=source  # Use source_id_filter instead of filter_metadata
-                        )
+                        propagate(lambda: vector_search(match_count))
                     ),
                     timeout=20.0
                 )
                 print(f"Vector search completed: {len(results)} results")
             except asyncio.TimeoutError:
                 print("Vector search timed out")
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "query": query,
                     "error": "Search query timed out after 20 seconds. Try reducing match_count or simplifying the query."
-                }, indent=2)
+                })
             except Exception as e:
                 print(f"Vector search failed: {e}")
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "query": query,
                     "error": f"Database search failed: {str(e)}"
-                }, indent=2)
+                })
+        
+        # Per-source quota (the multi-source RPC applies it already; hybrid merging may not)
+        if per_source_limit:
+            per_source_counts = {}
+            quota_results = []
+            for result in results:
+                result_source = result.get('source_id', '')
+                if per_source_counts.get(result_source, 0) < per_source_limit:
+                    per_source_counts[result_source] = per_source_counts.get(result_source, 0) + 1
+                    quota_results.append(result)
+            results = quota_results
         
         # Apply reranking if enabled and we have results
         use_reranking = os.getenv("USE_RERANKING", "false") == "true"
@@ -1660,12 +3023,12 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
                 reranked_results = await asyncio.wait_for(
                     asyncio.get_event_loop().run_in_executor(
                         None,
-                        lambda: rerank_results(
+                        propagate(lambda: rerank_results(
                             ctx.request_context.lifespan_context.reranking_model,
                             query,
                             results,
                             content_key="content"
-                        )
+                        ))
                     ),
                     timeout=10.0
                 )
@@ -1676,6 +3039,17 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
             except Exception as e:
                 print(f"Reranking failed: {e}, using original results")
         
+        # Small-to-big: swap matched chunks for their enclosing sections
+        if expand_to_section and results:
+            try:
+                max_section_chars = int(os.getenv("RAG_SECTION_MAX_CHARS", "8000"))
+                results = await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    propagate(lambda: expand_results_to_sections(supabase_client, results, max_chars=max_section_chars))
+                )
+            except Exception as e:
+                print(f"Section expansion failed: {e}, returning chunks")
+        
         # Format the results
         formatted_results = []
         for result in results:
@@ -1689,6 +3063,9 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
                 # Include rerank score if available
                 if "rerank_score" in result:
                     formatted_result["rerank_score"] = result["rerank_score"]
+                if result.get("expanded_to_section"):
+                    formatted_result["heading_path"] = result["heading_path"]
+                    formatted_result["matched_chunks"] = result["matched_chunks"]
                 formatted_results.append(formatted_result)
             except Exception as e:
                 print(f"Error formatting result: {e}")
@@ -1697,30 +3074,38 @@ async def perform_rag_query(ctx: Context, query: str, source: str = None, match_
         processing_time = time.time() - query_start_time
         print(f"RAG query completed in {processing_time:.2f}s with {len(formatted_results)} results")
         
-        return json.dumps({
+        response = {
             "success": True,
             "query": query,
-            "source_filter": source,
+            "source_filter": sources if multi_source else source,
+            "per_source_limit": per_source_limit,
             "search_mode": "hybrid" if use_hybrid_search else "vector",
+            "diversified": diversify,
             "reranking_applied": use_reranking and ctx.request_context.lifespan_context.reranking_model is not None,
+            "expanded_to_section": expand_to_section,
             "results": formatted_results,
             "count": len(formatted_results),
             "processing_time_seconds": round(processing_time, 2)
-        }, indent=2)
+        }
+        # Empty and degraded (hybrid fell back to vector) results are not worth repeating
+        if formatted_results and use_hybrid_search == hybrid_requested:
+            RETRIEVAL_CACHE.put(cache_key, response, cache_generation)
+        return dumps(response)
         
     except Exception as e:
         processing_time = time.time() - query_start_time
         print(f"RAG query failed after {processing_time:.2f}s: {e}")
-        return json.dumps({
+        return dumps({
             "success": False,
             "query": query,
             "source_filter": source,
             "error": f"Search operation failed: {str(e)}",
             "processing_time_seconds": round(processing_time, 2)
-        }, indent=2)
+        })
 
 @mcp.tool()
-async def search_code_examples(ctx: Context, query: str, source_id: str = None, match_count: int = 5) -> str:
+@traced_tool
+async def search_code_examples(ctx: Context, query: str, source_id: str = None, match_count: int = 5, diversify: bool = None) -> str:
     """
     Search for code examples relevant to the query.
     
@@ -1734,6 +3119,7 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
         query: The search query
         source_id: Optional source ID to filter results (e.g., 'example.com')
         match_count: Maximum number of results to return (default: 5)
+        diversify: Pick diverse results by maximal marginal relevance, dropping near-duplicate examples (default: USE_MMR or false)
     
     Returns:
         JSON string with the search results
@@ -1741,10 +3127,10 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
     # Check if code example extraction is enabled
     extract_code_examples_enabled = os.getenv("USE_AGENTIC_RAG", "false") == "true"
     if not extract_code_examples_enabled:
-        return json.dumps({
+        return dumps({
             "success": False,
             "error": "Code example extraction is disabled. Perform a normal RAG search."
-        }, indent=2)
+        })
     
     try:
         # Get the Supabase client from the context
@@ -1758,6 +3144,19 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
         if source_id and source_id.strip():
             filter_metadata = {"source": source_id}
         
+        # Repeated queries are answered from the cache until the source gets new content
+        reranking_enabled = os.getenv("USE_RERANKING", "false") == "true" and ctx.request_context.lifespan_context.reranking_model is not None
+        cache_source = source_id.strip() if source_id and source_id.strip() else None
+        if diversify is None:
+            diversify = os.getenv("USE_MMR", "false") == "true"
+        cache_key = RETRIEVAL_CACHE.key("code", query, cache_source, match_count,
+                                        (use_hybrid_search, reranking_enabled, mmr_settings() if diversify else None))
+        cached = RETRIEVAL_CACHE.get(cache_key, cache_source)
+        if cached is not None:
+            increment("retrieval_cache_hits")
+            return dumps({**cached, "cached": True})
+        cache_generation = RETRIEVAL_CACHE.generation(cache_source)
+        
         if use_hybrid_search:
             # Hybrid search: combine vector and keyword search
             
@@ -1765,12 +3164,15 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
             from utils import search_code_examples as search_code_examples_impl
             
             # 1. Get vector search results (get more to account for filtering)
-            vector_results = search_code_examples_impl(
-                client=supabase_client,
-                query=query,
-                match_count=match_count * 2,  # Get double to have room for filtering
-                filter_metadata=filter_metadata
-            )
+            if diversify:
+                vector_results = search_code_examples_diverse(supabase_client, query, match_count * 2, cache_source)
+            else:
+                vector_results = search_code_examples_impl(
+                    client=supabase_client,
+                    query=query,
+                    match_count=match_count * 2,  # Get double to have room for filtering
+                    filter_metadata=filter_metadata
+                )
             
             # 2. Get keyword search results using ILIKE on both content and summary
             keyword_query = supabase_client.from_('code_examples')\
@@ -1831,12 +3233,15 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
             # Standard vector search only
             from utils import search_code_examples as search_code_examples_impl
             
-            results = search_code_examples_impl(
-                client=supabase_client,
-                query=query,
-                match_count=match_count,
-                filter_metadata=filter_metadata
-            )
+            if diversify:
+                results = search_code_examples_diverse(supabase_client, query, match_count, cache_source)
+            else:
+                results = search_code_examples_impl(
+                    client=supabase_client,
+                    query=query,
+                    match_count=match_count,
+                    filter_metadata=filter_metadata
+                )
         
         # Apply reranking if enabled
         use_reranking = os.getenv("USE_RERANKING", "false") == "true"
@@ -1859,23 +3264,28 @@ async def search_code_examples(ctx: Context, query: str, source_id: str = None,
                 formatted_result["rerank_score"] = result["rerank_score"]
             formatted_results.append(formatted_result)
         
-        return json.dumps({
+        response = {
             "success": True,
             "query": query,
             "source_filter": source_id,
             "search_mode": "hybrid" if use_hybrid_search else "vector",
+            "diversified": diversify,
             "reranking_applied": use_reranking and ctx.request_context.lifespan_context.reranking_model is not None,
             "results": formatted_results,
             "count": len(formatted_results)
-        }, indent=2)
+        }
+        if formatted_results:
+            RETRIEVAL_CACHE.put(cache_key, response, cache_generation)
+        return dumps(response)
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
             "query": query,
             "error": str(e)
-        }, indent=2)
+        })
 
 @mcp.tool()
+@traced_tool
 async def check_ai_script_hallucinations(ctx: Context, script_path: str) -> str:
     """
     Check an AI-generated Python script for hallucinations using the knowledge graph.
@@ -1901,28 +3311,28 @@ async def check_ai_script_hallucinations(ctx: Context, script_path: str) -> str:
         # Check if knowledge graph functionality is enabled
         knowledge_graph_enabled = os.getenv("USE_KNOWLEDGE_GRAPH", "false") == "true"
         if not knowledge_graph_enabled:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Knowledge graph functionality is disabled. Set USE_KNOWLEDGE_GRAPH=true in environment."
-            }, indent=2)
+            })
         
         # Get the knowledge validator from context
         knowledge_validator = ctx.request_context.lifespan_context.knowledge_validator
         
         if not knowledge_validator:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Knowledge graph validator not available. Check Neo4j configuration in environment variables."
-            }, indent=2)
+            })
         
         # Validate script path
         validation = validate_script_path(script_path)
         if not validation["valid"]:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "script_path": script_path,
                 "error": validation["error"]
-            }, indent=2)
+            })
         
         # Step 1: Analyze script structure using AST
         analyzer = AIScriptAnalyzer()
@@ -1939,7 +3349,7 @@ async def check_ai_script_hallucinations(ctx: Context, script_path: str) -> str:
         report = reporter.generate_comprehensive_report(validation_result)
         
         # Format response with comprehensive information
-        return json.dumps({
+        return dumps({
             "success": True,
             "script_path": script_path,
             "overall_confidence": validation_result.overall_confidence,
@@ -1961,16 +3371,17 @@ async def check_ai_script_hallucinations(ctx: Context, script_path: str) -> str:
                 "total_functions": report["analysis_metadata"]["total_functions"]
             },
             "libraries_analyzed": report.get("libraries_analyzed", [])
-        }, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
             "script_path": script_path,
             "error": f"Analysis failed: {str(e)}"
-        }, indent=2)
+        })
 
 @mcp.tool()
+@traced_tool
 async def query_knowledge_graph(ctx: Context, command: str) -> str:
     """
     Query and explore the Neo4j knowledge graph containing repository data.
@@ -2039,27 +3450,27 @@ async def query_knowledge_graph(ctx: Context, command: str) -> str:
         # Check if knowledge graph functionality is enabled
         knowledge_graph_enabled = os.getenv("USE_KNOWLEDGE_GRAPH", "false") == "true"
         if not knowledge_graph_enabled:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Knowledge graph functionality is disabled. Set USE_KNOWLEDGE_GRAPH=true in environment."
-            }, indent=2)
+            })
         
         # Get Neo4j driver from context
         repo_extractor = ctx.request_context.lifespan_context.repo_extractor
         if not repo_extractor or not repo_extractor.driver:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Neo4j connection not available. Check Neo4j configuration in environment variables."
-            }, indent=2)
+            })
         
         # Parse command
         command = command.strip()
         if not command:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "command": "",
                 "error": "Command cannot be empty. Available commands: repos, explore <repo>, classes [repo], class <name>, method <name> [class], query <cypher>"
-            }, indent=2)
+            })
         
         parts = command.split()
         cmd = parts[0].lower()
@@ -2071,55 +3482,55 @@ async def query_knowledge_graph(ctx: Context, command: str) -> str:
                 return await _handle_repos_command(session, command)
             elif cmd == "explore":
                 if not args:
-                    return json.dumps({
+                    return dumps({
                         "success": False,
                         "command": command,
                         "error": "Repository name required. Usage: explore <repo_name>"
-                    }, indent=2)
+                    })
                 return await _handle_explore_command(session, command, args[0])
             elif cmd == "classes":
                 repo_name = args[0] if args else None
                 return await _handle_classes_command(session, command, repo_name)
             elif cmd == "class":
                 if not args:
-                    return json.dumps({
+                    return dumps({
                         "success": False,
                         "command": command,
                         "error": "Class name required. Usage: class <class_name>"
-                    }, indent=2)
+                    })
                 return await _handle_class_command(session, command, args[0])
             elif cmd == "method":
                 if not args:
-                    return json.dumps({
+                    return dumps({
                         "success": False,
                         "command": command,
                         "error": "Method name required. Usage: method <method_name> [class_name]"
-                    }, indent=2)
+                    })
                 method_name = args[0]
                 class_name = args[1] if len(args) > 1 else None
                 return await _handle_method_command(session, command, method_name, class_name)
             elif cmd == "query":
                 if not args:
-                    return json.dumps({
+                    return dumps({
                         "success": False,
                         "command": command,
                         "error": "Cypher query required. Usage: query <cypher_query>"
-                    }, indent=2)
+                    })
                 cypher_query = " ".join(args)
                 return await _handle_query_command(session, command, cypher_query)
             else:
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "command": command,
                     "error": f"Unknown command '{cmd}'. Available commands: repos, explore <repo>, classes [repo], class <name>, method <name> [class], query <cypher>"
-                }, indent=2)
+                })
                 
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
             "command": command,
             "error": f"Query execution failed: {str(e)}"
-        }, indent=2)
+        })
 
 
 async def _handle_repos_command(session, command: str) -> str:
@@ -2131,7 +3542,7 @@ async def _handle_repos_command(session, command: str) -> str:
     async for record in result:
         repos.append(record['name'])
     
-    return json.dumps({
+    return dumps({
         "success": True,
         "command": command,
         "data": {
@@ -2141,7 +3552,7 @@ async def _handle_repos_command(session, command: str) -> str:
             "total_results": len(repos),
             "limited": False
         }
-    }, indent=2)
+    })
 
 
 async def _handle_explore_command(session, command: str, repo_name: str) -> str:
@@ -2152,11 +3563,11 @@ async def _handle_explore_command(session, command: str, repo_name: str) -> str:
     repo_record = await result.single()
     
     if not repo_record:
-        return json.dumps({
+        return dumps({
             "success": False,
             "command": command,
             "error": f"Repository '{repo_name}' not found in knowledge graph"
-        }, indent=2)
+        })
     
     # Get file count
     files_query = """
@@ -2190,7 +3601,7 @@ async def _handle_explore_command(session, command: str, repo_name: str) -> str:
     result = await session.run(methods_query, repo_name=repo_name)
     method_count = (await result.single())['method_count']
     
-    return json.dumps({
+    return dumps({
         "success": True,
         "command": command,
         "data": {
@@ -2206,7 +3617,7 @@ async def _handle_explore_command(session, command: str, repo_name: str) -> str:
             "total_results": 1,
             "limited": False
         }
-    }, indent=2)
+    })
 
 
 async def _handle_classes_command(session, command: str, repo_name: str = None) -> str:
@@ -2237,7 +3648,7 @@ async def _handle_classes_command(session, command: str, repo_name: str = None)
             'full_name': record['full_name']
         })
     
-    return json.dumps({
+    return dumps({
         "success": True,
         "command": command,
         "data": {
@@ -2248,7 +3659,7 @@ async def _handle_classes_command(session, command: str, repo_name: str = None)
             "total_results": len(classes),
             "limited": len(classes) >= limit
         }
-    }, indent=2)
+    })
 
 
 async def _handle_class_command(session, command: str, class_name: str) -> str:
@@ -2264,11 +3675,11 @@ async def _handle_class_command(session, command: str, class_name: str) -> str:
     class_record = await result.single()
     
     if not class_record:
-        return json.dumps({
+        return dumps({
             "success": False,
             "command": command,
             "error": f"Class '{class_name}' not found in knowledge graph"
-        }, indent=2)
+        })
     
     actual_name = class_record['name']
     full_name = class_record['full_name']
@@ -2308,7 +3719,7 @@ async def _handle_class_command(session, command: str, class_name: str) -> str:
             'type': record['type'] or 'Any'
         })
     
-    return json.dumps({
+    return dumps({
         "success": True,
         "command": command,
         "data": {
@@ -2325,7 +3736,7 @@ async def _handle_class_command(session, command: str, class_name: str) -> str:
             "attributes_count": len(attributes),
             "limited": False
         }
-    }, indent=2)
+    })
 
 
 async def _handle_method_command(session, command: str, method_name: str, class_name: str = None) -> str:
@@ -2366,13 +3777,13 @@ async def _handle_method_command(session, command: str, method_name: str, class_
         })
     
     if not methods:
-        return json.dumps({
+        return dumps({
             "success": False,
             "command": command,
             "error": f"Method '{method_name}'" + (f" in class '{class_name}'" if class_name else "") + " not found"
-        }, indent=2)
+        })
     
-    return json.dumps({
+    return dumps({
         "success": True,
         "command": command,
         "data": {
@@ -2383,7 +3794,7 @@ async def _handle_method_command(session, command: str, method_name: str, class_
             "total_results": len(methods),
             "limited": len(methods) >= 20 and not class_name
         }
-    }, indent=2)
+    })
 
 
 async def _handle_query_command(session, command: str, cypher_query: str) -> str:
@@ -2400,7 +3811,7 @@ async def _handle_query_command(session, command: str, cypher_query: str) -> str
             if count >= 20:  # Limit results to prevent overwhelming responses
                 break
         
-        return json.dumps({
+        return dumps({
             "success": True,
             "command": command,
             "data": {
@@ -2411,21 +3822,22 @@ async def _handle_query_command(session, command: str, cypher_query: str) -> str
                 "total_results": len(records),
                 "limited": len(records) >= 20
             }
-        }, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
             "command": command,
             "error": f"Cypher query error: {str(e)}",
             "data": {
                 "query": cypher_query
             }
-        }, indent=2)
+        })
 
 
 @mcp.tool()
-async def parse_github_repository(ctx: Context, repo_url: str) -> str:
+@traced_tool
+async def parse_github_repository(ctx: Context, repo_url: str, background: bool = False) -> str:
     """
     Parse a GitHub repository into the Neo4j knowledge graph.
     
@@ -2441,36 +3853,46 @@ async def parse_github_repository(ctx: Context, repo_url: str) -> str:
     
     Args:
         repo_url: GitHub repository URL (e.g., 'https://github.com/user/repo.git')
+        background: If True, queue the parse as a background job and return its job ID immediately (default: False)
     
     Returns:
         JSON string with parsing results, statistics, and repository information
     """
+    if background:
+        return _submit_background_job(
+            ctx,
+            "parse_github_repository",
+            f"Parse {repo_url}",
+            LANE_BULK,
+            lambda: parse_github_repository(ctx, repo_url)
+        )
+    
     try:
         # Check if knowledge graph functionality is enabled
         knowledge_graph_enabled = os.getenv("USE_KNOWLEDGE_GRAPH", "false") == "true"
         if not knowledge_graph_enabled:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Knowledge graph functionality is disabled. Set USE_KNOWLEDGE_GRAPH=true in environment."
-            }, indent=2)
+            })
         
         # Get the repository extractor from context
         repo_extractor = ctx.request_context.lifespan_context.repo_extractor
         
         if not repo_extractor:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "error": "Repository extractor not available. Check Neo4j configuration in environment variables."
-            }, indent=2)
+            })
         
         # Validate repository URL
         validation = validate_github_url(repo_url)
         if not validation["valid"]:
-            return json.dumps({
+            return dumps({
                 "success": False,
                 "repo_url": repo_url,
                 "error": validation["error"]
-            }, indent=2)
+            })
         
         repo_name = validation["repo_name"]
         
@@ -2525,13 +3947,13 @@ async def parse_github_repository(ctx: Context, repo_url: str) -> str:
                     "sample_modules": record['sample_modules'] or []
                 }
             else:
-                return json.dumps({
+                return dumps({
                     "success": False,
                     "repo_url": repo_url,
                     "error": f"Repository '{repo_name}' not found in database after parsing"
-                }, indent=2)
+                })
         
-        return json.dumps({
+        return dumps({
             "success": True,
             "repo_url": repo_url,
             "repo_name": repo_name,
@@ -2543,14 +3965,14 @@ async def parse_github_repository(ctx: Context, repo_url: str) -> str:
                 f"Use check_ai_script_hallucinations to validate scripts against {repo_name}",
                 "The knowledge graph contains classes, methods, and functions from this repository"
             ]
-        }, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return dumps({
             "success": False,
             "repo_url": repo_url,
             "error": f"Repository parsing failed: {str(e)}"
-        }, indent=2)
+        })
 
 async def crawl_markdown_file(crawler: AsyncWebCrawler, url: str) -> List[Dict[str, Any]]:
     """
@@ -2563,10 +3985,12 @@ async def crawl_markdown_file(crawler: AsyncWebCrawler, url: str) -> List[Dict[s
     Returns:
         List of dictionaries with URL and markdown content
     """
-    crawl_config = CrawlerRunConfig()
+    crawl_config = build_crawler_run_config()
 
-    result = await crawler.arun(url=url, config=crawl_config)
+    with span("crawl"):
+        result = await crawler.arun(url=url, config=crawl_config)
     if result.success and result.markdown:
+        increment("pages_crawled")
         return [{'url': url, 'markdown': result.markdown}]
     else:
         print(f"Failed to crawl {url}: {result.error_message}")
@@ -2584,15 +4008,22 @@ async def crawl_batch(crawler: AsyncWebCrawler, urls: List[str], max_concurrent:
     Returns:
         List of dictionaries with URL and markdown content
     """
-    crawl_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
+    crawl_config = build_crawler_run_config(cache_mode=CacheMode.BYPASS, stream=False)
     dispatcher = MemoryAdaptiveDispatcher(
         memory_threshold_percent=70.0,
         check_interval=1.0,
         max_session_permit=max_concurrent
     )
 
-    results = await crawler.arun_many(urls=urls, config=crawl_config, dispatcher=dispatcher)
-    return [{'url': r.url, 'markdown': r.markdown, 'links': r.links} for r in results if r.success and r.markdown]
+    with span("crawl"):
+        results = await crawler.arun_many(urls=urls, config=crawl_config, dispatcher=dispatcher)
+    pages = [
+        {'url': r.url, 'markdown': r.markdown, 'links': r.links, 'canonical_url': extract_canonical_url(r.html, r.url),
+         'redirected_url': getattr(r, 'redirected_url', None)}
+        for r in results if r.success and r.markdown
+    ]
+    increment("pages_crawled", len(pages))
+    return pages
 
 async def crawl_recursive_internal_links(crawler: AsyncWebCrawler, start_urls: List[str], max_depth: int = 3, max_concurrent: int = 10) -> List[Dict[str, Any]]:
     """
@@ -2607,39 +4038,62 @@ async def crawl_recursive_internal_links(crawler: AsyncWebCrawler, start_urls: L
     Returns:
         List of dictionaries with URL and markdown content
     """
-    run_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
+    run_config = build_crawler_run_config(cache_mode=CacheMode.BYPASS, stream=False)
     dispatcher = MemoryAdaptiveDispatcher(
         memory_threshold_percent=70.0,
         check_interval=1.0,
         max_session_permit=max_concurrent
     )
 
+    # Visited pages are tracked by canonical key so tracking params, trailing slashes,
+    # index documents and http/https variants of a page are only crawled once
     visited = set()
+    # Canonical keys of pages actually stored; a failed crawl does not claim its canonical URL
+    stored_keys = set()
+    detector = create_near_duplicate_detector()
 
     def normalize_url(url):
         return urldefrag(url)[0]
 
-    current_urls = set([normalize_url(u) for u in start_urls])
+    def url_key(url):
+        return canonicalize_url(url, drop_scheme=True)
+
+    current_urls = {url_key(u): normalize_url(u) for u in start_urls}
     results_all = []
 
     for depth in range(max_depth):
-        urls_to_crawl = [normalize_url(url) for url in current_urls if normalize_url(url) not in visited]
+        urls_to_crawl = [url for key, url in current_urls.items() if key not in visited]
         if not urls_to_crawl:
             break
 
-        results = await crawler.arun_many(urls=urls_to_crawl, config=run_config, dispatcher=dispatcher)
-        next_level_urls = set()
+        with span("crawl"):
+            results = await crawler.arun_many(urls=urls_to_crawl, config=run_config, dispatcher=dispatcher)
+        increment("pages_crawled", sum(1 for result in results if result.success))
+        next_level_urls = {}
 
         for result in results:
-            norm_url = normalize_url(result.url)
-            visited.add(norm_url)
+            visited.add(url_key(result.url))
 
             if result.success and result.markdown:
+                # Pages pointing at an already stored canonical URL are duplicates
+                page_key = url_key(result.url)
+                canonical_url = extract_canonical_url(result.html, result.url)
+                canonical_key = url_key(canonical_url) if canonical_url else page_key
+                if canonical_key in stored_keys and canonical_key != page_key:
+                    continue
+
+                if detector and detector.check(result.url, result.markdown):
+                    continue
+
                 results_all.append({'url': result.url, 'markdown': result.markdown})
+                stored_keys.update((page_key, canonical_key))
+                # The canonical URL's content is stored now; do not crawl it separately
+                visited.add(canonical_key)
                 for link in result.links.get("internal", []):
                     next_url = normalize_url(link["href"])
-                    if next_url not in visited:
-                        next_level_urls.add(next_url)
+                    next_key = url_key(next_url)
+                    if next_key not in visited and next_key not in next_level_urls:
+                        next_level_urls[next_key] = next_url
 
         current_urls = next_level_urls
 
@@ -0,0 +1,319 @@
+"""
+Persistent storage for resumable crawl jobs.
+
+A crawl job keeps its frontier, visited set and per-page status in a local SQLite
+database, so long crawls survive client disconnects, tool timeouts and server
+restarts and can be resumed without re-crawling pages that were already stored.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+# Job statuses
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_INTERRUPTED = "interrupted"
+JOB_COMPLETED = "completed"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+
+# Page statuses
+PAGE_PENDING = "pending"
+PAGE_IN_PROGRESS = "in_progress"
+PAGE_DONE = "done"
+PAGE_DUPLICATE = "duplicate"
+PAGE_FAILED = "failed"
+# Crawled, but pointing at a canonical URL that is still queued; settled when that URL is
+PAGE_WAITING = "waiting"
+
+_SCHEMA = """
+create table if not exists crawl_jobs (
+    job_id text primary key,
+    start_url text not null,
+    status text not null,
+    params text not null default '{}',
+    stats text not null default '{}',
+    error text,
+    created_at real not null,
+    updated_at real not null
+);
+
+create table if not exists crawl_job_pages (
+    job_id text not null references crawl_jobs(job_id) on delete cascade,
+    url_key text not null,
+    url text not null,
+    depth integer not null default 0,
+    status text not null,
+    error text,
+    chunks_stored integer not null default 0,
+    fingerprint text,
+    waiting_on text,
+    updated_at real not null,
+    primary key (job_id, url_key)
+);
+
+create index if not exists idx_crawl_job_pages_status on crawl_job_pages (job_id, status);
+"""
+
+
+def _format_fingerprint(fingerprint: Optional[int]) -> Optional[str]:
+    # 64-bit fingerprints do not fit SQLite's signed integers; store them as hex
+    return None if fingerprint is None else format(fingerprint, "016x")
+
+
+def get_default_db_path() -> str:
+    """Get the crawl job database path from CRAWL_JOBS_DB or the project's data folder."""
+    default_path = Path(__file__).resolve().parent.parent / 'data' / 'crawl_jobs.db'
+    return os.getenv("CRAWL_JOBS_DB", str(default_path))
+
+
+class CrawlJobStore:
+    """SQLite-backed store for crawl jobs, their frontier and per-page status."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or get_default_db_path()
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma foreign_keys=on")
+        self._conn.executescript(_SCHEMA)
+        # Databases created before page fingerprints and canonical waits were persisted
+        columns = {row["name"] for row in self._conn.execute("pragma table_info(crawl_job_pages)")}
+        for column in ("fingerprint", "waiting_on"):
+            if column not in columns:
+                self._conn.execute(f"alter table crawl_job_pages add column {column} text")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def create_job(self, start_url: str, params: Dict[str, Any]) -> str:
+        """
+        Create a new crawl job.
+
+        Args:
+            start_url: URL the crawl starts from
+            params: Crawl parameters (crawl_type, max_depth, max_concurrent, chunk_size, ...)
+
+        Returns:
+            The new job ID
+        """
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "insert into crawl_jobs (job_id, start_url, status, params, created_at, updated_at) values (?, ?, ?, ?, ?, ?)",
+                (job_id, start_url, JOB_PENDING, json.dumps(params), now, now)
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job with its parameters and stats, or None if it does not exist."""
+        with self._lock:
+            row = self._conn.execute("select * from crawl_jobs where job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["stats"] = json.loads(job["stats"])
+        return job
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """List the most recently updated jobs."""
+        with self._lock:
+            rows = self._conn.execute(
+                "select job_id from crawl_jobs order by updated_at desc limit ?", (limit,)
+            ).fetchall()
+        return [self.get_job(row["job_id"]) for row in rows]
+
+    def update_job(self, job_id: str, status: Optional[str] = None, stats: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """Update a job's status, stats and/or error message."""
+        assignments = ["updated_at = ?"]
+        values: List[Any] = [time.time()]
+        if status is not None:
+            assignments.append("status = ?")
+            values.append(status)
+        if stats is not None:
+            assignments.append("stats = ?")
+            values.append(json.dumps(stats))
+        if error is not None:
+            assignments.append("error = ?")
+            values.append(error)
+        values.append(job_id)
+        with self._lock, self._conn:
+            self._conn.execute(f"update crawl_jobs set {', '.join(assignments)} where job_id = ?", values)
+
+    def mark_running_jobs_interrupted(self) -> int:
+        """Mark jobs left running by a previous server process as interrupted."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "update crawl_jobs set status = ?, updated_at = ? where status in (?, ?)",
+                (JOB_INTERRUPTED, time.time(), JOB_RUNNING, JOB_PENDING)
+            )
+        return cursor.rowcount
+
+    def add_pages(self, job_id: str, pages: List[Tuple[str, str, int]], status: str = PAGE_PENDING) -> int:
+        """
+        Add pages to a job's frontier, ignoring pages the job has already seen.
+
+        Args:
+            job_id: The job ID
+            pages: List of (url_key, url, depth) tuples
+            status: Initial page status (pages recorded as done are never crawled)
+
+        Returns:
+            Number of pages newly added
+        """
+        if not pages:
+            return 0
+        now = time.time()
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "insert or ignore into crawl_job_pages (job_id, url_key, url, depth, status, updated_at) values (?, ?, ?, ?, ?, ?)",
+                [(job_id, url_key, url, depth, status, now) for url_key, url, depth in pages]
+            )
+            return self._conn.total_changes - before
+
+    def get_page_status(self, job_id: str, url_key: str) -> Optional[str]:
+        """Get the status of a page in a job's frontier, or None if the job has not seen it."""
+        with self._lock:
+            row = self._conn.execute(
+                "select status from crawl_job_pages where job_id = ? and url_key = ?", (job_id, url_key)
+            ).fetchone()
+        return row["status"] if row else None
+
+    def claim_pending_pages(self, job_id: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Take the next pending pages off the frontier (shallowest first) and mark them in progress.
+
+        Args:
+            job_id: The job ID
+            limit: Maximum number of pages to claim
+
+        Returns:
+            List of page dictionaries with url_key, url and depth
+        """
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "select url_key, url, depth from crawl_job_pages where job_id = ? and status = ? order by depth, rowid limit ?",
+                (job_id, PAGE_PENDING, limit)
+            ).fetchall()
+            self._conn.executemany(
+                "update crawl_job_pages set status = ?, updated_at = ? where job_id = ? and url_key = ?",
+                [(PAGE_IN_PROGRESS, time.time(), job_id, row["url_key"]) for row in rows]
+            )
+        return [dict(row) for row in rows]
+
+    def release_in_progress_pages(self, job_id: str) -> int:
+        """Return pages that were in progress when a job stopped to the frontier."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "update crawl_job_pages set status = ?, updated_at = ? where job_id = ? and status = ?",
+                (PAGE_PENDING, time.time(), job_id, PAGE_IN_PROGRESS)
+            )
+        return cursor.rowcount
+
+    def complete_pages(
+        self,
+        job_id: str,
+        updates: List[Tuple[str, str, Optional[str], int]],
+        fingerprints: Optional[Dict[str, int]] = None,
+        waiting_on: Optional[Dict[str, str]] = None,
+        canonical_claims: Optional[List[Tuple[str, str, int]]] = None
+    ) -> Tuple[int, int]:
+        """
+        Record the outcome of crawled pages and settle the pages waiting on them.
+
+        Args:
+            job_id: The job ID
+            updates: List of (url_key, status, error, chunks_stored) tuples
+            fingerprints: Optional SimHash fingerprints of stored pages by url_key, kept to
+                rebuild near-duplicate detection when the job resumes
+            waiting_on: Canonical url_key each PAGE_WAITING page waits on
+            canonical_claims: (url_key, url, depth) of canonical URLs whose content was stored
+                under another page; recorded as done unless the job has them done or queued
+
+        Returns:
+            Tuple of (waiting pages settled as duplicates, waiting pages put back on the frontier)
+        """
+        fingerprints = fingerprints or {}
+        waiting_on = waiting_on or {}
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "update crawl_job_pages set status = ?, error = ?, chunks_stored = ?, fingerprint = coalesce(?, fingerprint), "
+                "waiting_on = ?, updated_at = ? where job_id = ? and url_key = ?",
+                [
+                    (status, error, chunks_stored, _format_fingerprint(fingerprints.get(url_key)), waiting_on.get(url_key),
+                     now, job_id, url_key)
+                    for url_key, status, error, chunks_stored in updates
+                ]
+            )
+            self._conn.executemany(
+                "insert into crawl_job_pages (job_id, url_key, url, depth, status, updated_at) values (?, ?, ?, ?, ?, ?) "
+                "on conflict (job_id, url_key) do update set status = excluded.status, error = null, waiting_on = null, "
+                "updated_at = excluded.updated_at where crawl_job_pages.status in (?, ?, ?)",
+                [
+                    (job_id, url_key, url, depth, PAGE_DONE, now, PAGE_FAILED, PAGE_DUPLICATE, PAGE_WAITING)
+                    for url_key, url, depth in canonical_claims or []
+                ]
+            )
+            return self._settle_waiting_pages(job_id, now)
+
+    def _settle_waiting_pages(self, job_id: str, now: float) -> Tuple[int, int]:
+        # Waiting pages are duplicates once their canonical URL is stored, and are crawled
+        # again (to take its place) if it failed. Repeat for chains of canonical URLs.
+        settle = (
+            "update crawl_job_pages set status = ?, waiting_on = null, updated_at = ? "
+            "where job_id = ? and status = ? and exists (select 1 from crawl_job_pages as target "
+            "where target.job_id = crawl_job_pages.job_id and target.url_key = crawl_job_pages.waiting_on "
+            "and target.status in ({}))"
+        )
+        duplicates = requeued = 0
+        while True:
+            settled_duplicates = self._conn.execute(
+                settle.format("?, ?"), (PAGE_DUPLICATE, now, job_id, PAGE_WAITING, PAGE_DONE, PAGE_DUPLICATE)
+            ).rowcount
+            settled_requeued = self._conn.execute(
+                settle.format("?"), (PAGE_PENDING, now, job_id, PAGE_WAITING, PAGE_FAILED)
+            ).rowcount
+            duplicates += settled_duplicates
+            requeued += settled_requeued
+            if not settled_duplicates and not settled_requeued:
+                return duplicates, requeued
+
+    def get_page_fingerprints(self, job_id: str) -> List[Tuple[str, int]]:
+        """Get the (url, fingerprint) pairs of the pages a job has stored, in crawl order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "select url, fingerprint from crawl_job_pages where job_id = ? and status = ? and fingerprint is not null order by rowid",
+                (job_id, PAGE_DONE)
+            ).fetchall()
+        return [(row["url"], int(row["fingerprint"], 16)) for row in rows]
+
+    def get_page_counts(self, job_id: str) -> Dict[str, int]:
+        """Get the number of pages per status for a job."""
+        with self._lock:
+            rows = self._conn.execute(
+                "select status, count(*) as count from crawl_job_pages where job_id = ? group by status", (job_id,)
+            ).fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def get_failed_pages(self, job_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get a sample of pages that failed to crawl."""
+        with self._lock:
+            rows = self._conn.execute(
+                "select url, error from crawl_job_pages where job_id = ? and status = ? limit ?",
+                (job_id, PAGE_FAILED, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,272 @@
+"""
+In-process background job queue for long-running MCP tool work.
+
+Jobs run on bounded asyncio worker pools split into priority lanes: an interactive
+lane for small, latency-sensitive work and a bulk lane for large crawls and repository
+parsing, so a big ingestion job can never starve quick requests. Tool calls that
+submit a job return its ID immediately while the work continues in the background.
+"""
+import asyncio
+import contextvars
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Priority lanes
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+# Job statuses
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+_current_job: contextvars.ContextVar[Optional["Job"]] = contextvars.ContextVar("current_job", default=None)
+
+
+@dataclass
+class Job:
+    """A unit of background work and its progress."""
+    job_id: str
+    kind: str
+    description: str
+    lane: str
+    run: Callable[["Job"], Awaitable[Any]]
+    status: str = JOB_QUEUED
+    progress: float = 0.0
+    total: Optional[float] = None
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = None
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def report_progress(self, progress: float, total: Optional[float] = None, message: Optional[str] = None):
+        """Update the job's progress and wake up anyone waiting on it."""
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        self.changed.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Format the job for a tool response."""
+        now = time.time()
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "description": self.description,
+            "lane": self.lane,
+            "status": self.status,
+            "progress": self.progress,
+            "total": self.total,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "queued_seconds": round((self.started_at or now) - self.created_at, 2),
+            "running_seconds": round((self.finished_at or now) - self.started_at, 2) if self.started_at else 0.0
+        }
+
+
+def report_job_progress(progress: float, total: Optional[float] = None, message: Optional[str] = None):
+    """
+    Report progress for the background job running the current code, if any.
+
+    Safe to call from code that may or may not be running inside a job.
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.report_progress(progress, total, message)
+
+
+class JobQueue:
+    """Bounded asyncio worker pools with interactive and bulk priority lanes."""
+
+    def __init__(self, interactive_workers: int = 4, bulk_workers: int = 2, max_finished_jobs: int = 200):
+        self.lane_workers = {
+            LANE_INTERACTIVE: max(1, interactive_workers),
+            LANE_BULK: max(1, bulk_workers)
+        }
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, Job] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: List[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        """Create a job queue sized from JOB_INTERACTIVE_WORKERS and JOB_BULK_WORKERS."""
+        return cls(
+            interactive_workers=int(os.getenv("JOB_INTERACTIVE_WORKERS", "4")),
+            bulk_workers=int(os.getenv("JOB_BULK_WORKERS", "2"))
+        )
+
+    async def start(self):
+        """Start the worker pools. Must be called from the server's event loop."""
+        for lane, worker_count in self.lane_workers.items():
+            self._queues[lane] = asyncio.Queue()
+            for i in range(worker_count):
+                self._workers.append(asyncio.create_task(self._worker(lane), name=f"job-worker-{lane}-{i}"))
+
+    async def shutdown(self):
+        """Cancel all queued and running jobs and stop the workers."""
+        for job in self.jobs.values():
+            if not job.finished:
+                self.cancel(job.job_id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def submit(
+        self,
+        kind: str,
+        run: Callable[[Job], Awaitable[Any]],
+        description: str = "",
+        lane: str = LANE_INTERACTIVE,
+        job_id: Optional[str] = None
+    ) -> Job:
+        """
+        Queue a job for background execution.
+
+        Args:
+            kind: Job kind (usually the name of the tool that submitted it)
+            run: Coroutine function called with the Job once a worker picks it up
+            description: Human-readable description of the job
+            lane: LANE_INTERACTIVE or LANE_BULK
+            job_id: Optional job ID to use instead of a generated one
+
+        Returns:
+            The queued Job
+        """
+        if lane not in self._queues:
+            raise ValueError(f"Unknown job lane '{lane}'")
+
+        job_id = job_id or uuid.uuid4().hex[:12]
+        existing = self.jobs.get(job_id)
+        if existing and not existing.finished:
+            raise ValueError(f"Job '{job_id}' is already {existing.status}")
+
+        job = Job(job_id=job_id, kind=kind, description=description, lane=lane, run=run)
+        self.jobs[job_id] = job
+        self._queues[lane].put_nowait(job)
+        self._prune_finished_jobs()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def is_active(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        return job is not None and not job.finished
+
+    def list_jobs(self, limit: int = 20) -> List[Job]:
+        """List the most recently created jobs."""
+        return sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)[:limit]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a queued or running job.
+
+        Returns:
+            True if the job was cancelled, False if it was unknown or already finished
+        """
+        job = self.jobs.get(job_id)
+        if not job or job.finished:
+            return False
+        if job.task:
+            job.task.cancel()
+        else:
+            self._finish(job, JOB_CANCELLED)
+        return True
+
+    async def wait(self, job_id: str, timeout: float, on_progress: Optional[Callable[[Job], Awaitable[None]]] = None) -> Optional[Job]:
+        """
+        Wait for a job to finish, calling on_progress every time it reports progress.
+
+        Args:
+            job_id: ID of the job to wait for
+            timeout: Maximum number of seconds to wait
+            on_progress: Optional coroutine function called with the job on every progress update
+
+        Returns:
+            The job (finished or not), or None if it is unknown
+        """
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+
+        deadline = time.monotonic() + timeout
+        while not job.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job.changed.clear()
+            try:
+                await asyncio.wait_for(job.changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if on_progress:
+                await on_progress(job)
+        return job
+
+    async def _worker(self, lane: str):
+        queue = self._queues[lane]
+        while True:
+            job = await queue.get()
+            try:
+                if job.finished:
+                    # Cancelled while still queued
+                    continue
+                await self._run_job(job)
+            finally:
+                queue.task_done()
+
+    async def _run_job(self, job: Job):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.changed.set()
+
+        token = _current_job.set(job)
+        job.task = asyncio.create_task(job.run(job))
+        try:
+            result = await job.task
+            job.result = result
+            self._finish(job, JOB_COMPLETED)
+        except asyncio.CancelledError:
+            self._finish(job, JOB_CANCELLED)
+            if asyncio.current_task().cancelling():
+                # The worker itself is being cancelled (server shutdown)
+                raise
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, JOB_FAILED)
+        finally:
+            _current_job.reset(token)
+            job.task = None
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        job.changed.set()
+
+    def _prune_finished_jobs(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        if len(finished) <= self.max_finished_jobs:
+            return
+        finished.sort(key=lambda job: job.finished_at or 0)
+        for job in finished[:len(finished) - self.max_finished_jobs]:
+            del self.jobs[job.job_id]
@@ -0,0 +1,383 @@
+"""
+Single-pass structural parser for crawled markdown.
+
+Walks a page's markdown once, jumping from block boundary to block boundary, and
+produces a MarkdownDocument: the top-level blocks (headings, paragraphs and fenced
+code blocks with their language) as offsets into the original text, per-block word
+counts, and the tree of sections defined by the headings. Chunking, chunk metadata and code example extraction all
+read from this document instead of rescanning the page.
+"""
+import bisect
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Tuple
+
+# Block kinds
+BLOCK_TEXT = "text"
+BLOCK_HEADING = "heading"
+BLOCK_FENCE = "fence"
+
+# A paragraph ends before a blank line or a line that could open a heading or a fenced code block
+_PARAGRAPH_END_RE = re.compile(r'\n(?=[ \t]*(?:\n|\Z)| {0,3}(?:#{1,6}(?:[ \t]|$)|`{3,}|~{3,}))', re.MULTILINE)
+_NON_BLANK_RE = re.compile(r'\S')
+
+
+@dataclass(slots=True)
+class MarkdownBlock:
+    """A top-level markdown block. Offsets exclude the trailing newline and trailing whitespace."""
+    kind: str
+    start: int
+    end: int
+    word_count: int
+    section: int = -1        # Index of the enclosing section, -1 before the first heading
+    level: int = 0           # Heading level (headings only)
+    title: str = ""          # Heading text (headings only)
+    language: str = ""       # First word of the info string (fences only)
+    content_start: int = 0   # Offsets of the code between the fence lines (fences only)
+    content_end: int = 0
+
+
+@dataclass(slots=True)
+class MarkdownSection:
+    """A heading and everything up to the next heading of the same or a higher level."""
+    index: int
+    level: int
+    title: str
+    start: int
+    end: int
+    parent: int = -1         # Index of the parent section, -1 for top-level sections
+
+
+@dataclass(slots=True)
+class CodeBlock:
+    """
+    A fenced code block of a page. Holds offsets into the page text; the code and its
+    surrounding context are only sliced out when they are read.
+    """
+    text: str = field(repr=False)
+    start: int               # Offsets of the whole block, fence lines included
+    end: int
+    code_start: int          # Offsets of the code, without surrounding whitespace
+    code_end: int
+    language: str = ""
+    context_chars: int = 1000
+
+    @property
+    def code(self) -> str:
+        return self.text[self.code_start:self.code_end]
+
+    @property
+    def context_before(self) -> str:
+        return self.text[max(0, self.start - self.context_chars):self.start].strip()
+
+    @property
+    def context_after(self) -> str:
+        return self.text[self.end:self.end + self.context_chars].strip()
+
+    @property
+    def full_context(self) -> str:
+        return f"{self.context_before}\n\n{self.code}\n\n{self.context_after}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the block as a dictionary with code, language, context_before, context_after and full_context."""
+        return {
+            'code': self.code,
+            'language': self.language,
+            'context_before': self.context_before,
+            'context_after': self.context_after,
+            'full_context': self.full_context
+        }
+
+
+@dataclass
+class MarkdownDocument:
+    """Structured view of a markdown page."""
+    text: str
+    blocks: List[MarkdownBlock] = field(default_factory=list)
+    sections: List[MarkdownSection] = field(default_factory=list)
+    _block_starts: List[int] = field(default_factory=list, repr=False)
+
+    @property
+    def word_count(self) -> int:
+        return sum(block.word_count for block in self.blocks)
+
+    def blocks_between(self, start: int, end: int) -> List[MarkdownBlock]:
+        """Get the blocks that lie entirely within text[start:end]."""
+        first = bisect.bisect_left(self._block_starts, start)
+        last = bisect.bisect_right(self._block_starts, end)
+        return [block for block in self.blocks[first:last] if block.end <= end]
+
+    def breadcrumb(self, section_index: int) -> List[str]:
+        """Get the titles of a section and its ancestors, outermost first."""
+        titles = []
+        while section_index >= 0:
+            section = self.sections[section_index]
+            titles.append(section.title)
+            section_index = section.parent
+        return titles[::-1]
+
+    def outline(self) -> List[Dict[str, Any]]:
+        """
+        Get one row per section for a hierarchical (parent/child) section index.
+
+        Each row covers only the section's own text, from its heading up to the next heading
+        of any level, so a section's full text is the concatenation of the rows from its
+        index through last_descendant.
+
+        Returns:
+            List of dictionaries with section_index, parent_index, level, title, heading_path,
+            last_descendant, start and end (offsets of the section's own text)
+        """
+        sections = self.sections
+        last_descendant = list(range(len(sections)))
+        for section in reversed(sections):
+            if section.parent >= 0:
+                last_descendant[section.parent] = max(last_descendant[section.parent], last_descendant[section.index])
+        rows = []
+        for section in sections:
+            own_end = sections[section.index + 1].start if section.index + 1 < len(sections) else len(self.text)
+            rows.append({
+                "section_index": section.index,
+                "parent_index": section.parent,
+                "level": section.level,
+                "title": section.title,
+                "heading_path": self.breadcrumb(section.index),
+                "last_descendant": last_descendant[section.index],
+                "start": section.start,
+                "end": _rstrip_offset(self.text, section.start, own_end)
+            })
+        return rows
+
+    def code_blocks(self, min_length: int = 1000, context_chars: int = 1000) -> List[CodeBlock]:
+        """
+        Get the fenced code blocks with at least min_length characters of code.
+
+        Args:
+            min_length: Minimum length of the code, ignoring surrounding whitespace
+            context_chars: Characters of surrounding text to use as context before and after each block
+
+        Returns:
+            List of CodeBlocks, in page order
+        """
+        code_blocks = []
+        for block in self.blocks:
+            if block.kind == BLOCK_FENCE:
+                _append_code_block(code_blocks, self.text, block.start, block.end, block.content_start,
+                                   block.content_end, block.language, min_length, context_chars)
+        return code_blocks
+
+
+def _fence_opener(line: str) -> Optional[Tuple[str, int]]:
+    """Return (fence character, fence length) if line opens a fenced code block."""
+    indent = len(line) - len(line.lstrip(' '))
+    if indent > 3:
+        return None
+    marker = line[indent:indent + 1]
+    if marker not in ('`', '~'):
+        return None
+    length = len(line) - indent - len(line[indent:].lstrip(marker))
+    if length < 3:
+        return None
+    if marker == '`' and '`' in line[indent + length:]:
+        # Backtick fences can't have backticks in their info string (that's inline code)
+        return None
+    return marker, length
+
+
+def _heading_level(line: str) -> int:
+    """Return the ATX heading level of line, or 0 if it is not a heading."""
+    stripped = line.lstrip(' ')
+    if not stripped.startswith('#') or len(line) - len(stripped) > 3:
+        return 0
+    level = len(stripped) - len(stripped.lstrip('#'))
+    if level > 6 or (len(stripped) > level and stripped[level] not in ' \t'):
+        return 0
+    return level
+
+
+def _find_closing_fence(text: str, start: int, marker: str, length: int) -> Optional[Tuple[int, int]]:
+    """Find the line closing a fence opened with length marker characters, as (line start, line end)."""
+    fence = marker * 3
+    pos = text.find(fence, start)
+    while pos != -1:
+        line_start = text.rfind('\n', 0, pos) + 1
+        line_end = text.find('\n', pos)
+        if line_end == -1:
+            line_end = len(text)
+        if line_start >= start and _closes_fence(text[line_start:line_end], marker, length):
+            return line_start, line_end
+        pos = text.find(fence, line_end)
+    return None
+
+
+def _closes_fence(line: str, marker: str, length: int) -> bool:
+    stripped = line.strip()
+    return len(stripped) >= length and stripped == marker * len(stripped) and len(line) - len(line.lstrip(' ')) <= 3
+
+
+def _lstrip_offset(text: str, start: int, end: int) -> int:
+    """Move start forward over leading whitespace, stopping at end."""
+    while start < end and text[start].isspace():
+        start += 1
+    return start
+
+
+def _rstrip_offset(text: str, start: int, end: int) -> int:
+    """Move end back over trailing whitespace, stopping at start."""
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def _append_code_block(code_blocks: List[CodeBlock], text: str, start: int, end: int, content_start: int,
+                       content_end: int, language: str, min_length: int, context_chars: int):
+    if content_end - content_start < min_length:
+        return
+    code_start = _lstrip_offset(text, content_start, content_end)
+    code_end = _rstrip_offset(text, code_start, content_end)
+    if code_end - code_start >= min_length:
+        code_blocks.append(CodeBlock(text, start, end, code_start, code_end, language=language, context_chars=context_chars))
+
+
+def scan_code_blocks(text: str, min_length: int = 1000, context_chars: int = 1000) -> List[CodeBlock]:
+    """
+    Find the fenced code blocks of markdown without parsing the rest of its structure.
+
+    Gives the same blocks as parse_markdown(text).code_blocks(), but only visits fence
+    lines: fences may interrupt paragraphs and headings are a single line, so neither can
+    hide a fence opener.
+
+    Args:
+        text: Markdown text
+        min_length: Minimum length of the code, ignoring surrounding whitespace
+        context_chars: Characters of surrounding text to use as context before and after each block
+
+    Returns:
+        List of CodeBlocks, in page order
+    """
+    code_blocks = []
+    text_length = len(text)
+    pos = 0
+    next_backticks = text.find('```')
+    next_tildes = text.find('~~~')
+    while True:
+        # Jump to the next ``` or ~~~ with str.find; only lines holding one can open a fence
+        if next_backticks != -1 and next_backticks < pos:
+            next_backticks = text.find('```', pos)
+        if next_tildes != -1 and next_tildes < pos:
+            next_tildes = text.find('~~~', pos)
+        if next_backticks == -1 and next_tildes == -1:
+            break
+        found = next_tildes if next_backticks == -1 or (next_tildes != -1 and next_tildes < next_backticks) else next_backticks
+        start = text.rfind('\n', 0, found) + 1
+        newline = text.find('\n', found)
+        line_end = text_length if newline == -1 else newline
+        opener = _fence_opener(text[start:line_end]) if found - start <= 3 else None
+        if not opener:
+            pos = line_end
+            continue
+        marker, length = opener
+        info = text[start:line_end].strip()[length:].split()
+        content_start = min(line_end + 1, text_length)
+        closing = _find_closing_fence(text, content_start, marker, length)
+        if closing:
+            content_end = max(content_start, closing[0] - 1)
+            end = _rstrip_offset(text, closing[0], closing[1])
+        else:
+            content_end = text_length
+            end = _rstrip_offset(text, start, text_length)
+        _append_code_block(code_blocks, text, start, end, content_start, content_end,
+                           info[0] if info else "", min_length, context_chars)
+        if not closing:
+            break
+        pos = closing[1]
+    return code_blocks
+
+
+def parse_markdown(text: str) -> MarkdownDocument:
+    """
+    Parse markdown into blocks and sections in a single pass.
+
+    The scanner jumps from block boundary to block boundary: paragraph ends and closing
+    fences are located with regular expressions, so the lines inside a paragraph or a
+    code block are never visited one by one. Fenced code blocks (``` or ~~~) are kept
+    whole, including any blank lines or '#' lines inside them; an unterminated fence runs
+    to the end of the text.
+
+    Args:
+        text: Markdown text
+
+    Returns:
+        MarkdownDocument for the text
+    """
+    document = MarkdownDocument(text=text)
+    blocks = document.blocks
+    sections = document.sections
+    open_sections: List[MarkdownSection] = []  # Stack of sections enclosing the current block
+    text_length = len(text)
+    pos = 0
+
+    while True:
+        # Skip blank lines to the start of the next block's line
+        match = _NON_BLANK_RE.search(text, pos)
+        if not match:
+            break
+        pos = text.rfind('\n', 0, match.start()) + 1
+        newline = text.find('\n', pos)
+        line_end = text_length if newline == -1 else newline
+        section_index = open_sections[-1].index if open_sections else -1
+
+        first_char = match.group()
+        opener = _fence_opener(text[pos:line_end]) if first_char in '`~' else None
+        level = _heading_level(text[pos:line_end]) if first_char == '#' else 0
+
+        if opener:
+            marker, length = opener
+            info = text[pos:line_end].strip()[length:].split()
+            content_start = min(line_end + 1, text_length)
+            closing = _find_closing_fence(text, content_start, marker, length)
+            if closing:
+                content_end = max(content_start, closing[0] - 1)
+                end = _rstrip_offset(text, closing[0], closing[1])
+            else:
+                content_end = text_length
+                end = _rstrip_offset(text, pos, text_length)
+            blocks.append(MarkdownBlock(
+                BLOCK_FENCE, pos, end, len(text[pos:end].split()), section=section_index,
+                language=info[0] if info else "", content_start=content_start, content_end=content_end
+            ))
+        elif level:
+            while open_sections and open_sections[-1].level >= level:
+                open_sections.pop().end = pos
+            line = text[pos:line_end]
+            title = line.strip()[level:].strip().rstrip('#').strip()
+            section = MarkdownSection(
+                index=len(sections), level=level, title=title, start=pos, end=text_length,
+                parent=open_sections[-1].index if open_sections else -1
+            )
+            sections.append(section)
+            open_sections.append(section)
+            end = _rstrip_offset(text, pos, line_end)
+            blocks.append(MarkdownBlock(BLOCK_HEADING, pos, end, len(line.split()),
+                                        section=section.index, level=level, title=title))
+        else:
+            # Paragraph: runs until a blank line, heading or fence opener
+            search_from = line_end
+            while True:
+                paragraph_end = _PARAGRAPH_END_RE.search(text, search_from)
+                if not paragraph_end:
+                    break
+                # A backtick line only interrupts the paragraph if it really opens a fence
+                next_start = paragraph_end.end()
+                next_newline = text.find('\n', next_start)
+                next_line = text[next_start:text_length if next_newline == -1 else next_newline]
+                if not next_line.lstrip(' ').startswith('`') or _fence_opener(next_line):
+                    break
+                search_from = next_start
+            end = _rstrip_offset(text, pos, paragraph_end.start() if paragraph_end else text_length)
+            blocks.append(MarkdownBlock(BLOCK_TEXT, pos, end, len(text[pos:end].split()), section=section_index))
+
+        pos = end
+
+    document._block_starts = [block.start for block in blocks]
+    return document
@@ -0,0 +1,284 @@
+"""
+Per-stage tracing and Prometheus metrics for the MCP tools.
+
+Every tool call runs inside a trace. Code on the way (crawling, chunking, embedding, the
+Supabase RPCs, reranking, ...) opens named spans and bumps counters (tokens, rows,
+retries, cache hits); each is recorded twice:
+
+- into the current tool call's trace, summarized as "metrics" in the tool's JSON response
+- into the process-wide registry, served in the Prometheus text format on METRICS_PORT
+
+Stage times of spans that run concurrently (e.g. per-URL RAG queries in search) are summed,
+so a stage can report more seconds than the tool's total.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from responses import cap_response, dumps
+
+# Histogram buckets in seconds, from a cached lookup to a deep crawl
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, List[float]]] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None, help: str = ""):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            if help:
+                self._help.setdefault(name, help)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, help: str = ""):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Per-bucket counts, then sum and count
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+            if help:
+                self._help.setdefault(name, help)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, state in sorted(series.items()):
+                    cumulative = 0.0
+                    for bound, count in zip(self.buckets, state):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {cumulative:g}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {state[-1]:g}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {state[-2]:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {state[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class ToolTrace:
+    """Stage timings and counters of one tool call."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.start = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def add_counter(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Any]:
+        """Summarize the trace: total seconds, per-stage seconds and call counts, and counters."""
+        with self._lock:
+            return {
+                "total_seconds": round(time.perf_counter() - self.start, 3),
+                "stages": {stage: {"seconds": round(seconds, 3), "count": count}
+                           for stage, (seconds, count) in self.stages.items()},
+                "counters": {name: int(value) if float(value).is_integer() else round(value, 3)
+                             for name, value in self.counters.items()}
+            }
+
+
+_current_trace: contextvars.ContextVar[Optional[ToolTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[ToolTrace]:
+    """Get the trace of the tool call running the current code, if any."""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of the current tool call."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        trace = _current_trace.get()
+        REGISTRY.observe("mcp_stage_duration_seconds", seconds,
+                         {"tool": trace.tool if trace else "none", "stage": stage},
+                         help="Duration of tool stages in seconds")
+        if trace is not None:
+            trace.add_stage(stage, seconds)
+
+
+def increment(name: str, value: float = 1):
+    """Add to a counter of the current tool call (exported as mcp_<name>_total)."""
+    if not value:
+        return
+    trace = _current_trace.get()
+    REGISTRY.inc(f"mcp_{name}_total", value, {"tool": trace.tool if trace else "none"})
+    if trace is not None:
+        trace.add_counter(name, value)
+
+
+def record_usage(prefix: str, response: Any):
+    """Count an API request and the tokens reported in its usage, as <prefix>_requests and <prefix>_tokens."""
+    increment(f"{prefix}_requests")
+    usage = getattr(response, "usage", None)
+    tokens = getattr(usage, "total_tokens", None)
+    if isinstance(tokens, int):
+        increment(f"{prefix}_tokens", tokens)
+
+
+def propagate(fn: Callable) -> Callable:
+    """
+    Bind fn to the current tool call's trace, for code handed to executor threads
+    (which do not inherit context variables).
+    """
+    trace = _current_trace.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+    return run
+
+
+def metrics_in_response() -> bool:
+    return os.getenv("METRICS_IN_RESPONSE", "true") == "true"
+
+
+def traced_tool(fn: Callable) -> Callable:
+    """
+    Run an async tool inside a trace and add the trace summary to its JSON response, which
+    is size-capped and serialized by the responses module.
+
+    A tool called by another tool (search calling scrape_urls) is recorded as a
+    "tool:<name>" stage of the outer call instead of starting its own trace.
+    """
+    tool = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if _current_trace.get() is not None:
+            with span(f"tool:{tool}"):
+                return await fn(*args, **kwargs)
+
+        trace = ToolTrace(tool)
+        token = _current_trace.set(trace)
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            REGISTRY.inc("mcp_tool_calls_total", 1, {"tool": tool, "status": "exception"})
+            raise
+        finally:
+            _current_trace.reset(token)
+            REGISTRY.observe("mcp_tool_duration_seconds", time.perf_counter() - trace.start, {"tool": tool},
+                             help="Duration of tool calls in seconds")
+
+        response = None
+        if isinstance(result, str) and result.startswith("{"):
+            try:
+                response = json.loads(result)
+            except ValueError:
+                response = None
+        status = "success" if not isinstance(response, dict) or response.get("success", True) else "error"
+        REGISTRY.inc("mcp_tool_calls_total", 1, {"tool": tool, "status": status}, help="Tool calls by outcome")
+
+        if isinstance(response, dict):
+            response = cap_response(response)
+            if metrics_in_response():
+                response["metrics"] = trace.summary()
+            return dumps(response)
+        return result
+
+    return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics in the Prometheus text format on a background thread.
+
+    Args:
+        port: Port to listen on; defaults to METRICS_PORT, and nothing is started when neither is set
+
+    Returns:
+        The running server (call shutdown() to stop it), or None
+    """
+    if port is None:
+        port_setting = os.getenv("METRICS_PORT", "")
+        if not port_setting:
+            return None
+        port = int(port_setting)
+    server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "0.0.0.0"), port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
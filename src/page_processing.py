@@ -0,0 +1,402 @@
+"""
+CPU-bound post-processing of crawled pages, optionally spread over worker processes.
+
+Chunking, section metadata and code block extraction hold the GIL, so on large crawls
+they serialize behind the event loop. PageProcessor can hand this work to a pool of
+worker processes: the markdown of a whole batch is written once into a shared memory
+segment, and workers send back chunk offsets and small metadata dictionaries instead
+of copies of the page text, which the coordinator then slices from its own strings.
+"""
+import multiprocessing
+import os
+import sys
+import concurrent.futures
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urlparse
+
+from markdown_parser import CodeBlock, MarkdownBlock, MarkdownDocument, BLOCK_HEADING, parse_markdown
+
+# Rough characters per token for English prose and code, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def _get_tokenizer():
+    """Load the tiktoken encoding used by the embedding models, or None if it is unavailable."""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # tiktoken is optional (and needs to download its vocabulary once)
+            _tokenizer = None
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken if available, otherwise estimate them from the text length."""
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _count_span_tokens(text: str, start: int, end: int) -> int:
+    """Count the tokens of text[start:end], without slicing when they are only estimated."""
+    if _get_tokenizer() is None:
+        return (end - start + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return count_tokens(text[start:end])
+
+
+def _split_oversized_block(text: str, start: int, end: int, tokens: int, max_tokens: int) -> List[Tuple[int, int, int]]:
+    """
+    Split a block larger than the token budget into pieces at line, then sentence, then word breaks.
+
+    Returns:
+        List of (start, end, estimated tokens) pieces
+    """
+    chars_per_token = (end - start) / tokens
+    max_chars = max(1, int(max_tokens * chars_per_token))
+    pieces = []
+    while end - start > max_chars:
+        limit = start + max_chars
+        cut = text.rfind('\n', start, limit)
+        if cut <= start:
+            cut = text.rfind('. ', start, limit) + 1
+        if cut <= start:
+            cut = text.rfind(' ', start, limit)
+        if cut <= start:
+            cut = limit
+        pieces.append((start, cut, max(1, round((cut - start) / chars_per_token))))
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        pieces.append((start, end, max(1, round((end - start) / chars_per_token))))
+    return pieces
+
+
+def chunk_document(document: MarkdownDocument, chunk_size: int = 5000, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[Tuple[int, int, Dict[str, Any]]]:
+    """
+    Chunk a parsed markdown page, packing whole blocks up to a token budget.
+
+    Fenced code blocks and paragraphs are never split unless a single block exceeds
+    the budget on its own, and a heading always starts the chunk holding its first
+    paragraph instead of dangling at the end of the previous one.
+
+    Args:
+        document: Parsed markdown page
+        chunk_size: Target chunk size in characters, converted to a token budget when max_tokens is not given
+        max_tokens: Token budget per chunk
+        overlap_tokens: Tokens of trailing blocks to repeat at the start of the next chunk
+            (default: CHUNK_OVERLAP_TOKENS, or 0)
+
+    Returns:
+        List of (start, end, section info) tuples, where section info has the keys of
+        extract_section_info (headers, char_count, word_count) plus heading_path (titles of
+        the section the chunk starts in and its ancestors) and section_index (-1 before the
+        first heading)
+    """
+    if max_tokens is None:
+        max_tokens = max(1, chunk_size // CHARS_PER_TOKEN)
+    if overlap_tokens is None:
+        overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    text = document.text
+    chunks = []
+    # (start, end, tokens, block, section) of the pieces in the current chunk; block is None for part of a split block
+    current: List[Tuple[int, int, int, Optional[MarkdownBlock], int]] = []
+    current_tokens = 0
+    repeated = 0  # Number of leading pieces repeated from the previous chunk as overlap
+
+    def is_heading(piece) -> bool:
+        return piece[3] is not None and piece[3].kind == BLOCK_HEADING
+
+    def close_chunk(pieces):
+        headers = [f"{'#' * piece[3].level} {piece[3].title}" for piece in pieces if is_heading(piece)]
+        word_count = sum(piece[3].word_count if piece[3] is not None else len(text[piece[0]:piece[1]].split())
+                         for piece in pieces)
+        start, end = pieces[0][0], pieces[-1][1]
+        # The chunk belongs to the section of its first new piece (overlap comes from the previous chunk)
+        section = pieces[min(repeated, len(pieces) - 1)][4]
+        chunks.append((start, end, {
+            "headers": '; '.join(headers),
+            "char_count": end - start,
+            "word_count": word_count,
+            "heading_path": document.breadcrumb(section),
+            "section_index": section
+        }))
+
+    for block in document.blocks:
+        tokens = _count_span_tokens(text, block.start, block.end)
+        if tokens <= max_tokens:
+            pieces = [(block.start, block.end, tokens, block, block.section)]
+        else:
+            pieces = [(start, end, piece_tokens, None, block.section)
+                      for start, end, piece_tokens in _split_oversized_block(text, block.start, block.end, tokens, max_tokens)]
+
+        for piece in pieces:
+            piece_tokens = piece[2]
+            if current_tokens + piece_tokens > max_tokens:
+                if all(is_heading(p) for p in current[repeated:]):
+                    # Nothing but headings (or overlap) so far: drop the overlap and keep the
+                    # headings with the block they introduce, even if that runs slightly over budget
+                    current = current[repeated:]
+                    current_tokens = sum(p[2] for p in current)
+                    repeated = 0
+                else:
+                    # Close the chunk, carrying trailing headings over to the next one
+                    carried = []
+                    while len(current) - 1 > repeated and is_heading(current[-1]):
+                        carried.insert(0, current.pop())
+                    close_chunk(current)
+
+                    overlap = []
+                    overlap_total = 0
+                    for p in reversed(current):
+                        if overlap_total + p[2] > overlap_tokens:
+                            break
+                        overlap.insert(0, p)
+                        overlap_total += p[2]
+
+                    carried_tokens = sum(p[2] for p in carried)
+                    if overlap_total + carried_tokens + piece_tokens > max_tokens:
+                        overlap, overlap_total = [], 0
+                    current = overlap + carried
+                    current_tokens = overlap_total + carried_tokens
+                    repeated = len(overlap)
+
+            current.append(piece)
+            current_tokens += piece_tokens
+
+    if len(current) > repeated:
+        close_chunk(current)
+    return chunks
+
+
+def smart_chunk_spans(text: str, chunk_size: int = 5000, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Find chunk boundaries in markdown (see chunk_document).
+
+    Returns:
+        List of (start, end) offsets of the chunks
+    """
+    return [(start, end) for start, end, _ in chunk_document(parse_markdown(text), chunk_size, max_tokens, overlap_tokens)]
+
+
+def smart_chunk_markdown(text: str, chunk_size: int = 5000) -> List[str]:
+    """Split text into chunks, respecting code blocks, headings and paragraphs."""
+    return [text[start:end] for start, end in smart_chunk_spans(text, chunk_size)]
+
+
+def extract_section_info(chunk: str) -> Dict[str, Any]:
+    """
+    Extracts headers and stats from a chunk.
+
+    Args:
+        chunk: Markdown chunk
+
+    Returns:
+        Dictionary with headers and stats
+    """
+    document = parse_markdown(chunk)
+    headers = [f"{'#' * block.level} {block.title}" for block in document.blocks if block.kind == BLOCK_HEADING]
+
+    return {
+        "headers": '; '.join(headers),
+        "char_count": len(chunk),
+        "word_count": document.word_count
+    }
+
+
+def process_page_markdown(markdown: str, chunk_size: int = 5000, extract_code: bool = False) -> Dict[str, Any]:
+    """
+    Parse a page once, then chunk it and extract per-chunk section info and (optionally) its code blocks.
+
+    Args:
+        markdown: Page markdown
+        chunk_size: Maximum size of each chunk in characters
+        extract_code: Whether to extract code blocks as well
+
+    Returns:
+        Dictionary with "chunk_spans" (offsets into markdown), "sections" (section info
+        per chunk), "outline" (one row per heading section, see MarkdownDocument.outline)
+        and "code_blocks" (offsets and language of each code block, see CodeBlock)
+    """
+    document = parse_markdown(markdown)
+    chunks = chunk_document(document, chunk_size)
+    code_blocks = []
+    if extract_code:
+        # Offsets only; the coordinator slices code and context from its own copy of the page
+        code_blocks = [(block.start, block.end, block.code_start, block.code_end, block.language)
+                       for block in document.code_blocks()]
+    return {
+        "chunk_spans": [(start, end) for start, end, _ in chunks],
+        "sections": [info for _, _, info in chunks],
+        "outline": document.outline(),
+        "code_blocks": code_blocks
+    }
+
+
+def deduplicate_code_blocks(pages: List[Tuple[str, List[CodeBlock]]]) -> List[Tuple[str, CodeBlock, List[str]]]:
+    """
+    Drop code blocks that repeat a block already seen on a page of the same site.
+
+    Docs sites repeat the same snippets (install commands, quick starts) on many pages; each
+    distinct block only needs to be summarized and stored once per source.
+
+    Args:
+        pages: (url, code blocks) for each page, in crawl order
+
+    Returns:
+        (url, block, duplicate_urls) for the first occurrence of each distinct block per
+        source, in order, where duplicate_urls lists the other pages it appeared on
+    """
+    first_seen: Dict[Tuple[str, str], Tuple[str, CodeBlock, List[str]]] = {}
+    for url, code_blocks in pages:
+        parsed_url = urlparse(url)
+        source_id = parsed_url.netloc or parsed_url.path
+        for block in code_blocks:
+            key = (source_id, block.code)
+            entry = first_seen.get(key)
+            if entry is None:
+                first_seen[key] = (url, block, [])
+            elif url != entry[0] and url not in entry[2]:
+                entry[2].append(url)
+    return list(first_seen.values())
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        # The coordinator owns the segment; workers must not unlink it on exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _process_shared_pages(shm_name: str, extents: List[Tuple[int, int]], chunk_size: int, extract_code: bool) -> List[Dict[str, Any]]:
+    """Worker entry point: process the pages stored at the given (offset, length) extents of a shared segment."""
+    shm = _attach_shared_memory(shm_name)
+    try:
+        buffer = shm.buf
+        return [
+            process_page_markdown(str(buffer[offset:offset + length], 'utf-8'), chunk_size, extract_code)
+            for offset, length in extents
+        ]
+    finally:
+        del buffer
+        shm.close()
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+class PageProcessor:
+    """Runs page post-processing inline or on a pool of worker processes."""
+
+    # Batches smaller than this are processed inline; the handoff would cost more than it saves
+    MIN_PARALLEL_BYTES = 256 * 1024
+
+    def __init__(self, worker_processes: int = 0):
+        self.worker_processes = max(0, worker_processes)
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> "PageProcessor":
+        """Create a page processor sized from CRAWL_WORKER_PROCESSES (0 = process inline)."""
+        return cls(worker_processes=int(os.getenv("CRAWL_WORKER_PROCESSES", "0")))
+
+    def start(self):
+        """
+        Start the worker processes, if any.
+
+        Workers are forked (on platforms that support it) and warmed up immediately, so they
+        inherit the already-imported modules instead of re-importing the server.
+        """
+        if self.worker_processes == 0:
+            return
+        mp_context = None
+        if "fork" in multiprocessing.get_all_start_methods():
+            # Start the resource tracker first so forked workers share it instead of each
+            # starting their own, which would report the coordinator's segments as leaked
+            resource_tracker.ensure_running()
+            mp_context = multiprocessing.get_context("fork")
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.worker_processes, mp_context=mp_context)
+        self._pool.submit(_warm_up).result()
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def process_pages(self, markdowns: List[str], chunk_size: int = 5000, extract_code: bool = False) -> List[Dict[str, Any]]:
+        """
+        Chunk pages and extract their section info and code blocks.
+
+        Args:
+            markdowns: Markdown of each page
+            chunk_size: Maximum size of each chunk in characters
+            extract_code: Whether to extract code blocks as well
+
+        Returns:
+            One dictionary per page, in order, with "chunks" (the chunk strings), "sections"
+            (section info per chunk), "outline" (section rows, each with its own "content")
+            and "code_blocks" (CodeBlocks, whose context is only sliced out when read)
+        """
+        if not markdowns:
+            return []
+
+        encoded = None
+        if self._pool and len(markdowns) > 1:
+            encoded = [markdown.encode('utf-8') for markdown in markdowns]
+            if sum(len(data) for data in encoded) < self.MIN_PARALLEL_BYTES:
+                encoded = None
+
+        if encoded is None:
+            results = [process_page_markdown(markdown, chunk_size, extract_code) for markdown in markdowns]
+        else:
+            results = self._process_in_workers(encoded, chunk_size, extract_code)
+
+        for markdown, result in zip(markdowns, results):
+            result["chunks"] = [markdown[start:end] for start, end in result.pop("chunk_spans")]
+            for row in result["outline"]:
+                row["content"] = markdown[row.pop("start"):row.pop("end")]
+            result["code_blocks"] = [CodeBlock(markdown, *offsets) for offsets in result["code_blocks"]]
+        return results
+
+    def _process_in_workers(self, encoded: List[bytes], chunk_size: int, extract_code: bool) -> List[Dict[str, Any]]:
+        shm = shared_memory.SharedMemory(create=True, size=sum(len(data) for data in encoded))
+        try:
+            extents = []
+            offset = 0
+            for data in encoded:
+                shm.buf[offset:offset + len(data)] = data
+                extents.append((offset, len(data)))
+                offset += len(data)
+
+            # Split the pages into contiguous groups of roughly equal size, a few per worker
+            group_count = min(len(extents), self.worker_processes * 4)
+            target_bytes = offset / group_count
+            groups: List[List[Tuple[int, int]]] = [[]]
+            group_bytes = 0
+            for extent in extents:
+                if groups[-1] and group_bytes >= target_bytes:
+                    groups.append([])
+                    group_bytes = 0
+                groups[-1].append(extent)
+                group_bytes += extent[1]
+
+            futures = [self._pool.submit(_process_shared_pages, shm.name, group, chunk_size, extract_code) for group in groups]
+            results = []
+            for future in futures:
+                results.extend(future.result())
+            return results
+        finally:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,180 @@
+"""
+Compact serialization and size caps for tool responses.
+
+Tool responses are serialized without indentation with orjson, and
+a response larger than RESPONSE_MAX_CHARS is cut down before it is sent:
+
+- documents (raw markdown of a page, long contents) above RESPONSE_INLINE_DOCUMENT_CHARS
+  are replaced by a link to a crawl4ai://documents/<id> resource with a short preview
+- if the response is still too large, its "results" are split into pages; the first page
+  is returned with a cursor for the get_response_page tool
+
+Documents and pages are kept in memory for RESPONSE_STORE_TTL seconds.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+DOCUMENT_URI_PREFIX = "crawl4ai://documents/"
+PREVIEW_CHARS = 500
+
+
+def dumps(obj: Any) -> str:
+    """Serialize a tool response: compact by default, indented with RESPONSE_FORMAT=pretty."""
+    if os.getenv("RESPONSE_FORMAT", "compact") == "pretty":
+        return json.dumps(obj, indent=2)
+    try:
+        return orjson.dumps(obj).decode('utf-8')
+    except TypeError:
+        # Not natively serializable (e.g. integers above 64 bits); json handles it
+        return json.dumps(obj, separators=(",", ":"))
+
+
+class ResponseStore:
+    """In-memory TTL/LRU store of documents and result pages cut out of tool responses."""
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, value: Any) -> str:
+        key = secrets.token_urlsafe(12)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return key
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+
+RESPONSE_STORE = ResponseStore(
+    ttl=float(os.getenv("RESPONSE_STORE_TTL", "3600")),
+    max_entries=int(os.getenv("RESPONSE_STORE_SIZE", "512"))
+)
+
+
+def store_document(content: str, url: Optional[str] = None) -> Dict[str, Any]:
+    """Keep a document in the response store and describe it with a resource link and a preview."""
+    document_id = RESPONSE_STORE.put({"url": url, "content": content})
+    link = {
+        "resource_uri": f"{DOCUMENT_URI_PREFIX}{document_id}",
+        "content_length": len(content),
+        "preview": content[:PREVIEW_CHARS]
+    }
+    if url:
+        link["url"] = url
+    return link
+
+
+def get_document(uri_or_id: str) -> Optional[Dict[str, Any]]:
+    """Get a stored document ({"url", "content"}) by its resource URI or ID."""
+    document_id = uri_or_id[len(DOCUMENT_URI_PREFIX):] if uri_or_id.startswith(DOCUMENT_URI_PREFIX) else uri_or_id
+    document = RESPONSE_STORE.get(document_id)
+    return document if isinstance(document, dict) and "content" in document else None
+
+
+def _link_documents(results: Any, max_inline: int) -> Tuple[Any, int]:
+    """Replace documents longer than max_inline in a results dict or list by resource links."""
+    linked = 0
+    if isinstance(results, dict):
+        for key, value in results.items():
+            if isinstance(value, str) and len(value) > max_inline:
+                results[key] = store_document(value, url=key)
+                linked += 1
+    elif isinstance(results, list):
+        for item in results:
+            if not isinstance(item, dict):
+                continue
+            for field in ("content", "markdown"):
+                value = item.get(field)
+                if isinstance(value, str) and len(value) > max_inline:
+                    item[field] = store_document(value, url=item.get("url"))
+                    linked += 1
+    return results, linked
+
+
+def _split_pages(results: Any, max_chars: int) -> List[Any]:
+    """Split a results dict or list into pages of roughly max_chars serialized characters."""
+    items = list(results.items()) if isinstance(results, dict) else list(results)
+    pages, page, page_chars = [], [], 0
+    for item in items:
+        item_chars = len(dumps(item))
+        if page and page_chars + item_chars > max_chars:
+            pages.append(page)
+            page, page_chars = [], 0
+        page.append(item)
+        page_chars += item_chars
+    if page:
+        pages.append(page)
+    return [dict(page) for page in pages] if isinstance(results, dict) else pages
+
+
+def _paginate(pages: List[Any], index: int, total: int) -> Dict[str, Any]:
+    pagination = {"page": index + 1, "pages": len(pages), "total_results": total, "next_cursor": None}
+    if index + 1 < len(pages):
+        pagination["next_cursor"] = RESPONSE_STORE.put({"pages": pages, "index": index + 1, "total": total})
+    return pagination
+
+
+def cap_response(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Keep a tool response under RESPONSE_MAX_CHARS (default 200000, 0 disables) by linking
+    large documents and paginating its results.
+
+    Args:
+        response: Parsed tool response
+
+    Returns:
+        The response, modified in place if it was too large
+    """
+    max_chars = int(os.getenv("RESPONSE_MAX_CHARS", "200000"))
+    results = response.get("results")
+    if max_chars <= 0 or not isinstance(results, (dict, list)) or len(dumps(response)) <= max_chars:
+        return response
+
+    max_inline = int(os.getenv("RESPONSE_INLINE_DOCUMENT_CHARS", "20000"))
+    results, linked = _link_documents(results, max_inline)
+    if linked:
+        response["documents_linked"] = linked
+    if len(dumps(response)) <= max_chars or len(results) <= 1:
+        return response
+
+    # Leave room for the rest of the response on the first page
+    page_budget = max(max_chars - len(dumps({**response, "results": []})), max_chars // 4)
+    pages = _split_pages(results, page_budget)
+    response["results"] = pages[0]
+    response["pagination"] = _paginate(pages, 0, len(results))
+    return response
+
+
+def load_page(cursor: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the page of results a cursor points to.
+
+    Returns:
+        Dictionary with results and pagination, or None if the cursor is unknown or expired
+    """
+    state = RESPONSE_STORE.get(cursor)
+    if not isinstance(state, dict) or "pages" not in state:
+        return None
+    pages, index = state["pages"], state["index"]
+    return {"results": pages[index], "pagination": _paginate(pages, index, state["total"])}
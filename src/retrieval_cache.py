@@ -0,0 +1,105 @@
+"""
+Result cache for the retrieval tools (perform_rag_query, search_code_examples).
+
+Agents often repeat a query while iterating; a cache hit skips the query embedding, the
+vector search RPC and reranking. Entries are keyed by the normalized query, the source
+filter, match_count and the search mode, and expire after RETRIEVAL_CACHE_TTL seconds.
+
+Each source has a generation counter that ingestion bumps whenever it writes chunks,
+sections or code examples of that source (a global counter covers unfiltered queries). An
+entry remembers the generations it was computed at and is stale as soon as they move on,
+so new content is visible to the next query. Writes by other processes sharing the
+database are only picked up when entries expire.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+from searxng_client import normalize_query
+
+# Generation counter bumped on every write, for queries without a source filter
+ALL_SOURCES = "*"
+
+# A source filter: none, one source ID or several
+Sources = Union[None, str, Tuple[str, ...]]
+
+
+class RetrievalCache:
+    """TTL/LRU cache of retrieval results invalidated by per-source generation counters."""
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Dict[str, Any]]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def key(kind: str, query: str, source: Sources, match_count: int, mode: Tuple = ()) -> Hashable:
+        """Build the cache key of a retrieval call."""
+        return (kind, normalize_query(query), source or "", match_count, mode)
+
+    def _current_generation(self, source: Sources) -> Any:
+        if isinstance(source, tuple):
+            return tuple(self._generations.get(source_id, 0) for source_id in source)
+        return self._generations.get(source or ALL_SOURCES, 0)
+
+    def generation(self, source: Sources) -> Any:
+        """Current generation of a source (or sources, or all sources); take it before running the query."""
+        with self._lock:
+            return self._current_generation(source)
+
+    def get(self, key: Hashable, source: Sources) -> Optional[Dict[str, Any]]:
+        """Get a cached result, or None if missing, expired or computed before the source's last write."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, generation, value = entry
+            if expires < time.monotonic() or generation != self._current_generation(source):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Dict[str, Any], generation: Any):
+        """Cache a result computed at the given generation (as returned by generation() before the query)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_sources(self, source_ids: Iterable[str]):
+        """Bump the generations of the given sources, making their cached results stale."""
+        source_ids = set(source_ids)
+        if not source_ids:
+            return
+        with self._lock:
+            for source_id in source_ids | {ALL_SOURCES}:
+                self._generations[source_id] = self._generations.get(source_id, 0) + 1
+
+    def invalidate_urls(self, urls: Iterable[str]):
+        """Bump the generations of the sources of the given page URLs."""
+        source_ids = set()
+        for url in urls:
+            parsed_url = urlparse(url)
+            source_ids.add(parsed_url.netloc or parsed_url.path)
+        self.invalidate_sources(source_ids)
+
+
+RETRIEVAL_CACHE = RetrievalCache(
+    ttl=float(os.getenv("RETRIEVAL_CACHE_TTL", "300")),
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+)
@@ -0,0 +1,238 @@
+"""
+Async SearXNG client with connection pooling, response caching and hedged requests.
+
+One client is shared by all search tool calls of the server, so connections to SearXNG
+are kept alive between searches instead of being opened per request, and a search never
+blocks the event loop. Responses are cached for a short TTL keyed by the normalized
+query, engines and limit, and identical searches in flight at the same time share one
+request. With several instances configured (comma-separated SEARXNG_URL) a request that
+has not answered within the hedge delay is raced against the next instance.
+"""
+import asyncio
+import copy
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from metrics import increment, span
+
+CacheKey = Tuple[str, Tuple[str, ...], int, str]
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase a query and collapse whitespace, so trivially different searches share cache entries."""
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def _parse_engines(engines: Optional[str]) -> Tuple[str, ...]:
+    return tuple(sorted({engine.strip().lower() for engine in (engines or "").split(",") if engine.strip()}))
+
+
+class SearxngClient:
+    """Pooled async client for one or more SearXNG instances."""
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        timeout: float = 30.0,
+        user_agent: str = "MCP-Crawl4AI-RAG-Server/1.0",
+        default_engines: str = "",
+        cache_ttl: float = 300.0,
+        cache_size: int = 256,
+        hedge_delay: float = 1.0,
+        fan_out_engines: bool = False
+    ):
+        self.base_urls = [url.rstrip('/') for url in base_urls]
+        self.timeout = timeout
+        self.default_engines = default_engines
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.hedge_delay = hedge_delay
+        self.fan_out_engines = fan_out_engines
+        self._cache: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._in_flight: Dict[CacheKey, asyncio.Future] = {}
+        self._client = httpx.AsyncClient(
+            headers={"User-Agent": user_agent, "Accept": "application/json"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0)
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional["SearxngClient"]:
+        """
+        Create a client from SEARXNG_URL (comma-separated for several instances), SEARXNG_TIMEOUT,
+        SEARXNG_USER_AGENT, SEARXNG_DEFAULT_ENGINES, SEARXNG_CACHE_TTL (seconds, default 300,
+        0 disables), SEARXNG_CACHE_SIZE (default 256), SEARXNG_HEDGE_DELAY (seconds, default 1,
+        0 disables) and SEARXNG_FAN_OUT_ENGINES (default false).
+
+        Returns:
+            The client, or None if SEARXNG_URL is not set
+        """
+        base_urls = [url.strip() for url in os.getenv("SEARXNG_URL", "").split(",") if url.strip()]
+        if not base_urls:
+            return None
+        return cls(
+            base_urls,
+            timeout=float(os.getenv("SEARXNG_TIMEOUT", "30")),
+            user_agent=os.getenv("SEARXNG_USER_AGENT", "MCP-Crawl4AI-RAG-Server/1.0"),
+            default_engines=os.getenv("SEARXNG_DEFAULT_ENGINES", ""),
+            cache_ttl=float(os.getenv("SEARXNG_CACHE_TTL", "300")),
+            cache_size=int(os.getenv("SEARXNG_CACHE_SIZE", "256")),
+            hedge_delay=float(os.getenv("SEARXNG_HEDGE_DELAY", "1.0")),
+            fan_out_engines=os.getenv("SEARXNG_FAN_OUT_ENGINES", "false") == "true"
+        )
+
+    @property
+    def search_endpoint(self) -> str:
+        return f"{self.base_urls[0]}/search"
+
+    async def close(self):
+        await self._client.aclose()
+
+    def _cache_get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return data
+
+    def _cache_put(self, key: CacheKey, data: Dict[str, Any]):
+        if self.cache_ttl <= 0 or self.cache_size <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.cache_ttl, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def search(self, query: str, num_results: int = 6, engines: Optional[str] = None,
+                     categories: str = "general") -> Tuple[Dict[str, Any], bool]:
+        """
+        Search SearXNG.
+
+        Args:
+            query: The search query
+            num_results: Number of results wanted (sent as SearXNG's 'limit')
+            engines: Comma-separated engines; defaults to SEARXNG_DEFAULT_ENGINES
+            categories: SearXNG categories
+
+        Returns:
+            Tuple of (SearXNG JSON response, whether it came from the cache). The response is
+            the caller's own copy, so it can be modified without affecting the cache.
+
+        Raises:
+            httpx.TimeoutException, httpx.ConnectError, httpx.HTTPStatusError or ValueError
+            (invalid JSON) when every instance failed
+        """
+        engine_list = _parse_engines(engines if engines is not None else self.default_engines)
+        key = (normalize_query(query), engine_list, num_results, categories)
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            increment("searxng_cache_hits")
+            return copy.deepcopy(cached), True
+
+        # Identical searches running at the same time share one request
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            try:
+                data = await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() or not in_flight.cancelled():
+                    raise
+                # The call that owned the request was cancelled, not this one: search again
+                return await self.search(query, num_results, engines, categories)
+            increment("searxng_cache_hits")
+            return copy.deepcopy(data), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            with span("searxng"):
+                if self.fan_out_engines and len(engine_list) > 1:
+                    data = await self._fan_out(query, engine_list, num_results, categories)
+                else:
+                    data = await self._hedged_request(self._params(query, engine_list, num_results, categories))
+            self._cache_put(key, data)
+            future.set_result(data)
+            return copy.deepcopy(data), False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise the exception; mark it retrieved in case nobody waited
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    @staticmethod
+    def _params(query: str, engines: Tuple[str, ...], num_results: int, categories: str) -> Dict[str, Any]:
+        params = {"q": query, "format": "json", "categories": categories, "limit": num_results}
+        if engines:
+            params["engines"] = ",".join(engines)
+        return params
+
+    async def _request(self, base_url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self._client.get(f"{base_url}/search", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def _hedged_request(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Request the first instance; if it has not answered within the hedge delay (or failed),
+        also request the next one, and return the first successful response.
+        """
+        pending = set()
+        last_error: Optional[BaseException] = None
+        try:
+            for attempt, base_url in enumerate(self.base_urls):
+                pending.add(asyncio.ensure_future(self._request(base_url, params)))
+                if attempt:
+                    increment("searxng_hedged_requests")
+                is_last = attempt == len(self.base_urls) - 1
+                while pending:
+                    wait_timeout = None if is_last or self.hedge_delay <= 0 else self.hedge_delay
+                    done, pending = await asyncio.wait(pending, timeout=wait_timeout,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break  # Hedge: start the next instance while this one keeps running
+                    for task in done:
+                        if task.exception() is None:
+                            return task.result()
+                        last_error = task.exception()
+                    if not is_last:
+                        break  # Failed: try the next instance right away
+            raise last_error or RuntimeError("No SearXNG instance answered")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fan_out(self, query: str, engines: Tuple[str, ...], num_results: int, categories: str) -> Dict[str, Any]:
+        """Query each engine separately at the same time and interleave their results by rank."""
+        responses = await asyncio.gather(
+            *(self._hedged_request(self._params(query, (engine,), num_results, categories)) for engine in engines),
+            return_exceptions=True
+        )
+        successful = [response for response in responses if not isinstance(response, BaseException)]
+        if not successful:
+            raise responses[0]
+
+        merged, seen = [], set()
+        result_lists = [response.get("results", []) for response in successful]
+        for rank in range(max(len(results) for results in result_lists)):
+            for results in result_lists:
+                if rank < len(results):
+                    url = results[rank].get("url")
+                    if url and url not in seen:
+                        seen.add(url)
+                        merged.append(results[rank])
+        return {"query": query, "results": merged, "number_of_results": len(merged)}
@@ -6,13 +6,21 @@ import concurrent.futures
 from typing import List, Dict, Any, Optional, Tuple
 import json
 from supabase import create_client, Client
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode, urljoin
 import openai
+import hashlib
 import re
 import time
 
+from markdown_parser import scan_code_blocks
+from metrics import increment, propagate, record_usage, span
+from retrieval_cache import RETRIEVAL_CACHE
+from vector_ranking import mmr_select
+
 # Load OpenAI API key for embeddings
 openai.api_key = os.getenv("OPENAI_API_KEY")
+# Optional OpenAI-compatible endpoint (a proxy, a local model server or benchmarks/fake_openai_server.py)
+openai.base_url = os.getenv("OPENAI_BASE_URL") or None
 
 def get_supabase_client() -> Client:
     """
@@ -29,6 +37,7 @@ def get_supabase_client() -> Client:
     
     return create_client(url, key)
 
+@span("embedding")
 def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
     Create embeddings for multiple texts in a single API call.
@@ -51,9 +60,12 @@ def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
                 model="text-embedding-3-small", # Hardcoding embedding model for now, will change this later to be more dynamic
                 input=texts
             )
+            record_usage("embedding", response)
+            increment("embedding_texts", len(texts))
             return [item.embedding for item in response.data]
         except Exception as e:
             if retry < max_retries - 1:
+                increment("embedding_retries")
                 print(f"Error creating batch embeddings (attempt {retry + 1}/{max_retries}): {e}")
                 print(f"Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
@@ -71,6 +83,8 @@ def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
                             model="text-embedding-3-small",
                             input=[text]
                         )
+                        record_usage("embedding", individual_response)
+                        increment("embedding_texts")
                         embeddings.append(individual_response.data[0].embedding)
                         successful_count += 1
                     except Exception as individual_error:
@@ -135,6 +149,7 @@ Please give a short succinct context to situate this chunk within the overall do
             temperature=0.3,
             max_tokens=200
         )
+        record_usage("llm", response)
         
         # Extract the generated context
         context = response.choices[0].message.content.strip()
@@ -164,6 +179,151 @@ def process_chunk_with_context(args):
     url, content, full_document = args
     return generate_contextual_embedding(full_document, content)
 
+# Instructions for document-level contextualization. They are sent before the document so the
+# prompt prefix (instructions + document) is identical for every call about the same document.
+CONTEXTUAL_BATCH_SYSTEM_PROMPT = """You situate chunks of a document within the whole document to improve search retrieval.
+You are given a document and some of its chunks, each with an id. For every chunk, write a short succinct context that situates the chunk within the overall document.
+Answer only with a JSON object of the form {"contexts": [{"id": <chunk id>, "context": "<succinct context>"}]} with one entry per chunk."""
+
+# Upper bound on the chunk text sent in one contextualization call
+CONTEXTUAL_MAX_CHARS_PER_CALL = 40000
+
+
+def _group_chunks_for_context(chunks: List[str], max_chunks: int) -> List[List[int]]:
+    """Group chunk indices into calls of at most max_chunks chunks and CONTEXTUAL_MAX_CHARS_PER_CALL characters."""
+    groups = [[]]
+    group_chars = 0
+    for i, chunk in enumerate(chunks):
+        if groups[-1] and (len(groups[-1]) >= max_chunks or group_chars + len(chunk) > CONTEXTUAL_MAX_CHARS_PER_CALL):
+            groups.append([])
+            group_chars = 0
+        groups[-1].append(i)
+        group_chars += len(chunk)
+    return groups
+
+
+def _request_document_contexts(full_document: str, chunks: List[str], chunk_ids: List[int]) -> Dict[int, str]:
+    """Ask for the contexts of the given chunks of a document in a single structured call."""
+    chunk_list = "\n".join(f'<chunk id="{i}">\n{chunks[i]}\n</chunk>' for i in chunk_ids)
+    prompt = f"""<document>
+{full_document[:25000]}
+</document>
+
+Here are the chunks we want to situate within the whole document:
+{chunk_list}"""
+    
+    response = openai.chat.completions.create(
+        model=os.getenv("MODEL_CHOICE"),
+        messages=[
+            {"role": "system", "content": CONTEXTUAL_BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.3,
+        max_tokens=150 * len(chunk_ids) + 50
+    )
+    record_usage("llm", response)
+    
+    contexts = {}
+    for entry in json.loads(response.choices[0].message.content).get("contexts", []):
+        try:
+            chunk_id = int(entry["id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        context = str(entry.get("context", "")).strip()
+        if chunk_id in chunk_ids and context:
+            contexts[chunk_id] = context
+    return contexts
+
+
+def generate_document_contexts(full_document: str, chunks: List[str], max_chunks_per_call: Optional[int] = None) -> List[Optional[str]]:
+    """
+    Generate situating context for all chunks of one document in a few structured calls.
+    
+    Each call carries the document once followed by a group of its chunks, instead of one
+    call per chunk that repeats the whole document. The first call runs alone so that the
+    provider's prompt cache holds the shared prefix before the remaining calls run in parallel.
+    
+    Args:
+        full_document: The complete document text
+        chunks: The chunks of the document
+        max_chunks_per_call: Maximum chunks per call (default: CONTEXTUAL_CHUNKS_PER_CALL, or 20)
+        
+    Returns:
+        Context for each chunk, or None where no context could be generated
+    """
+    if not chunks:
+        return []
+    if max_chunks_per_call is None:
+        max_chunks_per_call = int(os.getenv("CONTEXTUAL_CHUNKS_PER_CALL", "20"))
+    groups = _group_chunks_for_context(chunks, max(1, max_chunks_per_call))
+    
+    def request(chunk_ids: List[int]) -> Dict[int, str]:
+        try:
+            return _request_document_contexts(full_document, chunks, chunk_ids)
+        except Exception as e:
+            print(f"Error generating contexts for {len(chunk_ids)} chunks: {e}. Using original chunks instead.")
+            return {}
+    
+    contexts = request(groups[0])
+    if len(groups) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(groups) - 1)) as executor:
+            for group_contexts in executor.map(propagate(request), groups[1:]):
+                contexts.update(group_contexts)
+    return [contexts.get(i) for i in range(len(chunks))]
+
+
+@span("contextualize")
+def contextualize_chunks(urls: List[str], contents: List[str], url_to_full_document: Dict[str, str], max_workers: int = 10) -> List[Tuple[str, bool]]:
+    """
+    Prefix chunks with context situating them within their documents.
+    
+    Chunks are grouped by document and each document is contextualized with
+    generate_document_contexts; documents are processed in parallel.
+    
+    Args:
+        urls: URL of each chunk
+        contents: Chunk contents
+        url_to_full_document: Dictionary mapping URLs to their full document content
+        max_workers: Maximum documents processed at once
+        
+    Returns:
+        (contextual text, whether context was added) for each chunk, in order
+    """
+    indices_by_url: Dict[str, List[int]] = {}
+    for i, url in enumerate(urls):
+        indices_by_url.setdefault(url, []).append(i)
+    
+    results = [(content, False) for content in contents]
+    
+    def contextualize(url: str) -> None:
+        indices = indices_by_url[url]
+        contexts = generate_document_contexts(url_to_full_document.get(url, ""), [contents[i] for i in indices])
+        for i, context in zip(indices, contexts):
+            if context:
+                results[i] = (f"{context}\n---\n{contents[i]}", True)
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(propagate(contextualize), indices_by_url))
+    return results
+
+# Values of crawled_pages.embedding_version
+EMBEDDING_VERSION_PLAIN = 0        # Embedding of the chunk text alone
+EMBEDDING_VERSION_CONTEXTUAL = 1   # Embedding of the chunk prefixed with its document context
+
+
+def contextual_embeddings_deferred() -> bool:
+    """
+    Check whether contextual embeddings are generated in the background.
+    
+    With USE_CONTEXTUAL_EMBEDDINGS and CONTEXTUAL_EMBEDDING_MODE=background (the default),
+    chunks are stored with plain embeddings first and contextualize_stored_pages upgrades
+    them later; with CONTEXTUAL_EMBEDDING_MODE=inline they are contextualized before insert.
+    """
+    return (os.getenv("USE_CONTEXTUAL_EMBEDDINGS", "false") == "true"
+            and os.getenv("CONTEXTUAL_EMBEDDING_MODE", "background") == "background")
+
+
 def add_documents_to_supabase(
     client: Client, 
     urls: List[str], 
@@ -171,7 +331,8 @@ def add_documents_to_supabase(
     contents: List[str], 
     metadatas: List[Dict[str, Any]],
     url_to_full_document: Dict[str, str],
-    batch_size: int = 20
+    batch_size: int = 20,
+    defer_contextual: Optional[bool] = None
 ) -> None:
     """
     Add documents to the Supabase crawled_pages table in batches.
@@ -185,6 +346,8 @@ def add_documents_to_supabase(
         metadatas: List of document metadata
         url_to_full_document: Dictionary mapping URLs to their full document content
         batch_size: Size of each batch for insertion
+        defer_contextual: Store plain embeddings now and leave contextual embeddings to
+            contextualize_stored_pages (default: contextual_embeddings_deferred())
     """
     # Get unique URLs to delete existing records
     unique_urls = list(set(urls))
@@ -208,6 +371,14 @@ def add_documents_to_supabase(
     use_contextual_embeddings = os.getenv("USE_CONTEXTUAL_EMBEDDINGS", "false") == "true"
     print(f"\n\nUse contextual embeddings: {use_contextual_embeddings}\n\n")
     
+    if defer_contextual is None:
+        defer_contextual = contextual_embeddings_deferred()
+    
+    # Contextualize whole documents up front, so each document's chunks share a few calls
+    contextualized = None
+    if use_contextual_embeddings and not defer_contextual:
+        contextualized = contextualize_chunks(urls, contents, url_to_full_document)
+    
     # Process in batches to avoid memory issues
     for i in range(0, len(contents), batch_size):
         batch_end = min(i + batch_size, len(contents))
@@ -218,40 +389,13 @@ def add_documents_to_supabase(
         batch_contents = contents[i:batch_end]
         batch_metadatas = metadatas[i:batch_end]
         
-        # Apply contextual embedding to each chunk if MODEL_CHOICE is set
-        if use_contextual_embeddings:
-            # Prepare arguments for parallel processing
-            process_args = []
-            for j, content in enumerate(batch_contents):
-                url = batch_urls[j]
-                full_document = url_to_full_document.get(url, "")
-                process_args.append((url, content, full_document))
-            
-            # Process in parallel using ThreadPoolExecutor
+        # Use the contextual text of each chunk if contextual embeddings are enabled
+        if contextualized is not None:
             contextual_contents = []
-            with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-                # Submit all tasks and collect results
-                future_to_idx = {executor.submit(process_chunk_with_context, arg): idx 
-                                for idx, arg in enumerate(process_args)}
-                
-                # Process results as they complete
-                for future in concurrent.futures.as_completed(future_to_idx):
-                    idx = future_to_idx[future]
-                    try:
-                        result, success = future.result()
-                        contextual_contents.append(result)
-                        if success:
-                            batch_metadatas[idx]["contextual_embedding"] = True
-                    except Exception as e:
-                        print(f"Error processing chunk {idx}: {e}")
-                        # Use original content as fallback
-                        contextual_contents.append(batch_contents[idx])
-            
-            # Sort results back into original order if needed
-            if len(contextual_contents) != len(batch_contents):
-                print(f"Warning: Expected {len(batch_contents)} results but got {len(contextual_contents)}")
-                # Use original contents as fallback
-                contextual_contents = batch_contents
+            for j, (contextual_text, success) in enumerate(contextualized[i:batch_end]):
+                contextual_contents.append(contextual_text)
+                if success:
+                    batch_metadatas[j]["contextual_embedding"] = True
         else:
             # If not using contextual embeddings, use original contents
             contextual_contents = batch_contents
@@ -278,7 +422,8 @@ def add_documents_to_supabase(
                     **batch_metadatas[j]
                 },
                 "source_id": source_id,  # Add source_id field
-                "embedding": batch_embeddings[j]  # Use embedding from contextual content
+                "embedding": batch_embeddings[j],  # Use embedding from contextual content
+                "embedding_version": EMBEDDING_VERSION_CONTEXTUAL if batch_metadatas[j].get("contextual_embedding") else EMBEDDING_VERSION_PLAIN
             }
             
             batch_data.append(data)
@@ -289,11 +434,14 @@ def add_documents_to_supabase(
         
         for retry in range(max_retries):
             try:
-                client.table("crawled_pages").insert(batch_data).execute()
+                with span("insert"):
+                    client.table("crawled_pages").insert(batch_data).execute()
+                increment("rows_inserted", len(batch_data))
                 # Success - break out of retry loop
                 break
             except Exception as e:
                 if retry < max_retries - 1:
+                    increment("insert_retries")
                     print(f"Error inserting batch into Supabase (attempt {retry + 1}/{max_retries}): {e}")
                     print(f"Retrying in {retry_delay} seconds...")
                     time.sleep(retry_delay)
@@ -307,12 +455,226 @@ def add_documents_to_supabase(
                     for record in batch_data:
                         try:
                             client.table("crawled_pages").insert(record).execute()
+                            increment("rows_inserted")
                             successful_inserts += 1
                         except Exception as individual_error:
                             print(f"Failed to insert individual record for URL {record['url']}: {individual_error}")
                     
                     if successful_inserts > 0:
                         print(f"Successfully inserted {successful_inserts}/{len(batch_data)} records individually")
+    
+    # Cached retrieval results of these sources are stale now
+    RETRIEVAL_CACHE.invalidate_urls(unique_urls)
+
+def contextualize_stored_pages(
+    client: Client,
+    urls: List[str],
+    url_to_full_document: Optional[Dict[str, str]] = None,
+    batch_size: int = 20
+) -> Dict[str, int]:
+    """
+    Upgrade stored chunks from plain to contextual embeddings (the second phase of ingestion).
+    
+    Pages are stored with plain embeddings so they are searchable right away; this generates
+    the contextual text of their chunks afterwards and swaps in the contextual embedding.
+    Only rows still at EMBEDDING_VERSION_PLAIN are updated, so rows replaced by a re-crawl
+    in the meantime are left alone.
+    
+    Args:
+        client: Supabase client
+        urls: URLs of the pages to contextualize
+        url_to_full_document: Optional dictionary mapping URLs to their full document content.
+            Pages not in it are reassembled from their stored chunks.
+        batch_size: Number of chunks embedded per request
+        
+    Returns:
+        Dictionary with pages and chunks_updated counts
+    """
+    url_to_full_document = url_to_full_document or {}
+    pages = 0
+    chunks_updated = 0
+    
+    for url in dict.fromkeys(urls):
+        try:
+            rows = client.table("crawled_pages")\
+                .select("id, chunk_number, content, metadata")\
+                .eq("url", url)\
+                .eq("embedding_version", EMBEDDING_VERSION_PLAIN)\
+                .order("chunk_number")\
+                .execute().data or []
+        except Exception as e:
+            print(f"Error fetching chunks to contextualize for {url}: {e}")
+            continue
+        if not rows:
+            continue
+        pages += 1
+        
+        contents = [row["content"] for row in rows]
+        full_document = url_to_full_document.get(url) or "\n\n".join(contents)
+        contexts = generate_document_contexts(full_document, contents)
+        upgraded = [(row, f"{context}\n---\n{row['content']}") for row, context in zip(rows, contexts) if context]
+        
+        for i in range(0, len(upgraded), batch_size):
+            batch = upgraded[i:i + batch_size]
+            embeddings = create_embeddings_batch([contextual_text for _, contextual_text in batch])
+            for (row, contextual_text), embedding in zip(batch, embeddings):
+                if all(v == 0.0 for v in embedding):
+                    continue
+                try:
+                    response = client.table("crawled_pages").update({
+                        "content": contextual_text,
+                        "metadata": {**(row.get("metadata") or {}), "chunk_size": len(contextual_text), "contextual_embedding": True},
+                        "embedding": embedding,
+                        "embedding_version": EMBEDDING_VERSION_CONTEXTUAL
+                    }).eq("id", row["id"]).eq("embedding_version", EMBEDDING_VERSION_PLAIN).execute()
+                    # The update returns the rows it changed: none if the chunk was re-crawled meanwhile
+                    chunks_updated += len(response.data or [])
+                except Exception as e:
+                    print(f"Error updating contextual embedding of {url} chunk {row['chunk_number']}: {e}")
+    
+    if chunks_updated:
+        RETRIEVAL_CACHE.invalidate_urls(urls)
+    return {"pages": pages, "chunks_updated": chunks_updated}
+
+def add_sections_to_supabase(
+    client: Client,
+    urls: List[str],
+    outlines: List[List[Dict[str, Any]]],
+    batch_size: int = 20
+) -> None:
+    """
+    Add the heading sections of crawled pages to the Supabase crawled_sections table.
+    Deletes existing sections for the same URLs before inserting, like add_documents_to_supabase.
+    
+    Args:
+        client: Supabase client
+        urls: List of page URLs
+        outlines: Section rows of each page (the "outline" from PageProcessor.process_pages)
+        batch_size: Size of each batch for insertion
+    """
+    unique_urls = list(set(urls))
+    try:
+        if unique_urls:
+            client.table("crawled_sections").delete().in_("url", unique_urls).execute()
+    except Exception as e:
+        print(f"Error deleting existing sections: {e}")
+    
+    records = []
+    for url, outline in zip(urls, outlines):
+        parsed_url = urlparse(url)
+        source_id = parsed_url.netloc or parsed_url.path
+        for row in outline:
+            records.append({
+                "url": url,
+                "section_index": row["section_index"],
+                "parent_index": row["parent_index"],
+                "last_descendant": row["last_descendant"],
+                "level": row["level"],
+                "title": row["title"],
+                "heading_path": row["heading_path"],
+                "content": row["content"],
+                "source_id": source_id
+            })
+    
+    for i in range(0, len(records), batch_size):
+        batch = records[i:i + batch_size]
+        try:
+            with span("insert"):
+                client.table("crawled_sections").insert(batch).execute()
+            increment("rows_inserted", len(batch))
+        except Exception as e:
+            print(f"Error inserting sections batch {i // batch_size + 1}: {e}")
+    
+    RETRIEVAL_CACHE.invalidate_urls(unique_urls)
+
+@span("section_expansion")
+def expand_results_to_sections(
+    client: Client,
+    results: List[Dict[str, Any]],
+    max_chars: int = 8000
+) -> List[Dict[str, Any]]:
+    """
+    Replace matched chunks with the full text of the heading section they belong to (small-to-big retrieval).
+    
+    Chunks are matched at fine granularity, then each hit is expanded to its enclosing
+    section (the section's own text plus its subsections). Hits whose section is already
+    covered by a higher-ranked hit are merged into it. Hits without a section (text before
+    the first heading, or pages stored before sections were recorded) and sections longer
+    than max_chars keep the chunk content.
+    
+    Args:
+        client: Supabase client
+        results: Search results in rank order, with url, chunk_number, content and metadata
+        max_chars: Maximum length of an expanded section
+        
+    Returns:
+        Search results in rank order. Expanded results have "expanded_to_section" set and
+        "matched_chunks" listing the chunk numbers they cover.
+    """
+    # Sections to look up, per URL
+    wanted: Dict[str, set] = {}
+    for result in results:
+        section_index = (result.get("metadata") or {}).get("section_index", -1)
+        if section_index is not None and section_index >= 0:
+            wanted.setdefault(result["url"], set()).add(section_index)
+    
+    # (url, section_index) -> (last_descendant, heading_path, section text)
+    sections: Dict[Tuple[str, int], Tuple[int, List[str], str]] = {}
+    for url, indexes in wanted.items():
+        try:
+            heads = client.table("crawled_sections")\
+                .select("section_index, last_descendant, heading_path")\
+                .eq("url", url)\
+                .in_("section_index", sorted(indexes))\
+                .execute().data or []
+            if not heads:
+                continue
+            first = min(head["section_index"] for head in heads)
+            last = max(head["last_descendant"] for head in heads)
+            rows = client.table("crawled_sections")\
+                .select("section_index, content")\
+                .eq("url", url)\
+                .gte("section_index", first)\
+                .lte("section_index", last)\
+                .order("section_index")\
+                .execute().data or []
+            content_by_index = {row["section_index"]: row["content"] for row in rows}
+            for head in heads:
+                parts = [content_by_index.get(i, "") for i in range(head["section_index"], head["last_descendant"] + 1)]
+                sections[(url, head["section_index"])] = (
+                    head["last_descendant"], head["heading_path"] or [], "\n\n".join(part for part in parts if part)
+                )
+        except Exception as e:
+            print(f"Error fetching sections for {url}: {e}")
+    
+    expanded = []
+    covered: Dict[str, List[Tuple[int, int, Dict[str, Any]]]] = {}  # url -> (first, last, result) of expanded sections
+    for result in results:
+        url = result.get("url", "")
+        section_index = (result.get("metadata") or {}).get("section_index", -1)
+        section = sections.get((url, section_index))
+        
+        # Merge into a higher-ranked result whose section already contains this chunk
+        container = next((owner for first, last, owner in covered.get(url, [])
+                          if section_index is not None and first <= section_index <= last), None)
+        if container is not None:
+            container["matched_chunks"].append(result.get("chunk_number"))
+            continue
+        
+        if section is None or len(section[2]) > max_chars:
+            expanded.append(result)
+            continue
+        
+        last_descendant, heading_path, content = section
+        result = dict(result)
+        result["content"] = content
+        result["heading_path"] = heading_path
+        result["expanded_to_section"] = True
+        result["matched_chunks"] = [result.get("chunk_number")]
+        covered.setdefault(url, []).append((section_index, last_descendant, result))
+        expanded.append(result)
+    
+    return expanded
 
 def search_documents(
     client: Client,
@@ -379,7 +741,9 @@ def search_documents(
         # Debug log the RPC parameters
         print(f"[DEBUG] RPC params keys: {params.keys()}")
         
-        result = client.rpc('match_crawled_pages', params).execute()
+        with span("vector_search"):
+            result = client.rpc('match_crawled_pages', params).execute()
+        increment("rows_returned", len(result.data or []))
         
         if timeout_event.is_set():
             raise TimeoutError("Vector search timed out")
@@ -426,6 +790,190 @@ def search_documents(
         timer.cancel()
 
 
+def search_documents_in_sources(
+    client: Client,
+    query: str,
+    source_ids: List[str],
+    match_count: int = 10,
+    per_source_limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Search the chunks of several sources with one embedding and one RPC call.
+    
+    Args:
+        client: Supabase client
+        query: Query text
+        source_ids: Source IDs to search
+        match_count: Maximum number of results in total
+        per_source_limit: Optional maximum number of results per source
+        
+    Returns:
+        List of matching documents from all sources, best first
+    """
+    if not source_ids:
+        return []
+    
+    query_embedding = create_embedding(query)
+    if not query_embedding or all(v == 0.0 for v in query_embedding):
+        print("[ERROR] Failed to create valid embedding")
+        return []
+    
+    params = {
+        'query_embedding': query_embedding,
+        'source_filters': list(dict.fromkeys(source_ids)),
+        'match_count': match_count
+    }
+    if per_source_limit:
+        params['per_source_limit'] = per_source_limit
+    
+    try:
+        with span("vector_search"):
+            result = client.rpc('match_crawled_pages_multi_source', params).execute()
+    except Exception as e:
+        print(f"[ERROR] Error searching documents in sources {source_ids}: {e}")
+        return []
+    
+    rows = result.data or []
+    increment("rows_returned", len(rows))
+    return rows
+
+
+def mmr_settings() -> Tuple[int, float, Optional[float]]:
+    """
+    Read the diversification settings: MMR_CANDIDATES (candidate pool size, default 100),
+    MMR_LAMBDA (relevance vs. diversity, default 0.5) and MMR_DUPLICATE_THRESHOLD (similarity
+    above which a candidate is dropped as a near-duplicate, default 0.97, empty disables).
+    """
+    duplicate_threshold = os.getenv("MMR_DUPLICATE_THRESHOLD", "0.97")
+    return (
+        int(os.getenv("MMR_CANDIDATES", "100")),
+        float(os.getenv("MMR_LAMBDA", "0.5")),
+        float(duplicate_threshold) if duplicate_threshold else None
+    )
+
+
+def diversify_candidates(query_embedding: List[float], candidates: List[Dict[str, Any]], match_count: int,
+                         per_source_limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Pick a relevant but diverse top match_count of candidate rows by maximal marginal relevance.
+    
+    Args:
+        query_embedding: Embedding of the query
+        candidates: Rows from a *_candidates RPC, with their 'embedding'
+        match_count: Number of rows to return
+        per_source_limit: Optional maximum number of rows per source_id, applied while selecting
+        
+    Returns:
+        The selected rows (without their embeddings), in selection order
+    """
+    rows, embeddings = [], []
+    for row in candidates:
+        embedding = row.pop('embedding', None)
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        if embedding:
+            rows.append(row)
+            embeddings.append(embedding)
+    if not rows:
+        return []
+    
+    _, lambda_mult, duplicate_threshold = mmr_settings()
+    with span("mmr"):
+        selected = mmr_select(query_embedding, embeddings, match_count, lambda_mult, duplicate_threshold,
+                              groups=[row.get('source_id') for row in rows], per_group_limit=per_source_limit)
+    increment("mmr_candidates_dropped", len(rows) - len(selected))
+    return [rows[i] for i in selected]
+
+
+def search_documents_diverse(
+    client: Client,
+    query: str,
+    match_count: int = 10,
+    source_ids: Optional[List[str]] = None,
+    per_source_limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Search for documents and diversify the results by maximal marginal relevance, so
+    near-identical chunks (versioned or mirrored pages) do not take up several of the
+    match_count slots.
+    
+    Args:
+        client: Supabase client
+        query: Query text
+        match_count: Maximum number of results to return
+        source_ids: Optional source IDs to search (all sources if not given)
+        per_source_limit: Optional maximum number of results per source
+        
+    Returns:
+        List of matching documents, in selection order
+    """
+    query_embedding = create_embedding(query)
+    if not query_embedding or all(v == 0.0 for v in query_embedding):
+        print("[ERROR] Failed to create valid embedding")
+        return []
+    
+    candidate_count, _, _ = mmr_settings()
+    params = {'query_embedding': query_embedding, 'match_count': max(candidate_count, match_count)}
+    if source_ids:
+        params['source_filters'] = list(dict.fromkeys(source_ids))
+    try:
+        with span("vector_search"):
+            result = client.rpc('match_crawled_pages_candidates', params).execute()
+    except Exception as e:
+        print(f"[ERROR] Error searching documents for diversification: {e}")
+        return []
+    
+    increment("rows_returned", len(result.data or []))
+    return diversify_candidates(query_embedding, result.data or [], match_count, per_source_limit)
+
+
+def search_documents_by_url(
+    client: Client,
+    query: str,
+    urls: List[str],
+    match_count_per_url: int = 5
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Search the chunks of a set of pages with one embedding and one RPC call.
+    
+    Args:
+        client: Supabase client
+        query: Query text
+        urls: URLs of the pages to search
+        match_count_per_url: Maximum number of results per URL
+        
+    Returns:
+        Dictionary mapping each URL with matches to its results, best first
+    """
+    if not urls:
+        return {}
+    
+    query_embedding = create_embedding(query)
+    if not query_embedding or all(v == 0.0 for v in query_embedding):
+        print("[ERROR] Failed to create valid embedding")
+        return {}
+    
+    try:
+        with span("vector_search"):
+            result = client.rpc('match_crawled_pages_by_url', {
+                'query_embedding': query_embedding,
+                'url_filter': list(dict.fromkeys(urls)),
+                'match_count_per_url': match_count_per_url
+            }).execute()
+    except Exception as e:
+        print(f"[ERROR] Error searching documents by URL: {e}")
+        return {}
+    
+    rows = result.data or []
+    increment("rows_returned", len(rows))
+    results_by_url: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        results_by_url.setdefault(row['url'], []).append(row)
+    for url_results in results_by_url.values():
+        url_results.sort(key=lambda row: row.get('similarity', 0), reverse=True)
+    return results_by_url
+
+
 def extract_code_blocks(markdown_content: str, min_length: int = 1000) -> List[Dict[str, Any]]:
     """
     Extract code blocks from markdown content along with context.
@@ -437,75 +985,21 @@ def extract_code_blocks(markdown_content: str, min_length: int = 1000) -> List[D
     Returns:
         List of dictionaries containing code blocks and their context
     """
-    code_blocks = []
-    
-    # Skip if content starts with triple backticks (edge case for files wrapped in backticks)
-    content = markdown_content.strip()
-    start_offset = 0
-    if content.startswith('```'):
-        # Skip the first triple backticks
-        start_offset = 3
-        print("Skipping initial triple backticks")
-    
-    # Find all occurrences of triple backticks
-    backtick_positions = []
-    pos = start_offset
-    while True:
-        pos = markdown_content.find('```', pos)
-        if pos == -1:
-            break
-        backtick_positions.append(pos)
-        pos += 3
-    
-    # Process pairs of backticks
-    i = 0
-    while i < len(backtick_positions) - 1:
-        start_pos = backtick_positions[i]
-        end_pos = backtick_positions[i + 1]
-        
-        # Extract the content between backticks
-        code_section = markdown_content[start_pos+3:end_pos]
-        
-        # Check if there's a language specifier on the first line
-        lines = code_section.split('\n', 1)
-        if len(lines) > 1:
-            # Check if first line is a language specifier (no spaces, common language names)
-            first_line = lines[0].strip()
-            if first_line and not ' ' in first_line and len(first_line) < 20:
-                language = first_line
-                code_content = lines[1].strip() if len(lines) > 1 else ""
-            else:
-                language = ""
-                code_content = code_section.strip()
-        else:
-            language = ""
-            code_content = code_section.strip()
-        
-        # Skip if code block is too short
-        if len(code_content) < min_length:
-            i += 2  # Move to next pair
-            continue
-        
-        # Extract context before (1000 chars)
-        context_start = max(0, start_pos - 1000)
-        context_before = markdown_content[context_start:start_pos].strip()
-        
-        # Extract context after (1000 chars)
-        context_end = min(len(markdown_content), end_pos + 3 + 1000)
-        context_after = markdown_content[end_pos + 3:context_end].strip()
-        
-        code_blocks.append({
-            'code': code_content,
-            'language': language,
-            'context_before': context_before,
-            'context_after': context_after,
-            'full_context': f"{context_before}\n\n{code_content}\n\n{context_after}"
-        })
-        
-        # Move to next pair (skip the closing backtick we just processed)
-        i += 2
+    return [block.to_dict() for block in scan_code_blocks(markdown_content, min_length=min_length)]
+
+
+# Summary returned when the LLM call fails
+DEFAULT_CODE_SUMMARY = "Code example for demonstration purposes."
+
+
+def trim_code_example(code: str, context_before: str, context_after: str) -> Tuple[str, str, str]:
+    """
+    Trim a code example and its context to the parts the summary prompt uses.
     
-    return code_blocks
+    Returns:
+        Tuple of (code, context_before, context_after)
+    """
+    return code[:1500], context_before[-500:], context_after[:500]
 
 
 def generate_code_example_summary(code: str, context_before: str, context_after: str) -> str:
@@ -521,18 +1015,19 @@ def generate_code_example_summary(code: str, context_before: str, context_after:
         A summary of what the code example demonstrates
     """
     model_choice = os.getenv("MODEL_CHOICE")
+    code, context_before, context_after = trim_code_example(code, context_before, context_after)
     
     # Create the prompt
     prompt = f"""<context_before>
-{context_before[-500:] if len(context_before) > 500 else context_before}
+{context_before}
 </context_before>
 
 <code_example>
-{code[:1500] if len(code) > 1500 else code}
+{code}
 </code_example>
 
 <context_after>
-{context_after[:500] if len(context_after) > 500 else context_after}
+{context_after}
 </context_after>
 
 Based on the code example and its surrounding context, provide a concise summary (2-3 sentences) that describes what this code example demonstrates and its purpose. Focus on the practical application and key concepts illustrated.
@@ -548,12 +1043,13 @@ Based on the code example and its surrounding context, provide a concise summary
             temperature=0.3,
             max_tokens=100
         )
+        record_usage("llm", response)
         
         return response.choices[0].message.content.strip()
     
     except Exception as e:
         print(f"Error generating code example summary: {e}")
-        return "Code example for demonstration purposes."
+        return DEFAULT_CODE_SUMMARY
 
 
 def add_code_examples_to_supabase(
@@ -638,11 +1134,14 @@ def add_code_examples_to_supabase(
         
         for retry in range(max_retries):
             try:
-                client.table('code_examples').insert(batch_data).execute()
+                with span("insert"):
+                    client.table('code_examples').insert(batch_data).execute()
+                increment("rows_inserted", len(batch_data))
                 # Success - break out of retry loop
                 break
             except Exception as e:
                 if retry < max_retries - 1:
+                    increment("insert_retries")
                     print(f"Error inserting batch into Supabase (attempt {retry + 1}/{max_retries}): {e}")
                     print(f"Retrying in {retry_delay} seconds...")
                     time.sleep(retry_delay)
@@ -656,6 +1155,7 @@ def add_code_examples_to_supabase(
                     for record in batch_data:
                         try:
                             client.table('code_examples').insert(record).execute()
+                            increment("rows_inserted")
                             successful_inserts += 1
                         except Exception as individual_error:
                             print(f"Failed to insert individual record for URL {record['url']}: {individual_error}")
@@ -663,6 +1163,8 @@ def add_code_examples_to_supabase(
                     if successful_inserts > 0:
                         print(f"Successfully inserted {successful_inserts}/{len(batch_data)} records individually")
         print(f"Inserted batch {i//batch_size + 1} of {(total_items + batch_size - 1)//batch_size} code examples")
+    
+    RETRIEVAL_CACHE.invalidate_urls(unique_urls)
 
 
 def update_source_info(client: Client, source_id: str, summary: str, word_count: int):
@@ -698,6 +1200,7 @@ def update_source_info(client: Client, source_id: str, summary: str, word_count:
         print(f"Error updating source {source_id}: {e}")
 
 
+@span("source_summary")
 def extract_source_summary(source_id: str, content: str, max_length: int = 500) -> str:
     """
     Extract a summary for a source from its content using an LLM.
@@ -743,6 +1246,7 @@ The above content is from the documentation for '{source_id}'. Please provide a
             temperature=0.3,
             max_tokens=150
         )
+        record_usage("llm", response)
         
         # Extract the generated summary
         summary = response.choices[0].message.content.strip()
@@ -822,7 +1326,9 @@ def search_code_examples(
             params['source_filter'] = source_id  # Correct parameter name from SQL function
             print(f"[DEBUG] Using source_filter parameter: '{source_id}'")
         
-        result = client.rpc('match_code_examples', params).execute()
+        with span("vector_search"):
+            result = client.rpc('match_code_examples', params).execute()
+        increment("rows_returned", len(result.data or []))
         
         if timeout_event.is_set():
             raise TimeoutError("Code search timed out")
@@ -862,4 +1368,265 @@ def search_code_examples(
         return []
     finally:
         # Cancel the timer
-        timer.cancel()
\ No newline at end of file
+        timer.cancel()
+
+
+def search_code_examples_diverse(
+    client: Client,
+    query: str,
+    match_count: int = 10,
+    source_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Search for code examples and diversify the results by maximal marginal relevance.
+    
+    Args:
+        client: Supabase client
+        query: Query text
+        match_count: Maximum number of results to return
+        source_id: Optional source ID to filter results
+        
+    Returns:
+        List of matching code examples, in selection order
+    """
+    # Same descriptive query as search_code_examples, to match the code + summary embeddings
+    enhanced_query = f"Code example for {query}\n\nSummary: Example code showing {query}"
+    query_embedding = create_embedding(enhanced_query)
+    if not query_embedding or all(v == 0.0 for v in query_embedding):
+        print("[ERROR] Failed to create valid embedding for code search")
+        return []
+    
+    candidate_count, _, _ = mmr_settings()
+    params = {'query_embedding': query_embedding, 'match_count': max(candidate_count, match_count)}
+    if source_id:
+        params['source_filter'] = source_id
+    try:
+        with span("vector_search"):
+            result = client.rpc('match_code_examples_candidates', params).execute()
+    except Exception as e:
+        print(f"[ERROR] Error searching code examples for diversification: {e}")
+        return []
+    
+    increment("rows_returned", len(result.data or []))
+    return diversify_candidates(query_embedding, result.data or [], match_count)
+
+# Query parameters that only carry tracking information and never change page content
+TRACKING_QUERY_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', '_hsenc', '_hsmi', 'ref_src'
+}
+
+INDEX_DOCUMENTS = ('index.html', 'index.htm', 'index.php')
+
+_CANONICAL_LINK_RE = re.compile(r'<link\b[^>]*\brel\s*=\s*["\']?canonical["\'\s>][^>]*>', re.IGNORECASE)
+_HREF_RE = re.compile(r'\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+_SIMHASH_TOKEN_RE = re.compile(r'\w+')
+
+
+def canonicalize_url(url: str, drop_scheme: bool = False) -> str:
+    """
+    Canonicalize a URL so that trivially different spellings of the same page compare equal.
+    
+    Lowercases the scheme and host, drops default ports, fragments and tracking
+    parameters, sorts the remaining query parameters and removes trailing
+    index documents and slashes.
+    
+    Args:
+        url: URL to canonicalize
+        drop_scheme: If True, omit the scheme so http:// and https:// variants share a key
+        
+    Returns:
+        Canonical form of the URL
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+    
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)) else None
+    netloc = f"{host}:{port}" if port else host
+    
+    path = parts.path or '/'
+    for index_document in INDEX_DOCUMENTS:
+        if path.endswith('/' + index_document):
+            path = path[:-len(index_document)]
+            break
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+    
+    query_params = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_QUERY_PARAMS
+    ]
+    query = urlencode(sorted(query_params))
+    
+    if drop_scheme:
+        return urlunsplit(('', netloc, path, query, '')).lstrip('/')
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def extract_canonical_url(html: Optional[str], base_url: str) -> Optional[str]:
+    """
+    Extract the target of a page's <link rel="canonical"> tag.
+    
+    Args:
+        html: Raw HTML of the page
+        base_url: URL the page was fetched from (used to resolve relative hrefs)
+        
+    Returns:
+        Absolute canonical URL, or None if the page does not declare one
+    """
+    if not html:
+        return None
+    
+    # The canonical link lives in <head>, so avoid scanning the whole body
+    head_end = html.find('</head>')
+    head = html[:head_end] if head_end != -1 else html[:50000]
+    
+    link_match = _CANONICAL_LINK_RE.search(head)
+    if not link_match:
+        return None
+    href_match = _HREF_RE.search(link_match.group(0))
+    if not href_match:
+        return None
+    
+    href = next(group for group in href_match.groups() if group is not None).strip()
+    if not href:
+        return None
+    return urljoin(base_url, href)
+
+
+def index_crawl_results(crawl_results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Index crawl results by canonical URL, so requested URLs are matched to their results in O(1).
+    
+    Each result is indexed under its own URL and, if the crawl was redirected, under its
+    redirect target as well. A result's own URL takes precedence over another result's redirect.
+    
+    Args:
+        crawl_results: List of crawl result dictionaries with 'url' and optionally 'redirected_url'
+        
+    Returns:
+        Dictionary mapping canonical URL keys to crawl results (look up with find_crawl_result)
+    """
+    index = {}
+    for doc in crawl_results:
+        index.setdefault(canonicalize_url(doc['url'], drop_scheme=True), doc)
+    for doc in crawl_results:
+        redirected_url = doc.get('redirected_url')
+        if redirected_url:
+            index.setdefault(canonicalize_url(redirected_url, drop_scheme=True), doc)
+    return index
+
+
+def find_crawl_result(index: Dict[str, Dict[str, Any]], url: str) -> Optional[Dict[str, Any]]:
+    """Find the crawl result of a requested URL in an index built by index_crawl_results."""
+    return index.get(canonicalize_url(url, drop_scheme=True))
+
+
+def compute_simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    Compute a 64-bit SimHash fingerprint over word shingles of the text.
+    
+    Pages whose fingerprints differ in only a few bits are near-duplicates.
+    
+    Args:
+        text: Text (usually page markdown) to fingerprint
+        shingle_size: Number of consecutive words per shingle
+        
+    Returns:
+        64-bit fingerprint as an integer
+    """
+    words = _SIMHASH_TOKEN_RE.findall(text.lower())
+    if not words:
+        return 0
+    
+    if len(words) <= shingle_size:
+        shingles = [' '.join(words)]
+    else:
+        shingles = (' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1))
+    
+    # Count byte values per position instead of bits: 8 increments per shingle instead of 64
+    byte_counts = [[0] * 256 for _ in range(8)]
+    total = 0
+    for shingle in shingles:
+        digest = hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+        for position, value in enumerate(digest):
+            byte_counts[position][value] += 1
+        total += 1
+    
+    fingerprint = 0
+    for position, counts in enumerate(byte_counts):
+        for bit in range(8):
+            ones = sum(count for value, count in enumerate(counts) if count and (value >> bit) & 1)
+            if ones * 2 > total:
+                fingerprint |= 1 << (position * 8 + bit)
+    
+    return fingerprint
+
+
+class NearDuplicateDetector:
+    """
+    Detects near-duplicate pages using SimHash fingerprints.
+    
+    Fingerprints are split into max_distance + 1 bands; by the pigeonhole principle two
+    fingerprints within max_distance bits of each other share at least one band exactly,
+    so only pages sharing a band are compared.
+    """
+    
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max(0, max_distance)
+        num_bands = self.max_distance + 1
+        band_width = 64 // num_bands
+        self._bands = [
+            (i * band_width, 64 - i * band_width if i == num_bands - 1 else band_width)
+            for i in range(num_bands)
+        ]
+        self._index: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+    
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        return [(i, (fingerprint >> shift) & ((1 << width) - 1)) for i, (shift, width) in enumerate(self._bands)]
+    
+    def find(self, fingerprint: int) -> Optional[str]:
+        """Get the URL of a remembered page within max_distance bits of the fingerprint, if any."""
+        for key in self._band_keys(fingerprint):
+            for other_fingerprint, other_url in self._index.get(key, ()):
+                if bin(fingerprint ^ other_fingerprint).count('1') <= self.max_distance:
+                    return other_url
+        return None
+    
+    def add(self, url: str, fingerprint: int):
+        """Remember a page by its fingerprint (e.g. one stored before a crawl was resumed)."""
+        for key in self._band_keys(fingerprint):
+            self._index.setdefault(key, []).append((fingerprint, url))
+    
+    def check(self, url: str, text: str) -> Optional[str]:
+        """
+        Check a page against all previously seen pages and remember it if it is new.
+        
+        Args:
+            url: URL of the page
+            text: Page content (markdown)
+            
+        Returns:
+            URL of the earlier page this one duplicates, or None if it is unique
+        """
+        fingerprint = compute_simhash(text)
+        duplicate_of = self.find(fingerprint)
+        if duplicate_of is None:
+            self.add(url, fingerprint)
+        return duplicate_of
+
+
+def create_near_duplicate_detector() -> Optional[NearDuplicateDetector]:
+    """
+    Create a near-duplicate detector configured from environment variables.
+    
+    Returns:
+        NearDuplicateDetector, or None if near-duplicate detection is disabled
+    """
+    if os.getenv("USE_NEAR_DUPLICATE_DETECTION", "true") != "true":
+        return None
+    return NearDuplicateDetector(int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3")))
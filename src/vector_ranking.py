@@ -0,0 +1,118 @@
+"""
+In-memory vector ranking with NumPy.
+
+Used where the candidates are already in hand (chunks of pages crawled seconds ago) and a
+round-trip to the vector database would only add latency.
+"""
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_rows(vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    """Stack vectors into a float32 matrix of unit-length rows (zero vectors stay zero)."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_similarities(query: Sequence[float], vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    """Cosine similarity of the query to each vector."""
+    if len(vectors) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return normalize_rows(vectors) @ normalize_rows(query)[0]
+
+
+def top_k_per_group(scores: np.ndarray, groups: Sequence[Hashable], k: int) -> Dict[Hashable, List[Tuple[int, float]]]:
+    """
+    Select the k best-scoring items of each group.
+
+    Args:
+        scores: Score of each item
+        groups: Group of each item (e.g. the URL a chunk belongs to)
+        k: Maximum items per group
+
+    Returns:
+        Dictionary mapping each group to its (item index, score) pairs, best first
+    """
+    if k <= 0:
+        return {}
+    indices_by_group: Dict[Hashable, List[int]] = {}
+    for i, group in enumerate(groups):
+        indices_by_group.setdefault(group, []).append(i)
+
+    selected = {}
+    for group, indices in indices_by_group.items():
+        group_scores = scores[indices]
+        if len(indices) > k:
+            best = np.argpartition(-group_scores, k - 1)[:k]
+        else:
+            best = np.arange(len(indices))
+        best = best[np.argsort(-group_scores[best], kind="stable")]
+        selected[group] = [(indices[j], float(group_scores[j])) for j in best]
+    return selected
+
+
+def mmr_select(query: Sequence[float], candidates: Sequence[Sequence[float]], k: int, lambda_mult: float = 0.5,
+               duplicate_threshold: Optional[float] = None, groups: Optional[Sequence[Hashable]] = None,
+               per_group_limit: Optional[int] = None) -> List[int]:
+    """
+    Select a relevant but diverse subset of candidates by maximal marginal relevance.
+
+    Each step picks the candidate maximizing
+    lambda_mult * sim(query, c) - (1 - lambda_mult) * max(sim(c, s) for selected s).
+    The highest similarity of each candidate to the selection is updated with one
+    matrix-vector product per step, so selecting k of n d-dimensional candidates costs
+    O(k * n * d) without building the n x n similarity matrix.
+
+    Args:
+        query: Query embedding
+        candidates: Candidate embeddings, usually in retrieval order
+        k: Number of candidates to select
+        lambda_mult: Trade-off between relevance (1.0) and diversity (0.0)
+        duplicate_threshold: Optional similarity above which a candidate counts as a duplicate
+            of a selected one and is never selected
+        groups: Optional group (e.g. source) of each candidate, for per_group_limit
+        per_group_limit: Optional maximum number of selected candidates per group; a full
+            group's other candidates are skipped, so the selection still fills k if it can
+
+    Returns:
+        Indices of the selected candidates, in selection order
+    """
+    if k <= 0 or len(candidates) == 0:
+        return []
+    matrix = normalize_rows(candidates)
+    relevance = matrix @ normalize_rows(query)[0]
+    max_similarity = np.full(len(matrix), -np.inf, dtype=np.float32)
+    available = np.ones(len(matrix), dtype=bool)
+    group_index = None
+    if groups is not None and per_group_limit:
+        group_codes: Dict[Hashable, int] = {}
+        group_index = np.array([group_codes.setdefault(group, len(group_codes)) for group in groups])
+        group_counts = np.zeros(len(group_codes), dtype=int)
+
+    selected = []
+    for _ in range(min(k, len(matrix))):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not available[best]:
+            break
+        selected.append(best)
+        available[best] = False
+        similarity = matrix @ matrix[best]
+        np.maximum(max_similarity, similarity, out=max_similarity)
+        if duplicate_threshold is not None:
+            available &= similarity < duplicate_threshold
+        if group_index is not None:
+            group = group_index[best]
+            group_counts[group] += 1
+            if group_counts[group] >= per_group_limit:
+                available &= group_index != group
+    return selected